@@ -2,22 +2,31 @@ import streamlit as st
 import pandas as pd
 import matplotlib.pyplot as plt
 from dotenv import load_dotenv
-from src.models.llms import load_llm, create_agent_from_csv
+from src.models.llms import load_llm, agent_pool, first_token_latency, stream_agent
+from src.models.router import model_router
+from src.executor import code_executor
 from src.utils import (
     add_chart_card,
     init_db,
     get_all_datasets,
     get_dataset,
-    safe_read_csv,
+    get_dataset_key,
+    load_dataset,
+    load_sample,
     create_chat_session,
     get_sessions_by_dataset,
+    get_approx_distinct,
     add_chat_message,
     get_chat_messages,
     execute_plt_code,
     delete_chat_message,
     delete_chat_session,
-    rename_chat_session
+    rename_chat_session,
+    render_agent_stream
 )
+from src.sampling import sample_caption
+from src.profiling import distinct_count
+from src.prompt_context import fit_lines
 
 st.set_page_config(page_title="🧠 Delight-GPT", layout="wide")
 st.title("🧠 Delight-GPT")
@@ -35,7 +44,7 @@ with col3:
 load_dotenv()
 init_db()
 
-def smart_patch_code(code: str, df: pd.DataFrame, max_categories=10) -> str:
+def smart_patch_code(code: str, df: pd.DataFrame, max_categories=10, approx_distinct=None) -> str:
     import re
     patched_code = code
 
@@ -51,7 +60,7 @@ def smart_patch_code(code: str, df: pd.DataFrame, max_categories=10) -> str:
 
     cat_cols = df.select_dtypes(include=['object', 'category']).columns
     for col in cat_cols:
-        if col in patched_code and df[col].nunique() > max_categories:
+        if col in patched_code and distinct_count(df, col, approx_distinct) > max_categories:
             patched_code = (
                 f"top_cats = df['{col}'].value_counts().nlargest({max_categories}).index\n"
                 f"df = df[df['{col}'].isin(top_cats)]\n"
@@ -72,7 +81,9 @@ def smart_patch_code(code: str, df: pd.DataFrame, max_categories=10) -> str:
 
     return patched_code
 
-def enhance_prompt(prompt: str, df: pd.DataFrame) -> str:
+SUGGESTION_TOKENS = 300
+
+def enhance_prompt(prompt: str, df: pd.DataFrame, approx_distinct=None) -> str:
     prompt = prompt.strip()
     suggestions = []
 
@@ -83,7 +94,7 @@ def enhance_prompt(prompt: str, df: pd.DataFrame) -> str:
     for col in date_cols:
         suggestions.append(f"Group by `{col}` (or extract year) to compare over time.")
     for col in cat_cols:
-        if df[col].nunique() > 15:
+        if distinct_count(df, col, approx_distinct) > 15:
             suggestions.append(f"Limit the number of unique values in `{col}` to top 10.")
     for col in num_cols:
         if df[col].max() > 1e6:
@@ -91,10 +102,11 @@ def enhance_prompt(prompt: str, df: pd.DataFrame) -> str:
     if "scatter" in prompt.lower() and len(df) > 1000:
         suggestions.append("Use `alpha=0.5` for scatter plots to reduce overplotting.")
 
-    suggestions.append("Rotate x-axis labels for readability.")
-    suggestions.append("Apply `plt.tight_layout()` to prevent label cut-off.")
+    general = ["Rotate x-axis labels for readability.", "Apply `plt.tight_layout()` to prevent label cut-off."]
 
-    return prompt + "\n\n**Suggestions:** " + " ".join(suggestions)
+    # Gợi ý theo từng cột rất dài với dataset rộng → cắt theo ngân sách token, gợi ý chung luôn giữ
+    specific = fit_lines(suggestions, SUGGESTION_TOKENS, overflow="(+{n} similar suggestions)").replace("\n", " ")
+    return prompt + "\n\n**Suggestions:** " + " ".join([specific] + general if specific else general)
 
 # Load available datasets
 datasets = get_all_datasets()
@@ -107,14 +119,18 @@ dataset_options = {f"{d[0]} - {d[1]}": d[0] for d in datasets}
 selected = st.selectbox("Select dataset to analyze:", list(dataset_options.keys()))
 dataset_id = dataset_options[selected]
 dataset = get_dataset(dataset_id)
-file_path = dataset[2]
 num_rows, num_cols = dataset[3], dataset[4]
 
 st.markdown(f"**\U0001f4ca Dataset Info:** `{dataset[1]}` — {num_rows} rows × {num_cols} columns")
 
 try:
-    df = safe_read_csv(file_path)
+    df = load_dataset(dataset_id)
     st.session_state.df = df
+    # Dataset lớn: kiểm tra số nhóm bằng ước lượng HLL lưu lúc upload thay vì nunique (sai số ~1.6%)
+    approx_distinct = get_approx_distinct(dataset_id)
+    # Sample cho biểu đồ được nạp sẵn vào worker vẽ trong lúc người dùng còn gõ câu hỏi
+    plot_df, sample_info = load_sample(dataset_id)
+    plot_key = code_executor.preload(plot_df)
 except Exception as e:
     st.error(f"❌ Error loading CSV: {e}")
     st.stop()
@@ -173,18 +189,23 @@ if prompt:
 
     with st.chat_message("assistant"):
         try:
-            agent = create_agent_from_csv("gpt-3.5-turbo", file_path, return_steps=True)
-            prompt_to_send = enhance_prompt(prompt, df)
-            response = agent(prompt_to_send)
+            prompt_to_send = enhance_prompt(prompt, df, approx_distinct)
+            # Agent lấy từ pool: dùng lại frame đã load và LLM client thay vì đọc lại CSV;
+            # model là model đang nhanh nhất cho chat, lỗi/độ trễ được ghi lại cho lần chọn sau
+            with model_router.track("chat_agent") as model_name, \
+                    agent_pool.checkout(get_dataset_key(dataset_id), df, model_name, return_steps=True) as agent:
+                # Token và bước của agent hiện ra ngay khi tới; chỉ lưu câu trả lời cuối
+                response = render_agent_stream(stream_agent(agent, prompt_to_send))
             steps = response.get("intermediate_steps", [])
             action_code = steps[-1][0].tool_input["query"] if steps else ""
-            st.markdown(response["output"])
             add_chat_message(session_id, "assistant", response["output"])
             if "plt" in action_code:
-                patched_code = smart_patch_code(action_code, df)
-                fig = execute_plt_code(patched_code, df)
-                if fig:
-                    st.pyplot(fig)
+                patched_code = smart_patch_code(action_code, df, approx_distinct=approx_distinct)
+                chart = execute_plt_code(patched_code, plot_df, frame_key=plot_key)
+                if chart:
+                    st.image(chart)
+                    if sample_info["sampled"]:
+                        st.caption(sample_caption(sample_info))
                 st.code(patched_code, language="python")
                 add_chart_card(dataset_id, prompt, response["output"], patched_code)
         except Exception as e:
@@ -192,4 +213,8 @@ if prompt:
 
 
 with st.sidebar:
-    st.page_link("pages/📖_About_Project.py", label="About Project", icon="📘")
\ No newline at end of file
+    st.page_link("pages/📖_About_Project.py", label="About Project", icon="📘")
+    latency = first_token_latency.summary()
+    if latency["count"]:
+        st.caption(f"⏱️ First token: p50 {latency['p50']:.1f}s, p95 {latency['p95']:.1f}s "
+                   f"({latency['count']} answers since start)")
@@ -0,0 +1,73 @@
+"""So sánh `fix_numeric_strings` (suy luận định dạng + chuỗi vector hoá) với bản cũ.
+
+Chạy từ thư mục gốc của repo:
+
+    python -m benchmarks.bench_numeric_strings [--rows N] [--repeat R]
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.cleaning import fix_numeric_strings
+
+EU_SEPARATORS = str.maketrans(",.", ".,")
+
+
+def fix_numeric_strings_old(df):
+    """Bản gốc trong src/cleaning.py (giữ lại làm baseline)."""
+    for col in df.select_dtypes(include='object').columns:
+        if df[col].dropna().apply(lambda x: isinstance(x, str)).all():
+            try:
+                df[col] = df[col].str.replace(',', '', regex=False)
+                df[col] = pd.to_numeric(df[col], errors='coerce')
+            except Exception as e:
+                print(f"Failed to clean column {col}: {e}")
+    return df
+
+
+def make_frame(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    amounts = rng.lognormal(7, 2, rows).round(2)
+    text = lambda values: pd.Series(values, dtype=object)
+    return pd.DataFrame({
+        'plain': text([f"{v:,.0f}" for v in amounts]),
+        'usd': text([f"${v:,.2f}" if v < 5000 else f"(${v:,.2f})" for v in amounts]),
+        'eur': text([f"{v:,.2f} €".translate(EU_SEPARATORS) for v in amounts]),
+        'percent': text([f"{v:.1f}%" for v in rng.uniform(0, 100, rows)]),
+        'label': text(rng.choice(["alpha", "beta", "gamma"], rows)),
+    })
+
+
+def best_of(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=500_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    df = make_frame(args.rows)
+    old_time, old = best_of(lambda: fix_numeric_strings_old(df.copy()), args.repeat)
+    new_time, (new, report) = best_of(lambda: fix_numeric_strings(df), args.repeat)
+
+    print(f"{args.rows:,} rows × {df.shape[1]} columns")
+    print(f"old: {old_time * 1000:>9.1f}ms   new: {new_time * 1000:>9.1f}ms   speedup: {old_time / new_time:.1f}x")
+    print(f"\n{'column':<10} {'old parsed':>11} {'new parsed':>11} {'format':>8}")
+    for col in df.columns:
+        old_rate = old[col].notna().mean() if pd.api.types.is_numeric_dtype(old[col]) else 0.0
+        new_rate = report[col]['success_rate'] if col in report else 0.0
+        seps = f"{report[col]['decimal']} {report[col]['thousands']}" if col in report else "text"
+        print(f"{col:<10} {old_rate:>10.1%} {new_rate:>10.1%} {seps:>8}")
+
+
+if __name__ == "__main__":
+    main()
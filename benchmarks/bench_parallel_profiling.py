@@ -0,0 +1,74 @@
+"""Đo `profile_frame_parallel` theo số cột và số worker trên frame tổng hợp.
+
+Chạy từ thư mục gốc của repo:
+
+    python -m benchmarks.bench_parallel_profiling [--rows N] [--columns 50 100 200 400] [--workers 1 2 4 8]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.loader import build_columnar_copy
+from src.profiling import profile_frame, profile_frame_parallel
+
+
+def make_frame(n_rows, n_cols, seed=0):
+    """Frame rộng: 3/4 cột số (float + int), 1/4 cột chuỗi có số giá trị khác nhau vừa phải."""
+    rng = np.random.default_rng(seed)
+    columns = {}
+    for i in range(n_cols):
+        kind = i % 4
+        if kind == 0:
+            values = rng.normal(size=n_rows)
+            values[rng.random(n_rows) < 0.05] = np.nan
+        elif kind == 1:
+            values = rng.lognormal(size=n_rows)
+        elif kind == 2:
+            values = rng.integers(0, 10_000, n_rows)
+        else:
+            values = rng.choice([f"v{j}" for j in range(500)], n_rows)
+        columns[f"c{i}"] = values
+    return pd.DataFrame(columns)
+
+
+def best_of(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--columns", type=int, nargs="+", default=[50, 100, 200, 400])
+    parser.add_argument("--workers", type=int, nargs="+", default=[2, 4, os.cpu_count() or 1])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    workers = sorted(set(w for w in args.workers if w > 1))
+
+    print(f"cpu_count={os.cpu_count()} rows={args.rows:,}")
+    print(f"{'columns':>8} {'serial':>10}" + "".join(f" {f'{w} workers':>18}" for w in workers))
+    with tempfile.TemporaryDirectory() as tmp:
+        for n_cols in args.columns:
+            df = make_frame(args.rows, n_cols)
+            columnar_path = build_columnar_copy(df, os.path.join(tmp, f"wide_{n_cols}.parquet"))
+            serial_time, expected = best_of(lambda: profile_frame(df), args.repeat)
+            line = f"{n_cols:>8} {serial_time * 1000:>8.0f}ms"
+            for w in workers:
+                # Lượt đầu khởi động pool (spawn), không tính vào thời gian
+                profile_frame_parallel(df, columnar_path, workers=w)
+                parallel_time, result = best_of(lambda: profile_frame_parallel(df, columnar_path, workers=w), args.repeat)
+                pd.testing.assert_frame_equal(result, expected)
+                line += f" {parallel_time * 1000:>8.0f}ms ({serial_time / parallel_time:>4.1f}x)"
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
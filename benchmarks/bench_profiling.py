@@ -0,0 +1,80 @@
+"""So sánh `profile_frame` với vòng lặp `analyze_column` cũ trên các dataset mẫu.
+
+Chạy từ thư mục gốc của repo:
+
+    python -m benchmarks.bench_profiling [--tile N] [--repeat R]
+"""
+import argparse
+import glob
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.loader import UPLOAD_DIR, read_csv_file
+from src.profiling import profile_frame, profile_records
+
+
+def analyze_column(col_name, series):
+    """Bản gốc trong pages/3_📂_Dataset_Details.py (giữ lại làm baseline)."""
+    info = {'name': col_name, 'dtype': str(series.dtype), 'missing_pct': series.isna().mean() * 100, 'unique': series.nunique()}
+    if pd.api.types.is_numeric_dtype(series):
+        desc = series.describe()
+        info.update({
+            'min': desc['min'], 'max': desc['max'], 'mean': desc['mean'],
+            'median': series.median(), 'std': desc['std'],
+            'outliers': ((series < (desc['25%'] - 1.5*(desc['75%'] - desc['25%']))) | (series > (desc['75%'] + 1.5*(desc['75%'] - desc['25%'])))).sum(),
+            'type': 'Numeric'
+        })
+    elif series.nunique() == 2:
+        info['type'] = 'Boolean'
+    elif info['unique'] == len(series):
+        info['type'] = 'ID'
+    elif info['unique'] <= 20:
+        info['type'] = 'Category'
+    else:
+        info['type'] = 'Text'
+    return info
+
+
+def best_of(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def check_same(old, new):
+    for a, b in zip(old, new):
+        for key, value in a.items():
+            if isinstance(value, (float, np.floating)):
+                assert np.isclose(value, b[key], equal_nan=True), (a['name'], key, value, b[key])
+            else:
+                assert value == b[key], (a['name'], key, value, b[key])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tile", type=int, default=1, help="Nhân số dòng của mỗi dataset lên N lần")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'dataset':<55} {'shape':>14} {'per-column':>11} {'vectorized':>11} {'speedup':>8}")
+    for path in sorted(glob.glob(os.path.join(UPLOAD_DIR, "*.csv"))):
+        df = read_csv_file(path)
+        if args.tile > 1:
+            df = pd.concat([df] * args.tile, ignore_index=True)
+
+        old_time, old = best_of(lambda: [analyze_column(col, df[col]) for col in df.columns], args.repeat)
+        new_time, new = best_of(lambda: profile_records(profile_frame(df)), args.repeat)
+        check_same(old, new)
+        shape = f"{df.shape[0]}×{df.shape[1]}"
+        print(f"{os.path.basename(path)[:55]:<55} {shape:>14} {old_time * 1000:>9.1f}ms "
+              f"{new_time * 1000:>9.1f}ms {old_time / new_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,39 +2,49 @@ import streamlit as st
 import pandas as pd
 import os
 from datetime import datetime
-from src.utils import init_db, add_dataset, get_all_datasets, delete_dataset, rename_dataset, safe_read_csv
+from src.utils import (
+    init_db, add_dataset, add_column_stats, get_column_stats, get_datasets_page, get_dataset_summary,
+    get_dataset_schema, set_dataset_schema, find_dataset_by_hash, delete_dataset, rename_dataset,
+    load_preview, load_sample
+)
+from src.sampling import OVERVIEW_MAX_ROWS, sample_caption
+from src.ingest import store_upload
+from src.cache import dataframe_cache
 from pygwalker.api.streamlit import StreamlitRenderer
 
 st.set_page_config(page_title="📂 Dashboard", layout="wide")
 st.title("📂 Dataset Dashboard")
 
+PAGE_SIZE = 10
+PREVIEW_ROWS = 5
+
 init_db()
 if not os.path.exists('data/uploads'):
     os.makedirs('data/uploads')
 
 uploaded_file = st.file_uploader("Upload your CSV file", type=["csv"])
 
-def safe_read_csv(file_path):
-    for enc in ['utf-8', 'ISO-8859-1', 'utf-16', 'cp1252']:
-        try:
-            return pd.read_csv(file_path, encoding=enc)
-        except UnicodeDecodeError:
-            continue
-    raise UnicodeDecodeError("Unable to decode file with common encodings.")
-
 # Prevent duplicate upload and browser freeze
 if uploaded_file and "uploaded_filename" not in st.session_state:
     now = datetime.now().strftime("%Y%m%d_%H%M%S")
     filename = f"{now}_{uploaded_file.name}"
-    file_path = os.path.join('data', 'uploads', filename)
-    with open(file_path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
-
-    df = safe_read_csv(file_path)
-    rows, cols = df.shape
+    # Ghi file, dò định dạng, thống kê và bản sao Parquet trong một lượt đọc theo chunk,
+    # lưu theo hash nội dung để file trùng dùng chung blob
+    upload = store_upload(uploaded_file)
+    stats = upload['stats']
+    original_id = find_dataset_by_hash(upload['content_hash']) if upload['duplicate'] else None
     upload_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    add_dataset(filename, file_path, rows, cols, upload_time)
+    dataset_id = add_dataset(filename, upload['path'], stats['num_rows'], stats['num_cols'], upload_time,
+                             columnar_path=upload['columnar_path'], csv_format=upload['csv_format'],
+                             content_hash=upload['content_hash'])
+    add_column_stats(dataset_id, stats['columns'])
+    if original_id is not None:
+        schema, bytes_saved = get_dataset_schema(original_id)
+        if schema is not None:
+            set_dataset_schema(dataset_id, schema, bytes_saved)
     st.session_state.uploaded_filename = filename
+    if upload['duplicate']:
+        st.info(f"♻️ Identical content already uploaded — {filename} shares the stored file.")
     st.success(f"✅ Uploaded and saved {filename}")
     st.rerun()
 
@@ -42,24 +52,29 @@ if uploaded_file and "uploaded_filename" not in st.session_state:
 if "uploaded_filename" in st.session_state:
     del st.session_state.uploaded_filename
 
-# Load datasets
-datasets = get_all_datasets()
-
 # Summary header
-if datasets:
+num_datasets, total_rows, total_cols = get_dataset_summary()
+if num_datasets:
     st.markdown("### 📦 Summary")
-    st.write(f"**Total datasets:** {len(datasets)}")
-    st.write(f"**Total rows:** {sum([d[2] for d in datasets])}, **columns:** {sum([d[3] for d in datasets])}")
+    st.write(f"**Total datasets:** {num_datasets}")
+    st.write(f"**Total rows:** {total_rows}, **columns:** {total_cols}")
+    cache_stats = dataframe_cache.stats()
+    st.caption(
+        f"DataFrame cache: {cache_stats['entries']} frames, "
+        f"{cache_stats['bytes'] / 1024 ** 2:.1f} / {cache_stats['max_bytes'] / 1024 ** 2:.0f} MB — "
+        f"{cache_stats['hits']} hits, {cache_stats['misses']} misses"
+    )
 else:
     st.info("No datasets available.")
 
-# Show dataset management
+# Show dataset management (phân trang: mỗi lần rerun chỉ xử lý một trang)
 st.markdown("### 🧾 Uploaded Datasets")
+num_pages = max(1, -(-num_datasets // PAGE_SIZE))
+page = st.number_input(f"Page (1–{num_pages})", min_value=1, max_value=num_pages, value=1, step=1) if num_pages > 1 else 1
+datasets = get_datasets_page(PAGE_SIZE, (page - 1) * PAGE_SIZE)
 for dataset in datasets:
     id_, name, rows, cols, uploaded, status = dataset
     with st.expander(f"📁 {name} — {rows} rows × {cols} cols"):
-        file_path = os.path.join("data", "uploads", name)
-
         col1, col2, col3 = st.columns(3)
         with col1:
             if st.button("🗑️ Delete", key=f"del_{id_}", help="Remove this dataset"):
@@ -76,14 +91,26 @@ for dataset in datasets:
 
         with col3:
             if st.button("🔍 Open Overview", key=f"overview_{id_}", help="Explore this dataset"):
-                st.session_state.df = safe_read_csv(file_path)
+                st.session_state.df, st.session_state.overview_sample = load_sample(id_, max_rows=OVERVIEW_MAX_ROWS)
                 st.session_state.selected_name = name
                 st.session_state.activate_overview = True
 
-        # Preview table
+        _, bytes_saved = get_dataset_schema(id_)
+        if bytes_saved:
+            st.caption(f"🗜️ Dtype compaction saves {bytes_saved / 1024 ** 2:.1f} MB in memory")
+
+        column_stats = get_column_stats(id_)
+        if column_stats:
+            st.dataframe(
+                pd.DataFrame(column_stats, columns=["Column", "Type", "Nulls", "Min", "Max", "≈ Distinct"]),
+                use_container_width=True,
+                hide_index=True,
+            )
+
+        # Preview table (chỉ đọc vài dòng đầu)
         try:
-            preview_df = safe_read_csv(file_path)
-            st.dataframe(preview_df.head(5), use_container_width=True)
+            preview_df = load_preview(id_, n=PREVIEW_ROWS)
+            st.dataframe(preview_df, use_container_width=True)
         except Exception as e:
             st.error(f"Could not preview: {e}")
 
@@ -91,6 +118,8 @@ for dataset in datasets:
 if st.session_state.get("activate_overview", False):
     st.markdown("## 🧠 Dataset Overview")
     st.success(f"Now analyzing: `{st.session_state.selected_name}`")
+    if st.session_state.overview_sample["sampled"]:
+        st.caption(sample_caption(st.session_state.overview_sample))
 
     import pygwalker as pyg
     import streamlit.components.v1 as components
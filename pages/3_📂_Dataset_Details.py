@@ -2,53 +2,33 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-import re
-from src.utils import get_all_datasets, get_dataset
-from src.models.llms import load_llm
+from src.utils import init_db, get_all_datasets, get_dataset, load_cleaned, load_dataset, load_profile
+from src.profiling import profile_error_caption, profile_records, profile_table
+from src.models.llms import predict_many
+from src.models.router import model_router, route_llm
+from src.prompt_context import fit_lines, fit_table
+from src.semantic_types import guess_column_semantics
+from src.moments import Moments, changed_columns
+from src.cleaning import describe_operations, fix_numeric_strings, operations_prompt, parse_operations
 
 st.set_page_config(page_title="📂 Dataset Details", layout="wide")
 st.title("📂 Dataset Details")
+init_db()
 
-llm = load_llm("gpt-3.5-turbo")
+OVERVIEW_PAGE_SIZE = 10
+# Ngân sách token cho danh sách cột / bảng skew-kurtosis trong prompt
+PLAN_CONTEXT_TOKENS = 1500
+REPORT_TABLE_TOKENS = 800
+llm = route_llm("dataset_details")
 
 # ---------- Helper functions ----------
-def safe_read_csv(file_path):
-    for enc in ['utf-8', 'ISO-8859-1', 'utf-16', 'cp1252']:
-        try:
-            return pd.read_csv(file_path, encoding=enc)
-        except UnicodeDecodeError:
-            continue
-    raise UnicodeDecodeError("Unable to decode file with common encodings.")
-
-def analyze_column(col_name, series):
-    info = {'name': col_name, 'dtype': str(series.dtype), 'missing_pct': series.isna().mean() * 100, 'unique': series.nunique()}
-    if pd.api.types.is_numeric_dtype(series):
-        desc = series.describe()
-        info.update({
-            'min': desc['min'], 'max': desc['max'], 'mean': desc['mean'],
-            'median': series.median(), 'std': desc['std'],
-            'outliers': ((series < (desc['25%'] - 1.5*(desc['75%'] - desc['25%']))) | (series > (desc['75%'] + 1.5*(desc['75%'] - desc['25%'])))).sum(),
-            'type': 'Numeric'
-        })
-    elif series.nunique() == 2:
-        info['type'] = 'Boolean'
-    elif info['unique'] == len(series):
-        info['type'] = 'ID'
-    elif info['unique'] <= 20:
-        info['type'] = 'Category'
-    else:
-        info['type'] = 'Text'
-    return info
-
-def guess_column_semantic_llm(col_name):
-    prompt = f"What is the semantic type or meaning of a column named '{col_name}' in a dataset? Answer in 3-5 words."
-    return llm.predict(prompt)
-
 @st.cache_data(show_spinner=False)
 def get_cleaning_suggestions(col_stats):
-    cols_description = "\n".join([
-        f"Column: {col['name']} | Type: {col['dtype']} | Missing: {col['missing_pct']:.2f}%" for col in col_stats
-    ])
+    # Cột có dữ liệu trống cần kế hoạch nhất → đứng trước khi phải cắt theo ngân sách token
+    cols_description = fit_lines([
+        f"Column: {col['name']} | Type: {col['dtype']} | Missing: {col['missing_pct']:.2f}%"
+        for col in sorted(col_stats, key=lambda col: -col['missing_pct'])
+    ], PLAN_CONTEXT_TOKENS, overflow="... and {n} more columns without missing values")
     prompt = f"""
 Given the following summary of columns in a dataset:
 {cols_description}
@@ -80,30 +60,14 @@ Update the cleaning plan accordingly.
     return llm.predict(prompt)
 
 @st.cache_data(show_spinner=False)
-def generate_cleaning_code_from_plan(plan):
-    prompt = f"""
-Convert the following cleaning plan into valid Python code using pandas.
-Only return Python code that can be executed directly in Python.
-Assume the dataframe is named `df`.
-
-Before applying `.str` methods (e.g. `.str.replace`), always check the column's dtype like this:
-if df[\"column_name\"].dtype == \"object\":
-    df[\"column_name\"] = df[\"column_name\"].str.replace(",", "").astype(float)
+def plan_to_operations(plan, dtypes):
+    """Chuyển kế hoạch (văn bản) thành danh sách bước có kiểu, một lần cho mỗi kế hoạch."""
+    return parse_operations(llm.predict(operations_prompt(plan, dtypes)), dtypes)
 
-Also ensure any strings like '1,000' or '2,500.50' are converted to numeric values before further cleaning.
-
-Cleaning Plan:
-{plan}
-"""
-    return llm.predict(prompt)
-
-def extract_valid_code(llm_response):
-    match = re.search(r"```(?:python)?\n(.*?)```", llm_response.strip(), re.DOTALL)
-    if match:
-        return match.group(1)
-    lines = llm_response.splitlines()
-    code_lines = [line for line in lines if line.strip() and not line.strip().startswith("#")]
-    return "\n".join(code_lines)
+@st.cache_data(show_spinner=False)
+def numeric_text_report(dataset_id):
+    """Cột chữ thực chất là số và tỉ lệ chuyển đổi thành công, tính một lần cho mỗi dataset."""
+    return fix_numeric_strings(load_dataset(dataset_id))[1]
 
 def generate_insight(info):
     if info['type'] == 'ID':
@@ -116,46 +80,73 @@ def generate_insight(info):
         return "ℹ️ Category with <5 distinct values."
     return "✅ No major issues detected."
 
-def plot_distribution(col_name, series):
+def plot_distribution(col_name, distribution):
+    """Vẽ từ histogram / top-k đã tính sẵn trong profile, không đụng tới dữ liệu thô."""
+    if distribution is None:
+        st.caption("No non-missing values to plot.")
+        return
     fig, ax = plt.subplots()
-    if pd.api.types.is_numeric_dtype(series):
-        ax.hist(series.dropna(), bins=20, color='#69b3a2')
+    if distribution['kind'] == 'histogram':
+        edges = np.asarray(distribution['edges'])
+        ax.bar(edges[:-1], distribution['counts'], width=np.diff(edges), align='edge', color='#69b3a2')
         ax.set_xlabel(col_name)
         ax.set_ylabel('Frequency')
     else:
-        vc = series.fillna("NaN").value_counts().head(20)
-        ax.bar(vc.index.astype(str), vc.values, color='#8c54ff')
-        ax.set_xticklabels(vc.index, rotation=45, ha='right')
+        positions = np.arange(len(distribution['values']))
+        ax.bar(positions, distribution['counts'], color='#8c54ff')
+        ax.set_xticks(positions)
+        ax.set_xticklabels(distribution['values'], rotation=45, ha='right')
         ax.set_ylabel('Count')
     ax.set_title(f"Distribution: {col_name}")
     st.pyplot(fig)
+    plt.close(fig)
 
-def fix_numeric_strings(df):
-    for col in df.select_dtypes(include='object').columns:
-        if df[col].dropna().apply(lambda x: isinstance(x, str)).all():
-            try:
-                df[col] = df[col].str.replace(',', '', regex=False)
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-            except Exception as e:
-                print(f"Failed to clean column {col}: {e}")
-    return df
-
-def show_skew_kurtosis(df, cleaned_df):
-    raw_cols = df.select_dtypes(include='number').columns
-    clean_cols = cleaned_df.select_dtypes(include='number').columns
-    numeric_cols = list(set(raw_cols).intersection(set(clean_cols)))
+def show_skew_kurtosis(df, cleaned_df, raw_moments):
+    raw_cols = raw_moments.columns
+    clean_cols = set(cleaned_df.select_dtypes(include='number').columns)
+    numeric_cols = [col for col in raw_cols if col in clean_cols]
 
     if not numeric_cols:
         st.info("No common numeric columns available for skewness/kurtosis report.")
         return
 
+    # Moment của frame gốc lấy từ profile đã lưu; chỉ tính lại các cột mà code làm sạch đã đổi
+    before = raw_moments.subset(numeric_cols)
+    touched = changed_columns(df, cleaned_df, numeric_cols)
+    after = raw_moments.subset(numeric_cols).replace(Moments.from_frame(cleaned_df, touched))
+
     report = pd.DataFrame(index=numeric_cols)
-    report['Skew (Before)'] = df[numeric_cols].skew()
-    report['Kurtosis (Before)'] = df[numeric_cols].kurtosis()
-    report['Skew (After)'] = cleaned_df[numeric_cols].skew()
-    report['Kurtosis (After)'] = cleaned_df[numeric_cols].kurtosis()
+    report['Skew (Before)'] = before.skew()
+    report['Kurtosis (Before)'] = before.kurtosis()
+    report['Skew (After)'] = after.skew()
+    report['Kurtosis (After)'] = after.kurtosis()
     st.dataframe(report.round(2), use_container_width=True)
 
+    # Prompt chỉ giữ các cột thay đổi nhiều nhất khi bảng vượt ngân sách token
+    change = (report['Skew (After)'] - report['Skew (Before)']).abs() + (report['Kurtosis (After)'] - report['Kurtosis (Before)']).abs()
+    ranked = report.loc[change.sort_values(ascending=False).index]
+
+    # Ba prompt độc lập gửi cùng lúc trước khi vẽ: chờ bằng lời gọi chậm nhất thay vì tổng ba lời gọi
+    insight1, insight2, interpretation = predict_many(llm, [f"""
+Interpret this skewness bar chart comparing before vs after cleaning:
+{fit_table(ranked[['Skew (Before)', 'Skew (After)']], REPORT_TABLE_TOKENS)}
+""", f"""
+Interpret this kurtosis bar chart comparing before vs after cleaning:
+{fit_table(ranked[['Kurtosis (Before)', 'Kurtosis (After)']], REPORT_TABLE_TOKENS)}
+""", f"""
+Please analyze the following:
+1. The skewness and kurtosis table below.
+2. The bar charts comparing before vs after cleaning.
+
+Then provide:
+- An interpretation of how cleaning affected distribution symmetry and tail behavior.
+- An evaluation of whether the cleaned data is now more suitable for statistical analysis.
+- Suggested next steps if improvements are still needed.
+
+Data summary:
+{fit_table(ranked, REPORT_TABLE_TOKENS)}
+"""])
+
     st.markdown("### 📊 Visualization")
 
     fig1, ax1 = plt.subplots()
@@ -165,16 +156,13 @@ def show_skew_kurtosis(df, cleaned_df):
     ax1.set_xlabel('Feature')
     ax1.legend()
     st.pyplot(fig1)
+    plt.close(fig1)
 
-    try:
-        insight1 = llm.predict(f"""
-Interpret this skewness bar chart comparing before vs after cleaning:
-{report[['Skew (Before)', 'Skew (After)']].to_markdown()}
-""")
+    if isinstance(insight1, Exception):
+        st.warning("Failed to interpret skewness chart via LLM.")
+    else:
         st.markdown("#### 🤖 Insight on Skewness")
         st.info(insight1)
-    except Exception:
-        st.warning("Failed to interpret skewness chart via LLM.")
 
     fig2, ax2 = plt.subplots()
     report[['Kurtosis (Before)', 'Kurtosis (After)']].plot(kind='bar', ax=ax2)
@@ -183,35 +171,19 @@ Interpret this skewness bar chart comparing before vs after cleaning:
     ax2.set_xlabel('Feature')
     ax2.legend()
     st.pyplot(fig2)
+    plt.close(fig2)
 
-    try:
-        insight2 = llm.predict(f"""
-Interpret this kurtosis bar chart comparing before vs after cleaning:
-{report[['Kurtosis (Before)', 'Kurtosis (After)']].to_markdown()}
-""")
+    if isinstance(insight2, Exception):
+        st.warning("Failed to interpret kurtosis chart via LLM.")
+    else:
         st.markdown("#### 🤖 Insight on Kurtosis")
         st.info(insight2)
-    except Exception:
-        st.warning("Failed to interpret kurtosis chart via LLM.")
 
-    try:
-        interpretation = llm.predict(f"""
-Please analyze the following:
-1. The skewness and kurtosis table below.
-2. The bar charts comparing before vs after cleaning.
-
-Then provide:
-- An interpretation of how cleaning affected distribution symmetry and tail behavior.
-- An evaluation of whether the cleaned data is now more suitable for statistical analysis.
-- Suggested next steps if improvements are still needed.
-
-Data summary:
-{report.to_markdown()}
-""")
+    if isinstance(interpretation, Exception):
+        st.warning("Failed to interpret the report via LLM.")
+    else:
         st.markdown("### 📘 Interpretation by LLM")
         st.write(interpretation)
-    except Exception:
-        st.warning("Failed to interpret the report via LLM.")
 
 
 
@@ -222,15 +194,28 @@ if datasets:
     selected = st.selectbox("Select dataset:", [f"{d[0]} - {d[1]}" for d in datasets])
     dataset_id = int(selected.split(" - ")[0])
     dataset = get_dataset(dataset_id)
-    df = safe_read_csv(dataset[2])
+    df = load_dataset(dataset_id)
     st.markdown(f"### Dataset: `{dataset[1]}` — {df.shape[0]} rows × {df.shape[1]} columns")
 
+    # Profile lưu trong dataset_profiles (tính một lần theo hash nội dung), dùng chung
+    # cho tab Overview và Cleaning; dataset lớn dùng sketch HLL/KLL lưu lúc upload
+    dataset_profile = load_profile(dataset_id)
+    profile = profile_table(dataset_profile)
+    column_profiles = dict(zip(df.columns, profile_records(profile)))
+    error_caption = profile_error_caption(profile)
+    if error_caption:
+        st.caption(error_caption)
+
     tab1, tab2, tab3 = st.tabs(["📊 Overview", "🧼 Cleaning", "📈 Skewness & Kurtosis"])
 
     with tab1:
-        for col in df.columns:
+        # Chỉ vẽ các cột của trang đang xem
+        num_pages = max(1, -(-len(df.columns) // OVERVIEW_PAGE_SIZE))
+        page = st.number_input(f"Columns page (1–{num_pages})", min_value=1, max_value=num_pages, value=1,
+                               step=1) if num_pages > 1 else 1
+        for col in df.columns[(page - 1) * OVERVIEW_PAGE_SIZE:page * OVERVIEW_PAGE_SIZE]:
             with st.container():
-                stats = analyze_column(col, df[col])
+                stats = column_profiles[col]
                 st.markdown(f"#### 📌 {col}")
                 cols = st.columns([2, 3])
                 with cols[0]:
@@ -246,11 +231,13 @@ if datasets:
                     st.markdown(f"- Missing: `{stats['missing_pct']:.2f}%`")
                     st.info(generate_insight(stats))
                 with cols[1]:
-                    plot_distribution(col, df[col])
+                    plot_distribution(col, dataset_profile['distributions'].get(str(col)))
             st.markdown("---")
 
     with tab2:
-        col_stats = [dict(analyze_column(col, df[col]), semantic=guess_column_semantic_llm(col)) for col in df.columns]
+        # Một lượt gọi LLM theo batch cho mọi cột chưa có trong cache (của bất kỳ model nào router có thể chọn)
+        semantics = guess_column_semantics(llm, model_router.models, df)
+        col_stats = [dict(column_profiles[col], semantic=semantics[col]) for col in df.columns]
         summary_df = pd.DataFrame([{**c, 'Missing %': f"{c['missing_pct']:.2f}"} for c in col_stats])
         st.session_state.col_stats = col_stats
         st.session_state.summary_df = summary_df
@@ -267,16 +254,25 @@ if datasets:
                 st.session_state.base_cleaning_plan = refine_cleaning_strategy(user_input, base_plan)
                 st.rerun()
 
-        code_raw = generate_cleaning_code_from_plan(st.session_state.base_cleaning_plan)
-        code_clean = extract_valid_code(code_raw)
-        st.session_state.code_clean = code_clean
-        with st.expander("🧪 Raw Cleaning Code (debug)"):
-            st.code(code_raw, language="markdown")
+        # Cột số lưu dạng chữ luôn được parse trước; LLM thấy chúng như cột số
+        numeric_text = numeric_text_report(dataset_id)
+        dtypes = {str(col): "float64" if str(col) in numeric_text else str(dtype) for col, dtype in df.dtypes.items()}
+        operations = [{'op': 'parse_numeric', 'column': col} for col in numeric_text]
+        operations += plan_to_operations(st.session_state.base_cleaning_plan, dtypes)
+        st.session_state.cleaning_operations = operations
+        with st.expander("🧪 Cleaning Operations"):
+            st.dataframe(describe_operations(operations), use_container_width=True)
+        if numeric_text:
+            with st.expander("🔢 Numeric Text Columns"):
+                st.dataframe(pd.DataFrame([
+                    {'column': col, 'decimal': f['decimal'], 'thousands': f['thousands'],
+                     'success rate': f"{f['success_rate']:.1%}"}
+                    for col, f in numeric_text.items()
+                ]), use_container_width=True)
 
         try:
-            exec_globals = {'df': df.copy(), 'pd': pd, 'np': np, 'fix_numeric_strings': fix_numeric_strings}
-            exec("df = fix_numeric_strings(df)\n" + code_clean, exec_globals)
-            cleaned_df = exec_globals['df']
+            # Các bước vector hoá; kết quả cache theo (hash dataset, hash kế hoạch)
+            cleaned_df = load_cleaned(dataset_id, operations)
 
             # Chỉ khi không lỗi mới gán vào session_state
             st.session_state.cleaned_df = cleaned_df
@@ -286,8 +282,7 @@ if datasets:
             st.dataframe(cleaned_df.head())
 
         except Exception as e:
-            st.error(f"Error while executing cleaning code: {e}")
-            st.code(code_clean, language="python")
+            st.error(f"Error while applying cleaning operations: {e}")
 
         if 'cleaned_df' in st.session_state:
             st.download_button(
@@ -297,16 +292,14 @@ if datasets:
                 mime="text/csv"
             )
 
-            with st.expander("🧾 Python Code Used"):
-                st.code(code_clean, language="python")
-
 
 
 
     with tab3:
         st.markdown("### 📈 Skewness & Kurtosis Report")
         if "cleaned_df" in st.session_state and "raw_df" in st.session_state:
-            show_skew_kurtosis(st.session_state.raw_df, st.session_state.cleaned_df)
+            show_skew_kurtosis(st.session_state.raw_df, st.session_state.cleaned_df,
+                               Moments.from_dict(dataset_profile['moments']))
         else:
             st.info("Please run cleaning in the '🧼 Cleaning' tab first.")
 else:
@@ -2,7 +2,9 @@
 import streamlit as st
 import pandas as pd
 import matplotlib.pyplot as plt
-from src.utils import init_db, get_all_datasets, get_chart_cards_by_dataset, get_dataset, safe_read_csv, execute_plt_code, delete_chart_card
+from src.executor import code_executor
+from src.utils import init_db, get_all_datasets, get_chart_cards_by_dataset, get_dataset, load_sample, execute_plt_code, delete_chart_card
+from src.sampling import sample_caption
 
 
 st.set_page_config(page_title="📊 Visual Summary", layout="wide")
@@ -25,7 +27,8 @@ dataset = get_dataset(dataset_id)
 
 # Load dataframe safely
 try:
-    st.session_state.df = safe_read_csv(dataset[2])
+    st.session_state.df, sample_info = load_sample(dataset_id)
+    plot_key = code_executor.preload(st.session_state.df)
 except Exception as e:
     st.error(f"❌ Failed to load dataframe: {e}")
     st.stop()
@@ -52,7 +55,7 @@ st.subheader("🧩 Chart-based Insights")
 #                 st.code(code, language="python")
 
 #         with cols[1]:
-#             fig = execute_plt_code(code, st.session_state.df)
+#             fig = execute_plt_code(code, st.session_state.df, frame_key=plot_key)
 #             if fig:
 #                 st.pyplot(fig)
 #             else:
@@ -84,9 +87,11 @@ for i, (question, answer, code, timestamp) in enumerate(cards):
                 st.rerun()  # 
 
         with cols[1]:
-            fig = execute_plt_code(code, st.session_state.df)
-            if fig:
-                st.pyplot(fig)
+            chart = execute_plt_code(code, st.session_state.df, frame_key=plot_key)
+            if chart:
+                st.image(chart)
+                if sample_info["sampled"]:
+                    st.caption(sample_caption(sample_info))
             else:
                 st.warning("⚠️ No chart could be rendered from saved code.")
 
@@ -2,7 +2,9 @@ import streamlit as st
 import pandas as pd
 import os
 from datetime import datetime
-from src.utils import export_eda_report_to_pdf, init_db, add_dataset, get_all_datasets, delete_dataset, rename_dataset, safe_read_csv
+from src.utils import clear_llm_cache, export_eda_report_to_pdf, get_llm_cache_usage, init_db, add_dataset, get_all_datasets, delete_dataset, rename_dataset, load_dataset, load_sample, load_profile
+from src.sampling import sample_caption
+from src.executor import ExecutionError, code_executor
 from pygwalker.api.streamlit import StreamlitRenderer
 import matplotlib.pyplot as plt
 import seaborn as sns
@@ -10,14 +12,19 @@ import json
 import textwrap
 import re
 
-from langchain.chat_models import ChatOpenAI
-from langchain.schema import HumanMessage
+from langchain_core.messages import HumanMessage
+from src.models.llms import submit_llm_call
+from src.models.router import route_llm
+from src.prompt_context import build_dataset_context, fit_lines
 
 st.set_page_config(page_title="EDA Report", layout="wide")
 st.title("🧠 Exploratory Data Analysis (EDA) Report")
 
-# LangChain LLM setup
-llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0)
+# LangChain LLM setup (câu trả lời được cache trong SQLite, xem `CachedLLM`)
+llm = route_llm("eda_report")
+# Ngân sách token cho phần mô tả dataset / insight từng cột trong prompt
+EDA_CONTEXT_TOKENS = 1500
+SUMMARY_INSIGHT_TOKENS = 800
 
 def clean_llm_json(raw_response):
     # Xoá markdown code block ```json hoặc ```
@@ -25,7 +32,7 @@ def clean_llm_json(raw_response):
     cleaned = re.sub(r"```$", "", cleaned.strip())
     return cleaned.strip()
 
-def generate_eda_report_with_llm(df):
+def generate_eda_report_with_llm(df, profile, bypass_cache=False):
     prompt = f"""
 You are a professional data analyst. Given a dataset `df`, perform an in-depth exploratory data analysis (EDA) and return your findings in JSON. Your response **must** be valid JSON with the following fields:
 
@@ -52,19 +59,12 @@ You are a professional data analyst. Given a dataset `df`, perform an in-depth e
 Make sure your output is JSON only and properly escaped.
 
 Dataset Metadata Preview:
-- Head:
-{df.head().to_json(orient="records")}
-- Missing values:
-{df.isnull().sum()[df.isnull().sum() > 0].to_dict()}
-- Dtypes:
-{df.dtypes.astype(str).to_dict()}
-- Description:
-{df.describe().to_dict()}
+{build_dataset_context(profile, budget=EDA_CONTEXT_TOKENS, head=df.head())}
 
 Return only valid JSON. Do not wrap it in markdown code block (no triple backticks).
 """
 
-    response = llm([HumanMessage(content=prompt)]).content
+    response = llm([HumanMessage(content=prompt)], bypass=bypass_cache).content
 
     try:
         return json.loads(response)
@@ -127,12 +127,58 @@ if not datasets:
 dataset_options = {f"{d[0]} - {d[1]}": d for d in datasets}
 selected = st.selectbox("Select dataset to generate report:", list(dataset_options.keys()))
 dataset_id, name, rows, cols, uploaded, _ = dataset_options[selected]
-file_path = os.path.join("data", "uploads", name)
-df = safe_read_csv(file_path)
+df = load_dataset(dataset_id)
+# Missing/duplicate/describe() đọc từ profile đã lưu thay vì tính lại mỗi lần rerun
+profile = load_profile(dataset_id)
+# Biểu đồ (code do LLM sinh) chạy trên sample khi dataset quá lớn
+plot_df, sample_info = load_sample(dataset_id)
+# Worker vẽ nhận sẵn sample trong lúc chờ LLM viết báo cáo
+plot_key = code_executor.preload(plot_df)
+if sample_info["sampled"]:
+    st.caption(sample_caption(sample_info) + " Charts below use this sample.")
+
+def render_chart(code):
+    """Chạy code vẽ của LLM trên `plot_df` trong worker riêng (timeout/giới hạn bộ nhớ) rồi hiển thị ảnh."""
+    image = code_executor.run(code, plot_df, frame_key=plot_key)
+    if image is None:
+        raise ExecutionError("The code did not draw a chart.")
+    st.image(image)
 
 # Call LLM-generated EDA content
 tabs = st.tabs(["📘 Introduction", "🧼 Data Quality", "🔍 Univariate", "📊 Correlation", "💡 Insights", "📄 Full Report"])
-eda_sections = generate_eda_report_with_llm(df)
+with st.sidebar:
+    # Bỏ qua cache một lần để LLM viết lại báo cáo
+    regenerate = st.button("🔄 Regenerate report")
+eda_sections = generate_eda_report_with_llm(df, profile, bypass_cache=regenerate)
+
+# Prompt tóm tắt chỉ cần eda_sections → gửi ngay, chạy song song với việc vẽ biểu đồ ở các tab.
+# Dựng trước mọi tab nên phần nào LLM bỏ sót thì để trống, không làm dừng cả trang
+summary_insights = [b['insight_after_chart'] for b in eda_sections.get('univariate', []) if 'insight_after_chart' in b]
+prompt_summary = f"""
+    You are a professional data analyst. Given the following summaries from the EDA process:
+
+    1. Dataset introduction:
+    {eda_sections.get('introduction', '')}
+
+    2. Data quality issues:
+    {eda_sections.get('data_quality', '')}
+
+    3. Univariate insights:
+    {fit_lines(summary_insights, SUMMARY_INSIGHT_TOKENS)}
+
+    4. Correlation insight:
+    {eda_sections.get('correlation', {}).get('insight_after_chart', '')}
+
+    Write a cohesive summary paragraph (~200-300 words) that:
+    - Interprets patterns or problems in the dataset.
+    - Highlights important relationships.
+    - Mentions unexpected findings.
+    - Proposes actionable insights.
+
+    End with a short list of recommendations in bullet format.
+    Respond in markdown.
+    """
+summary_future = submit_llm_call(llm, [HumanMessage(content=prompt_summary)], bypass=regenerate)
 
 # --- 📘 Introduction ---
 with tabs[0]:
@@ -144,14 +190,14 @@ with tabs[0]:
 with tabs[1]:
     st.markdown(eda_sections['data_quality'])
     st.subheader("Missing Values")
-    missing = df.isnull().sum()
+    missing = pd.Series(profile['missing'], dtype='int64')
     missing = missing[missing > 0]
     if not missing.empty:
         st.dataframe(missing)
     else:
         st.success("No missing values detected.")
     st.subheader("Duplicate Rows")
-    st.write(f"Number of duplicate rows: **{df.duplicated().sum()}**")
+    st.write(f"Number of duplicate rows: **{profile['duplicate_rows']}**")
 
     # Detailed per-column analysis
     st.subheader("🔎 Column-wise Analysis")
@@ -159,10 +205,11 @@ with tabs[1]:
         st.markdown(f"### 📌 `{col}`")
         col_data = df[col]
         st.write(f"- Data type: `{col_data.dtype}`")
-        st.write(f"- Missing values: `{col_data.isnull().sum()}` ({col_data.isnull().mean():.2%})")
+        n_missing = profile['missing'].get(str(col), 0)
+        st.write(f"- Missing values: `{n_missing}` ({n_missing / max(profile['num_rows'], 1):.2%})")
 
         if pd.api.types.is_numeric_dtype(col_data):
-            desc = col_data.describe()
+            desc = pd.Series(profile['describe'][str(col)]) if str(col) in profile['describe'] else col_data.describe()
             st.dataframe(desc.to_frame())
             try:
                 fig, ax = plt.subplots()
@@ -188,10 +235,7 @@ with tabs[2]:
         st.markdown(block['insight'])
         st.code(block['code'], language='python')
         try:
-            local_env = {"df": df, "plt": plt, "sns": sns}
-            exec(block['code'], local_env)
-            st.pyplot(plt.gcf())
-            plt.clf()
+            render_chart(block['code'])
             if 'insight_after_chart' in block:
                 st.info(block['insight_after_chart'])
         except Exception as e:
@@ -202,10 +246,7 @@ with tabs[3]:
     st.markdown(eda_sections['correlation']['insight'])
     st.code(eda_sections['correlation']['code'], language='python')
     try:
-        local_env = {"df": df, "plt": plt, "sns": sns}
-        exec(eda_sections['correlation']['code'], local_env)
-        st.pyplot(plt.gcf())
-        plt.clf()
+        render_chart(eda_sections['correlation']['code'])
         if 'insight_after_chart' in eda_sections['correlation']:
             st.info(eda_sections['correlation']['insight_after_chart'])
     except Exception as e:
@@ -215,33 +256,12 @@ with tabs[3]:
 # --- 💡 Insights ---
 with tabs[4]:
     st.subheader("🔖 Key Takeaways & Recommendations")
-    prompt_summary = f"""
-        You are a professional data analyst. Given the following summaries from the EDA process:
-
-        1. Dataset introduction:
-        {eda_sections['introduction']}
-
-        2. Data quality issues:
-        {eda_sections['data_quality']}
-
-        3. Univariate insights:
-        {[b['insight_after_chart'] for b in eda_sections['univariate'] if 'insight_after_chart' in b]}
-
-        4. Correlation insight:
-        {eda_sections['correlation']['insight_after_chart']}
-
-        Write a cohesive summary paragraph (~200-300 words) that:
-        - Interprets patterns or problems in the dataset.
-        - Highlights important relationships.
-        - Mentions unexpected findings.
-        - Proposes actionable insights.
-
-        End with a short list of recommendations in bullet format.
-        Respond in markdown.
-        """
-    
-    summary_response = llm([HumanMessage(content=prompt_summary)]).content
-    st.markdown(summary_response)
+    try:
+        summary_response = summary_future.result().content
+        st.markdown(summary_response)
+    except Exception as e:
+        summary_response = ""
+        st.error(f"Error generating summary: {e}")
 
 
 
@@ -268,10 +288,7 @@ with tabs[5]:
         st.markdown(f"- {block['insight']}")
         st.code(block['code'], language="python")
         try:
-            local_env = {"df": df, "plt": plt, "sns": sns}
-            exec(block['code'], local_env)
-            st.pyplot(plt.gcf())
-            plt.clf()
+            render_chart(block['code'])
             if 'insight_after_chart' in block:
                 st.markdown(f"_{block['insight_after_chart']}_")
         except Exception as e:
@@ -282,10 +299,7 @@ with tabs[5]:
     st.markdown(eda_sections['correlation']['insight'])
     st.code(eda_sections['correlation']['code'], language="python")
     try:
-        local_env = {"df": df, "plt": plt, "sns": sns}
-        exec(eda_sections['correlation']['code'], local_env)
-        st.pyplot(plt.gcf())
-        plt.clf()
+        render_chart(eda_sections['correlation']['code'])
         st.markdown(f"_{eda_sections['correlation']['insight_after_chart']}_")
     except Exception as e:
         st.error(f"Heatmap error: {e}")
@@ -336,8 +350,19 @@ _{eda_sections['correlation'].get('insight_after_chart', '')}_
 
 
     # Export PDF
-    pdf_bytes = export_eda_report_to_pdf(eda_sections, df, summary_response, dataset_name=name)
+    pdf_bytes = export_eda_report_to_pdf(eda_sections, plot_df, summary_response, dataset_name=name, frame_key=plot_key)
     st.download_button("📄 Download PDF Report", pdf_bytes, file_name=f"EDA_Report_{name}.pdf", mime="application/pdf")
 
 
 
+
+with st.sidebar:
+    cache_stats = llm.stats()
+    st.caption(f"🗄️ LLM cache: {cache_stats['hit_rate']:.0%} hit rate "
+               f"({cache_stats['hits']} hits, {cache_stats['misses']} misses since start)")
+    usage = get_llm_cache_usage()
+    st.caption(f"{usage['entries']} stored answers, {usage['bytes'] / 1024 / 1024:.1f} MB")
+    if st.button("🧹 Clear LLM cache", disabled=usage['entries'] == 0):
+        clear_llm_cache()
+        st.toast("🧹 LLM cache cleared!", icon="✅")
+        st.rerun()
@@ -1,15 +1,18 @@
 import streamlit as st
 import pandas as pd
 import plotly.express as px
-from src.models.llms import load_llm
+from src.models.router import route_llm
 from src.models.config import COLOR_THEME
 from datetime import datetime
-from src.utils import get_all_datasets, get_dataset
+from src.utils import get_all_datasets, get_dataset, load_dataset, load_profile, load_sample
+from src.prompt_context import build_dataset_context
+from src.sampling import MAX_PLOT_ROWS, sample_caption
 
 st.set_page_config(page_title="📈 Smart Chart Builder", layout="wide")
 st.title("📈 Smart Chart Builder")
 
-llm = load_llm("gpt-3.5-turbo")
+llm = route_llm("smart_charts")
+CHART_CONTEXT_TOKENS = 800
 
 # Load datasets
 datasets = get_all_datasets()
@@ -21,18 +24,8 @@ dataset_options = {f"{d[0]} - {d[1]}": d[0] for d in datasets}
 selected = st.selectbox("📂 Select dataset to analyze:", list(dataset_options.keys()))
 dataset_id = dataset_options[selected]
 dataset = get_dataset(dataset_id)
-file_path = dataset[2]
 
-@st.cache_data
-def load_csv(file_path):
-    for enc in ['utf-8', 'ISO-8859-1', 'utf-16', 'cp1252']:
-        try:
-            return pd.read_csv(file_path, encoding=enc)
-        except:
-            continue
-    raise ValueError("❌ Cannot decode CSV file.")
-
-df = load_csv(file_path)
+df = load_dataset(dataset_id)
 
 st.markdown(f"**🧾 Dataset Info:** `{dataset[1]}` — {df.shape[0]} rows × {df.shape[1]} columns")
 
@@ -45,36 +38,50 @@ with sidebar:
     y_axis = st.selectbox("Y-axis", options=df.select_dtypes(include=['number']).columns.tolist())
     group_by = st.selectbox("Color By", options=["None"] + df.select_dtypes(include=['object', 'category']).columns.tolist())
     chart_type = st.selectbox("Chart Type", options=["line", "bar", "scatter"])
+    sampling = "uniform"
+    if len(df) > MAX_PLOT_ROWS:
+        sampling = st.selectbox("Sampling", options=["uniform", "stratified", "time"],
+                                help="Large datasets are plotted from a sample. Stratified uses 'Color By', time uses the X-axis.")
     user_prompt = st.text_area("📝 Extra LLM Instructions", placeholder="e.g., add markers, use dark theme...")
     generate = st.button("🚀 Generate & Analyze")
 
 if generate:
     color = group_by if group_by != "None" else None
+    sample_column = {"stratified": color, "time": x_axis}.get(sampling)
+    if sampling == "stratified" and color is None:
+        sampling = "uniform"
+    plot_df, sample_info = load_sample(dataset_id, method=sampling, column=sample_column)
 
     with chart_col:
         st.markdown("### 📊 Generated Chart")
         try:
             if chart_type == "line":
-                fig = px.line(df, x=x_axis, y=y_axis, color=color)
+                fig = px.line(plot_df, x=x_axis, y=y_axis, color=color)
             elif chart_type == "bar":
-                fig = px.bar(df, x=x_axis, y=y_axis, color=color)
+                fig = px.bar(plot_df, x=x_axis, y=y_axis, color=color)
             elif chart_type == "scatter":
-                fig = px.scatter(df, x=x_axis, y=y_axis, color=color)
+                fig = px.scatter(plot_df, x=x_axis, y=y_axis, color=color)
             else:
                 st.warning("Unsupported chart type.")
                 fig = None
 
             if fig:
                 st.plotly_chart(fig, use_container_width=True)
+                if sample_info["sampled"]:
+                    st.caption(sample_caption(sample_info))
         except Exception as e:
             st.error(f"❌ Error generating chart: {e}")
 
     with llm_col:
         st.markdown("### 🧠 Chart Code & Insights")
         with st.spinner("Generating chart code and insights..."):
+            # Mô tả dataset gọn theo ngân sách token; các cột đang vẽ luôn đầy đủ
+            dataset_context = build_dataset_context(load_profile(dataset_id), budget=CHART_CONTEXT_TOKENS,
+                                                    focus=[x_axis, y_axis, color])
             prompt = f"""
                 You are a professional data analyst and visualization expert working with Python and pandas.
-                The dataset is preloaded in the DataFrame `df` and contains these columns: {df.columns.tolist()}.
+                The dataset is preloaded in the DataFrame `df`.
+                {dataset_context}
 
                 The user has just generated a Plotly {chart_type} chart with:
                 - X-axis: `{x_axis}`
@@ -105,5 +112,5 @@ if generate:
                 - Insights must be specific and data-driven
                 """
 
-            result = llm.predict(prompt)
-            st.markdown(result)
+            # Hiện insight theo từng token thay vì chờ cả câu trả lời
+            result = st.write_stream(llm.stream(prompt))
@@ -0,0 +1,119 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_MAX_BYTES = int(os.environ.get("VUDA_DF_CACHE_BYTES", 1024 ** 3))
+
+
+def file_identity(path):
+    """Khoá nhận diện file: (đường dẫn tuyệt đối, kích thước, mtime)."""
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+def frame_nbytes(df: pd.DataFrame):
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+def make_read_only(df: pd.DataFrame):
+    """Khoá các mảng numpy bên dưới để ghi tại chỗ báo lỗi thay vì sửa bản dùng chung."""
+    for block in df._mgr.blocks:
+        values = getattr(block, "values", None)
+        if isinstance(values, np.ndarray):
+            values.flags.writeable = False
+    return df
+
+
+class DataFrameCache:
+    """Cache DataFrame dùng chung cho cả process, LRU theo ngân sách byte.
+
+    Mọi phiên Streamlit cùng nhận một object read-only cho cùng một file, nên
+    một dataset chỉ nằm trong RAM một lần dù có nhiều người đang mở.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (df, nbytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, df: pd.DataFrame):
+        nbytes = frame_nbytes(df)
+        make_read_only(df)
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            if nbytes > self.max_bytes:
+                return df  # lớn hơn cả ngân sách → không cache
+            self._entries[key] = (df, nbytes)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self._bytes -= evicted_bytes
+                self.evictions += 1
+        return df
+
+    def get_or_load(self, key, loader):
+        """Trả về frame trong cache, hoặc gọi `loader()` đúng một lần cho mỗi khoá."""
+        df = self.get(key)
+        if df is not None:
+            return df
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            # Phiên khác có thể vừa load xong trong lúc chờ khoá
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    return entry[0]
+            try:
+                return self.put(key, loader())
+            finally:
+                with self._lock:
+                    self._key_locks.pop(key, None)
+
+    def invalidate(self, path):
+        """Xoá mọi entry của một file (mọi phiên bản và tập cột)."""
+        path = os.path.abspath(path)
+        with self._lock:
+            for key in [k for k in self._entries if k[0][0] == path]:
+                self._bytes -= self._entries.pop(key)[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+dataframe_cache = DataFrameCache()
@@ -0,0 +1,271 @@
+import hashlib
+import json
+import re
+
+import numpy as np
+import pandas as pd
+
+from src.prompt_context import fit_lines
+
+CLEANING_OPS = ("parse_numeric", "fill_median", "fill_mode", "clip_outliers", "normalize", "drop_column")
+# Các bước chỉ có nghĩa trên cột số (hoặc cột đã parse_numeric trước đó)
+NUMERIC_OPS = ("fill_median", "clip_outliers", "normalize")
+
+NUMERIC_SAMPLE_SIZE = 1000
+MIN_NUMERIC_MATCH_RATE = 0.9
+CURRENCY_PATTERN = r"[$€£¥₫₹]|USD|EUR|GBP|JPY|VND"
+# (dấu thập phân, dấu phân cách nghìn) → mẫu số hợp lệ sau khi bỏ tiền tệ/khoảng trắng/%
+NUMBER_PATTERNS = {
+    (".", ","): r"[+-]?(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d+)?|[+-]?\.\d+",
+    (",", "."): r"[+-]?(?:\d{1,3}(?:\.\d{3})+|\d+)(?:,\d+)?|[+-]?,\d+",
+}
+DEFAULT_NUMBER_FORMAT = {"decimal": ".", "thousands": ","}
+OPERATIONS_COLUMN_TOKENS = 1000
+
+
+def operations_prompt(plan, dtypes, budget=OPERATIONS_COLUMN_TOKENS):
+    """Prompt chuyển kế hoạch làm sạch (văn bản) thành danh sách bước có kiểu.
+
+    Danh sách cột giới hạn trong `budget` token; cột được nhắc tới trong kế hoạch đứng trước.
+    """
+    ordered = sorted(dtypes.items(), key=lambda item: str(item[0]) not in plan)
+    columns = fit_lines([f"- {json.dumps(str(col), ensure_ascii=False)}: {dtype}" for col, dtype in ordered], budget,
+                        overflow="... and {n} more columns not mentioned in the plan")
+    return f"""Convert the cleaning plan below into a JSON object {{"operations": [...]}}.
+Each operation is {{"op": <one of {list(CLEANING_OPS)}>, "column": <exact column name>}}, in the order to apply them:
+- parse_numeric: turn strings like '1,000', '$2,500.50', '12%' or '1.234,5' into numbers (text columns only)
+- fill_median / fill_mode: fill missing values with the column median / most frequent value
+- clip_outliers: clip values outside Q1 - 1.5*IQR .. Q3 + 1.5*IQR
+- normalize: min-max scale to [0, 1]
+- drop_column: remove the column
+
+Columns and dtypes:
+{columns}
+
+Cleaning plan:
+{plan}
+
+Return only the JSON object."""
+
+
+def parse_operations(response_text, dtypes):
+    """Đọc JSON từ LLM, bỏ các bước không hợp lệ (op lạ, cột không tồn tại, bước số trên cột chữ)."""
+    text = re.sub(r"^```(?:json)?|```$", "", response_text.strip()).strip()
+    try:
+        payload = json.loads(text)
+    except json.JSONDecodeError:
+        return []
+    raw_ops = payload.get("operations", []) if isinstance(payload, dict) else payload
+    numeric = {str(col) for col, dtype in dtypes.items() if pd.api.types.is_numeric_dtype(dtype)
+               and not pd.api.types.is_bool_dtype(dtype)}
+    operations = []
+    for op in raw_ops if isinstance(raw_ops, list) else []:
+        if not isinstance(op, dict) or op.get("op") not in CLEANING_OPS or str(op.get("column")) not in map(str, dtypes):
+            continue
+        column = str(op["column"])
+        if op["op"] == "parse_numeric":
+            numeric.add(column)
+        elif op["op"] in NUMERIC_OPS and column not in numeric:
+            continue
+        operations.append({"op": op["op"], "column": column})
+    return operations
+
+
+def _hash(payload):
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def plan_hash(operations):
+    return _hash(operations)
+
+
+def column_operations(operations):
+    """{cột: [op, ...]} theo thứ tự xuất hiện; cột bị drop chỉ còn ["drop_column"]."""
+    per_column = {}
+    for op in operations:
+        ops = per_column.setdefault(op["column"], [])
+        if "drop_column" not in ops:
+            ops.append(op["op"])
+    return {col: (["drop_column"] if "drop_column" in ops else ops) for col, ops in per_column.items()}
+
+
+def cleaning_stats(dataset_profile):
+    """Thống kê của frame gốc lấy từ profile đã lưu: {cột: {median, q1, q3, min, max, mode}}."""
+    stats = {}
+    for record in dataset_profile["columns"]:
+        col = record["name"]
+        describe = dataset_profile["describe"].get(col, {})
+        top = dataset_profile["distributions"].get(col, {})
+        stats[col] = {
+            "median": record.get("median"),
+            "q1": describe.get("25%"),
+            "q3": describe.get("75%"),
+            "min": record.get("min"),
+            "max": record.get("max"),
+            # top-k chỉ có cho cột không phải số; "NaN" không phải giá trị để điền
+            "mode": next((v for v in top.get("values", []) if v != "NaN"), None) if top.get("kind") == "top_values" else None,
+        }
+    return stats
+
+
+def _is_text(series: pd.Series):
+    return series.dtype == object or pd.api.types.is_string_dtype(series.dtype)
+
+
+def _strip_decorations(strings: pd.Series):
+    """Bỏ ký hiệu tiền tệ, khoảng trắng, dấu %; "(1,234)" → "-1,234". Trả về (chuỗi, mask phần trăm)."""
+    cleaned = strings.str.replace(CURRENCY_PATTERN + "|[\\s\u00a0\u202f']", "", regex=True)
+    cleaned = cleaned.str.replace(r"^\((.*)\)$", r"-\1", regex=True)
+    percent = cleaned.str.endswith("%").fillna(False).astype(bool)
+    return cleaned.str.rstrip("%"), percent
+
+
+def _match_rates(sample: pd.Series):
+    """{(dấu thập phân, dấu nghìn): tỉ lệ giá trị khớp} trên một sample không có null."""
+    if sample.empty:
+        return {}
+    cleaned, _ = _strip_decorations(sample.astype(str))
+    return {seps: float(cleaned.str.fullmatch(pattern).mean()) for seps, pattern in NUMBER_PATTERNS.items()}
+
+
+def numeric_match_rate(sample: pd.Series):
+    """Tỉ lệ giá trị trong sample đọc được thành số theo định dạng khớp nhiều nhất."""
+    return max(_match_rates(sample.dropna()).values(), default=0.0)
+
+
+def infer_numeric_format(series: pd.Series, sample_size=NUMERIC_SAMPLE_SIZE):
+    """Phân loại một cột chữ từ sample: có phải số không, và dùng dấu thập phân/nghìn nào.
+
+    Returns:
+        dict | None: {'decimal', 'thousands', 'match_rate'} nếu ít nhất
+            `MIN_NUMERIC_MATCH_RATE` giá trị trong sample khớp một định dạng số, không thì None.
+    """
+    rates = _match_rates(series.dropna().head(sample_size))
+    if not rates:
+        return None
+    # Hoà nhau (vd. "1234") → ưu tiên định dạng đầu tiên (dấu chấm thập phân)
+    (decimal, thousands), rate = max(rates.items(), key=lambda item: item[1])
+    if rate < MIN_NUMERIC_MATCH_RATE:
+        return None
+    return {"decimal": decimal, "thousands": thousands, "match_rate": rate}
+
+
+def convert_numeric_strings(series: pd.Series, number_format=None):
+    """Chuyển cả cột chữ sang số bằng các phép chuỗi vector hoá.
+
+    Returns:
+        tuple: (Series float64, tỉ lệ giá trị không rỗng chuyển được)
+    """
+    number_format = number_format or DEFAULT_NUMBER_FORMAT
+    cleaned, percent = _strip_decorations(series.astype(str))
+    cleaned = cleaned.str.replace(number_format["thousands"], "", regex=False)
+    if number_format["decimal"] != ".":
+        cleaned = cleaned.str.replace(number_format["decimal"], ".", regex=False)
+    values = pd.to_numeric(cleaned, errors="coerce").astype("float64")
+    values = values.where(~percent, values / 100).where(series.notna())
+    non_null = int(series.notna().sum())
+    success_rate = float(values.notna().sum() / non_null) if non_null else 1.0
+    return values, success_rate
+
+
+def detect_numeric_strings(df: pd.DataFrame):
+    """Các cột chữ thực chất là số: {cột: định dạng (xem `infer_numeric_format`)}."""
+    detected = {}
+    for col in df.columns:
+        if _is_text(df[col]):
+            number_format = infer_numeric_format(df[col])
+            if number_format is not None:
+                detected[str(col)] = number_format
+    return detected
+
+
+def fix_numeric_strings(df: pd.DataFrame):
+    """Chuyển mọi cột chữ được xác nhận là số (nghìn, tiền tệ, %, dấu thập phân theo locale).
+
+    Returns:
+        tuple: (frame đã chuyển, {cột: {'decimal', 'thousands', 'match_rate', 'success_rate'}})
+    """
+    converted, report = {}, {}
+    for col, number_format in detect_numeric_strings(df).items():
+        converted[col], success_rate = convert_numeric_strings(df[col], number_format)
+        report[col] = dict(number_format, success_rate=success_rate)
+    return (df.assign(**converted) if converted else df), report
+
+
+def parse_numeric(series: pd.Series):
+    if not _is_text(series):
+        return series
+    return convert_numeric_strings(series, infer_numeric_format(series))[0]
+
+
+def _mode(series: pd.Series):
+    modes = series.mode(dropna=True)
+    return modes.iloc[0] if len(modes) else None
+
+
+def clean_column(series: pd.Series, ops, stats=None):
+    """Áp lần lượt các bước lên một cột (vector hoá).
+
+    `stats` là thống kê của cột gốc; chỉ dùng khi cột chưa bị bước nào trước đó
+    thay đổi, còn lại tính trên giá trị hiện tại.
+    """
+    stats = stats or {}
+    touched = False
+    for op in ops:
+        if op == "parse_numeric":
+            parsed = parse_numeric(series)
+            touched = touched or parsed is not series
+            series = parsed
+            continue
+        if op == "fill_median":
+            median = stats.get("median") if not touched else None
+            series = series.fillna(series.median() if median is None or pd.isna(median) else median)
+        elif op == "fill_mode":
+            mode = stats.get("mode") if not touched else None
+            if mode is None or isinstance(series.dtype, pd.CategoricalDtype) and mode not in series.cat.categories:
+                mode = _mode(series)
+            if mode is not None:
+                series = series.fillna(mode)
+        elif op == "clip_outliers":
+            q1, q3 = (stats.get("q1"), stats.get("q3")) if not touched else (None, None)
+            if q1 is None or q3 is None:
+                q1, q3 = series.quantile(0.25), series.quantile(0.75)
+            iqr = q3 - q1
+            series = series.clip(q1 - 1.5 * iqr, q3 + 1.5 * iqr)
+        elif op == "normalize":
+            low, high = (stats.get("min"), stats.get("max")) if not touched else (None, None)
+            if low is None or high is None or pd.isna(low) or pd.isna(high):
+                low, high = series.min(), series.max()
+            span = high - low
+            series = (series - low) / span if span else series - low
+        touched = True
+    return series
+
+
+def apply_plan(df: pd.DataFrame, operations, stats=None, column_cache=None):
+    """Áp danh sách bước lên `df`, không copy cả frame.
+
+    Mỗi cột chỉ phụ thuộc vào chuỗi bước của chính nó, nên `column_cache(col, key, compute)`
+    (nếu có) cho phép dùng lại cột đã làm sạch ở kế hoạch trước khi chuỗi bước của cột
+    đó không đổi; chỉ các cột có bước thay đổi mới được tính lại.
+    """
+    stats = stats or {}
+    changed, dropped = {}, []
+    for col, ops in column_operations(operations).items():
+        if col not in df.columns:
+            continue
+        if ops == ["drop_column"]:
+            dropped.append(col)
+            continue
+
+        def compute(col=col, ops=ops):
+            return clean_column(df[col], ops, stats.get(col))
+
+        key = _hash([col, ops])
+        changed[col] = column_cache(col, key, compute) if column_cache else compute()
+    cleaned = df.assign(**changed) if changed else df
+    return cleaned.drop(columns=dropped) if dropped else cleaned
+
+
+def describe_operations(operations):
+    return pd.DataFrame(operations, columns=["op", "column"])
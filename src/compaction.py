@@ -0,0 +1,137 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from src.cleaning import numeric_match_rate
+
+COMPACT_DTYPES = os.environ.get("VUDA_COMPACT_DTYPES", "1") != "0"
+MAX_CATEGORY_RATIO = 0.5
+MAX_CATEGORIES = 1000
+DATE_SAMPLE_SIZE = 1000
+DATE_MIN_PARSE_RATE = 0.95
+MIN_INT_DTYPE = np.int32
+
+
+def _is_text(series):
+    return series.dtype == object or pd.api.types.is_string_dtype(series.dtype)
+
+
+def _looks_numeric(sample: pd.Series):
+    """Chuỗi như '1,234', '$12.5' hay '45%' để dành cho bước làm sạch số, không đổi sang category/datetime."""
+    return numeric_match_rate(sample) >= 0.5
+
+
+def _guess_date_format(sample: pd.Series):
+    try:
+        from pandas.tseries.api import guess_datetime_format
+    except ImportError:
+        return None
+    return guess_datetime_format(str(sample.iloc[0]))
+
+
+def _parses_fully(non_null: pd.Series, date_format):
+    try:
+        pd.to_datetime(non_null, format=date_format)
+    except (ValueError, TypeError):
+        return False
+    return True
+
+
+def _infer_text_column(series: pd.Series):
+    non_null = series.dropna()
+    if non_null.empty:
+        return None
+    sample = non_null.iloc[:DATE_SAMPLE_SIZE]
+    if _looks_numeric(sample):
+        return None
+
+    date_format = _guess_date_format(sample)
+    if date_format is not None:
+        parsed = pd.to_datetime(sample, format=date_format, errors='coerce')
+        # Mẫu chỉ để loại nhanh; schema datetime chỉ giữ khi mọi giá trị của cả cột parse được
+        if parsed.notna().mean() >= DATE_MIN_PARSE_RATE and _parses_fully(non_null, date_format):
+            return {'dtype': 'datetime64[ns]', 'format': date_format}
+
+    n_unique = non_null.nunique()
+    if n_unique <= MAX_CATEGORIES and n_unique <= MAX_CATEGORY_RATIO * len(non_null):
+        return {'dtype': 'category'}
+    return None
+
+
+def _infer_numeric_column(series: pd.Series):
+    if pd.api.types.is_bool_dtype(series.dtype):
+        return None
+    if pd.api.types.is_integer_dtype(series.dtype):
+        # Không xuống dưới int32: code LLM sinh ra hay nhân/cộng trực tiếp và int8/int16 dễ tràn
+        target = np.promote_types(pd.to_numeric(series, downcast='integer').dtype, MIN_INT_DTYPE)
+    elif pd.api.types.is_float_dtype(series.dtype) and series.dtype != np.float32:
+        as_float32 = series.astype(np.float32)
+        # Chỉ hạ xuống float32 khi không mất độ chính xác
+        lossless = ((as_float32.astype(series.dtype) == series) | series.isna()).all()
+        target = np.dtype(np.float32) if lossless else series.dtype
+    else:
+        return None
+    if target == series.dtype:
+        return None
+    return {'dtype': str(target)}
+
+
+def infer_compact_schema(df: pd.DataFrame):
+    """Chọn kiểu gọn hơn cho từng cột: category, số nguyên/thực nhỏ hơn, datetime.
+
+    Returns:
+        dict: {tên cột: {'dtype': ..., 'format': ... (chỉ với datetime)}} cho các cột cần đổi.
+    """
+    schema = {}
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_numeric_dtype(series.dtype):
+            spec = _infer_numeric_column(series)
+        elif _is_text(series):
+            spec = _infer_text_column(series)
+        else:
+            spec = None
+        if spec is not None:
+            schema[str(col)] = spec
+    return schema
+
+
+def apply_schema(df: pd.DataFrame, schema):
+    """Áp schema đã lưu; bỏ qua cột không còn tồn tại hoặc đã đúng kiểu."""
+    converted = {}
+    for col, spec in schema.items():
+        if col not in df.columns or str(df[col].dtype) == spec['dtype']:
+            continue
+        if spec['dtype'].startswith('datetime64') and pd.api.types.is_datetime64_any_dtype(df[col].dtype):
+            continue
+        try:
+            if spec['dtype'].startswith('datetime64'):
+                series = pd.to_datetime(df[col], format=spec.get('format'))
+            else:
+                series = df[col].astype(spec['dtype'])
+        except (ValueError, TypeError) as e:
+            print(f"Skipped dtype compaction for column {col}: {e}")
+            continue
+        # Không bao giờ đổi giá trị thành NaN/NaT: giữ cột gốc nếu số giá trị thiếu thay đổi
+        if series.isna().sum() != df[col].isna().sum():
+            print(f"Skipped dtype compaction for column {col}: conversion would lose values")
+            continue
+        converted[col] = series
+    if not converted:
+        return df
+    return df.assign(**converted)
+
+
+def compact_dtypes(df: pd.DataFrame, schema=None):
+    """Thu gọn kiểu dữ liệu của `df`.
+
+    Returns:
+        tuple: (frame đã thu gọn, schema đã dùng, số byte tiết kiệm được)
+    """
+    if schema is None:
+        schema = infer_compact_schema(df)
+    before = int(df.memory_usage(index=True, deep=True).sum())
+    compacted = apply_schema(df, schema)
+    after = int(compacted.memory_usage(index=True, deep=True).sum())
+    return compacted, schema, before - after
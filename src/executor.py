@@ -0,0 +1,286 @@
+import hashlib
+import io
+import multiprocessing
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+EXEC_WORKERS = int(os.environ.get("VUDA_EXEC_WORKERS", 2))
+EXEC_TIMEOUT = float(os.environ.get("VUDA_EXEC_TIMEOUT", 30))
+# Giới hạn bộ nhớ mỗi worker (RLIMIT_DATA); 0 = không giới hạn
+EXEC_MEMORY_MB = int(os.environ.get("VUDA_EXEC_MEMORY_MB", 4096))
+WORKER_FRAME_SLOTS = 4
+POLL_INTERVAL = 0.1
+
+
+class ExecutionError(RuntimeError):
+    """Code do LLM sinh chạy lỗi (hoặc worker chết) trong process thực thi."""
+
+
+class ExecutionTimeout(ExecutionError):
+    pass
+
+
+def encode_frame(df: pd.DataFrame):
+    """DataFrame → Arrow IPC; cột object không chuyển được sang Arrow thì dùng pickle."""
+    import pyarrow as pa
+
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=True)
+    except (pa.ArrowException, TypeError, ValueError):
+        return "pickle", pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return "arrow", sink.getvalue().to_pybytes()
+
+
+def decode_frame(encoded):
+    import pyarrow as pa
+
+    fmt, data = encoded
+    if fmt == "pickle":
+        return pickle.loads(data)
+    return pa.ipc.open_stream(data).read_all().to_pandas()
+
+
+def frame_fingerprint(df: pd.DataFrame):
+    """Khoá nhận diện nội dung frame, để worker biết đã có sẵn frame này hay chưa."""
+    hasher = hashlib.sha1()
+    hasher.update(repr((list(map(str, df.columns)), list(map(str, df.dtypes)), df.shape)).encode())
+    try:
+        hasher.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    except TypeError:
+        # Giá trị không băm được (list, dict...) → khoá theo object, chỉ dùng lại trong cùng lượt
+        hasher.update(str(id(df)).encode())
+    return hasher.hexdigest()
+
+
+def _limit_memory(memory_mb):
+    if not memory_mb:
+        return
+    try:
+        import resource
+    except ImportError:
+        return  # Windows: không có rlimit
+    limit = memory_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_DATA, (limit, limit))
+
+
+def _run_job(job, frames):
+    import matplotlib.pyplot as plt
+    import numpy as np
+    import seaborn as sns
+
+    df = frames[job["frame_key"]]
+    frames.move_to_end(job["frame_key"])
+    env = {"df": df.copy(), "pd": pd, "np": np, "plt": plt, "sns": sns}
+    plt.close("all")
+    try:
+        exec(compile(job["code"], "<generated>", "exec"), env)
+        fig = plt.gcf()
+        if not fig.get_axes():
+            return {"image": None}
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format="png", bbox_inches="tight")
+        return {"image": buffer.getvalue()}
+    finally:
+        plt.close("all")
+
+
+def _worker_main(conn, memory_mb):
+    """Vòng lặp của worker: import sẵn thư viện nặng, giữ vài frame gần nhất, chạy từng job."""
+    _limit_memory(memory_mb)
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot  # noqa: F401
+    import seaborn  # noqa: F401
+
+    frames = OrderedDict()
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        try:
+            if job.get("frame") is not None:
+                frames[job["frame_key"]] = decode_frame(job["frame"])
+                while len(frames) > WORKER_FRAME_SLOTS:
+                    frames.popitem(last=False)
+            # Job không có code chỉ để nạp sẵn frame (xem `CodeExecutor.preload`)
+            result = _run_job(job, frames) if job["code"] is not None else {"image": None}
+        except MemoryError:
+            result = {"error": f"Memory limit of {memory_mb} MB exceeded."}
+        except Exception as e:
+            result = {"error": f"{type(e).__name__}: {e}"}
+        conn.send(result)
+
+
+class _Worker:
+    def __init__(self, context, memory_mb):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn, memory_mb), daemon=True)
+        self.process.start()
+        child_conn.close()
+        # Các frame worker đang giữ, cùng thứ tự LRU với phía worker
+        self.frame_keys = OrderedDict()
+
+    def has_frame(self, key):
+        return key in self.frame_keys
+
+    def remember_frame(self, key):
+        self.frame_keys[key] = True
+        self.frame_keys.move_to_end(key)
+        while len(self.frame_keys) > WORKER_FRAME_SLOTS:
+            self.frame_keys.popitem(last=False)
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout=5)
+        self.conn.close()
+
+
+class CodeExecutor:
+    """Chạy code pandas/matplotlib do LLM sinh trong các process worker giữ ấm.
+
+    Mỗi job có timeout và giới hạn bộ nhớ; worker bị kill và thay mới khi quá
+    hạn, chết, hoặc khi Streamlit dừng script giữa chừng (rerun). Worker giữ sẵn
+    vài frame gần nhất (nạp trước bằng `preload`) nên lần chạy sau trên cùng
+    dataset không phải gửi lại dữ liệu.
+    """
+
+    def __init__(self, workers=EXEC_WORKERS, timeout=EXEC_TIMEOUT, memory_mb=EXEC_MEMORY_MB):
+        self.max_workers = max(1, workers)
+        self.timeout = timeout
+        self.memory_mb = memory_mb
+        self._context = multiprocessing.get_context("spawn")
+        self._idle = []
+        self._started = 0
+        self._cond = threading.Condition()
+
+    def _acquire(self, frame_key):
+        with self._cond:
+            while True:
+                for worker in self._idle:
+                    if worker.has_frame(frame_key):
+                        self._idle.remove(worker)
+                        return worker
+                if self._started < self.max_workers:
+                    self._started += 1
+                    break
+                if self._idle:
+                    return self._idle.pop()
+                self._cond.wait()
+        try:
+            return _Worker(self._context, self.memory_mb)
+        except Exception:
+            with self._cond:
+                self._started -= 1
+                self._cond.notify()
+            raise
+
+    def _release(self, worker, healthy):
+        with self._cond:
+            if healthy:
+                self._idle.append(worker)
+            else:
+                worker.kill()
+                self._started -= 1
+            self._cond.notify()
+
+    def _has_idle_frame(self, frame_key):
+        with self._cond:
+            return any(worker.has_frame(frame_key) for worker in self._idle)
+
+    def preload(self, df: pd.DataFrame, frame_key=None):
+        """Nạp trước `df` vào một worker (chạy nền), để lần vẽ đầu tiên trên dataset
+        không phải chờ spawn worker hay gửi dữ liệu.
+
+        Returns:
+            str: Khoá frame, truyền lại cho `run` để khỏi tính lại.
+        """
+        frame_key = frame_key or frame_fingerprint(df)
+        if not self._has_idle_frame(frame_key):
+            threading.Thread(target=self._preload, args=(df, frame_key), daemon=True).start()
+        return frame_key
+
+    def _preload(self, df, frame_key):
+        try:
+            self._submit(None, df, frame_key, self.timeout)
+        except ExecutionError as e:
+            print(f"Failed to preload frame into execution worker: {e}")
+
+    def run(self, code, df: pd.DataFrame, frame_key=None, timeout=None):
+        """Chạy code vẽ `code` với biến `df` (bản sao trong worker).
+
+        Args:
+            frame_key: khoá nội dung của `df` (vd. từ `preload`); mặc định tính bằng `frame_fingerprint`.
+
+        Returns:
+            bytes | None: Ảnh PNG của figure hiện tại, None nếu code không vẽ gì.
+
+        Raises:
+            ExecutionError / ExecutionTimeout
+        """
+        frame_key = frame_key or frame_fingerprint(df)
+        timeout = self.timeout if timeout is None else timeout
+        result = self._submit(code, df, frame_key, timeout)
+        if "error" in result:
+            raise ExecutionError(result["error"])
+        return result["image"]
+
+    def _send(self, worker, job, df):
+        if not worker.has_frame(job["frame_key"]):
+            job = dict(job, frame=encode_frame(df))
+        worker.conn.send(job)
+        worker.remember_frame(job["frame_key"])
+
+    def _submit(self, code, df, frame_key, timeout):
+        job = {"code": code, "frame_key": frame_key, "frame": None}
+        worker = self._acquire(frame_key)
+        healthy = False
+        try:
+            try:
+                self._send(worker, job, df)
+            except (BrokenPipeError, OSError):
+                # Worker chết khi đang rảnh: job chưa chạy nên thử lại trên worker mới
+                self._release(worker, healthy=False)
+                worker = self._acquire(frame_key)
+                try:
+                    self._send(worker, job, df)
+                except (BrokenPipeError, OSError) as e:
+                    raise ExecutionError(f"Could not reach execution worker: {e}") from e
+
+            deadline = time.monotonic() + timeout
+            try:
+                while not worker.conn.poll(POLL_INTERVAL):
+                    if time.monotonic() > deadline:
+                        raise ExecutionTimeout(f"Execution exceeded {timeout:.0f}s and was stopped.")
+                    if not worker.process.is_alive():
+                        raise ExecutionError("Execution worker crashed (possibly out of memory).")
+                result = worker.conn.recv()
+            except (EOFError, OSError) as e:
+                raise ExecutionError("Execution worker crashed (possibly out of memory).") from e
+            healthy = True
+        finally:
+            # Mọi lỗi giữa chừng (kể cả Streamlit dừng script khi rerun) → kill worker đang chạy dở
+            self._release(worker, healthy)
+        return result
+
+    def shutdown(self):
+        with self._cond:
+            for worker in self._idle:
+                worker.kill()
+            self._started -= len(self._idle)
+            self._idle = []
+
+
+code_executor = CodeExecutor()
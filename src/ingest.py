@@ -0,0 +1,285 @@
+import hashlib
+import io
+import os
+from uuid import uuid4
+
+import pandas as pd
+
+from src.loader import (
+    FALLBACK_ENCODINGS,
+    SNIFF_BYTES,
+    UPLOAD_DIR,
+    blob_path_for,
+    columnar_path_for,
+    csv_read_options,
+    detect_csv_format_from_sample,
+    label_columns,
+)
+from src.sampling import ReservoirSampler, sample_path_for
+from src.sketches import HyperLogLog, KLLSketch, dump_sketch
+
+CHUNK_ROWS = 100_000
+COPY_BYTES = 8 * 1024 * 1024
+
+
+class _TeeReader(io.RawIOBase):
+    """Đọc byte từ file upload cho parser, đồng thời ghi từng đoạn xuống đĩa và băm SHA-256."""
+
+    def __init__(self, prefix, source, sink):
+        self._prefix = prefix
+        self._source = source
+        self._sink = sink
+        self.hasher = hashlib.sha256(prefix)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._prefix:
+            data = self._prefix[:len(buffer)]
+            self._prefix = self._prefix[len(buffer):]
+        else:
+            data = self._source.read(len(buffer))
+            self._sink.write(data)
+            self.hasher.update(data)
+        buffer[:len(data)] = data
+        return len(data)
+
+    def drain(self):
+        """Ghi nốt phần còn lại (parser có thể dừng trước khi hết file)."""
+        while True:
+            data = self._source.read(COPY_BYTES)
+            if not data:
+                break
+            self._sink.write(data)
+            self.hasher.update(data)
+
+
+class StatsAccumulator:
+    """Thống kê theo cột cộng dồn qua từng chunk: số dòng, null, min/max, distinct xấp xỉ.
+
+    Kèm sketch HyperLogLog (mọi cột) và KLL (cột số) đã serialize để lưu cùng
+    dataset; profile của dataset lớn đọc lại chúng thay vì quét cả frame.
+    """
+
+    def __init__(self):
+        self.num_rows = 0
+        self.columns = {}
+
+    def update(self, chunk: pd.DataFrame):
+        self.num_rows += len(chunk)
+        null_counts = chunk.isna().sum()
+        numeric = chunk.select_dtypes(include='number')
+        mins, maxs = numeric.min(), numeric.max()
+
+        for col in chunk.columns:
+            stats = self.columns.get(col)
+            if stats is None:
+                stats = self.columns[col] = {
+                    'dtype': str(chunk[col].dtype),
+                    'null_count': 0,
+                    'min': None,
+                    'max': None,
+                    'numeric': True,
+                    'hll': HyperLogLog(),
+                    'kll': KLLSketch(),
+                }
+            stats['null_count'] += int(null_counts[col])
+            stats['hll'].update(chunk[col])
+            if col not in numeric.columns:
+                # Một chunk không phải số (vd. có chuỗi lẫn vào) → cả cột không phải số
+                if chunk[col].notna().any():
+                    stats['numeric'] = False
+                    stats['dtype'] = str(chunk[col].dtype)
+                    stats['kll'] = None
+                continue
+            if stats['kll'] is not None:
+                stats['kll'].update(chunk[col].to_numpy(dtype='float64', na_value=float('nan')))
+            if pd.notna(mins[col]):
+                stats['min'] = mins[col] if stats['min'] is None else min(stats['min'], mins[col])
+                stats['max'] = maxs[col] if stats['max'] is None else max(stats['max'], maxs[col])
+
+    def result(self):
+        columns = []
+        for col, stats in self.columns.items():
+            is_numeric = stats['numeric'] and stats['min'] is not None
+            columns.append({
+                'name': str(col),
+                'dtype': stats['dtype'],
+                'null_count': stats['null_count'],
+                'min': float(stats['min']) if is_numeric else None,
+                'max': float(stats['max']) if is_numeric else None,
+                'approx_distinct': stats['hll'].estimate(),
+                'hll_sketch': dump_sketch(stats['hll']),
+                'quantile_sketch': dump_sketch(stats['kll']) if is_numeric and stats['kll'] is not None else None,
+            })
+        return {'num_rows': self.num_rows, 'num_cols': len(columns), 'columns': columns}
+
+
+class _ColumnarWriter:
+    """Ghi bản sao Parquet theo từng chunk; bỏ cuộc nếu kiểu dữ liệu giữa các chunk không khớp."""
+
+    def __init__(self, columnar_path):
+        self.columnar_path = columnar_path
+        self._tmp_path = columnar_path + ".tmp" if columnar_path else None
+        self._writer = None
+        self._schema = None
+        self.failed = columnar_path is None
+
+    def write(self, chunk: pd.DataFrame):
+        if self.failed:
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        try:
+            table = pa.Table.from_pandas(chunk, schema=self._schema, preserve_index=False)
+            if self._writer is None:
+                self._schema = table.schema
+                self._writer = pq.ParquetWriter(self._tmp_path, self._schema)
+            self._writer.write_table(table)
+        except (pa.ArrowException, ValueError, TypeError) as e:
+            # load_dataset sẽ build lại từ CSV ở lần đọc đầu tiên
+            print(f"Deferred columnar copy {self.columnar_path}: {e}")
+            self.abort()
+
+    def abort(self):
+        self.failed = True
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._tmp_path and os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+    def close(self):
+        if self.failed or self._writer is None:
+            self.abort()
+            return None
+        self._writer.close()
+        os.replace(self._tmp_path, self.columnar_path)
+        return self.columnar_path
+
+
+def _scan(source, csv_format, chunk_rows, on_chunk):
+    reader = pd.read_csv(
+        source,
+        encoding=csv_format['encoding'],
+        chunksize=chunk_rows,
+        **csv_read_options(csv_format),
+    )
+    with reader:
+        for chunk in reader:
+            on_chunk(label_columns(chunk, csv_format))
+
+
+def _write_sample(sampler, sample_path):
+    sample = sampler.result()
+    if sample_path is None or sample.empty:
+        return None
+    sample.to_parquet(sample_path, engine="pyarrow", index=False)
+    return sample_path
+
+
+def ingest_upload(source, dest_path, columnar_path=None, chunk_rows=CHUNK_ROWS, sample_path=None):
+    """Stream file upload xuống `dest_path` và tính thống kê trong cùng một lượt đọc.
+
+    Bộ nhớ chỉ giữ một chunk `chunk_rows` dòng tại một thời điểm. Nếu có
+    `columnar_path`, bản sao Parquet cũng được ghi trong cùng lượt; nếu có
+    `sample_path`, sample đều (reservoir) cũng vậy.
+
+    Returns:
+        tuple: (content_hash, csv_format, stats, columnar_path hoặc None)
+    """
+    if hasattr(source, "seek"):
+        source.seek(0)
+    stats = StatsAccumulator()
+    writer = _ColumnarWriter(columnar_path)
+    sampler = ReservoirSampler()
+
+    def on_chunk(chunk):
+        stats.update(chunk)
+        writer.write(chunk)
+        sampler.update(chunk)
+
+    with open(dest_path, "wb") as sink:
+        prefix = source.read(SNIFF_BYTES)
+        sink.write(prefix)
+        csv_format = detect_csv_format_from_sample(prefix, truncated=len(prefix) == SNIFF_BYTES)
+        tee = _TeeReader(prefix, source, sink)
+        try:
+            _scan(io.BufferedReader(tee, COPY_BYTES), csv_format, chunk_rows, on_chunk)
+            decode_error = None
+        except UnicodeDecodeError as e:
+            decode_error = e
+        tee.drain()
+
+    if decode_error is not None:
+        # Byte lỗi nằm sau phần mẫu: file đã nằm trên đĩa, quét lại với encoding 8-bit
+        writer.abort()
+        csv_format, stats, writer, sampler = _rescan_with_fallback(
+            dest_path, csv_format, columnar_path, chunk_rows, decode_error)
+
+    _write_sample(sampler, sample_path)
+    return tee.hasher.hexdigest(), csv_format, stats.result(), writer.close()
+
+
+def store_upload(source, upload_dir=UPLOAD_DIR, chunk_rows=CHUNK_ROWS):
+    """Ingest file upload rồi lưu theo hash nội dung: `<upload_dir>/<sha256>.csv`.
+
+    Nếu blob cùng nội dung đã tồn tại, file vừa ghi bị bỏ và blob cũ (cùng các
+    artifact dẫn xuất nằm cạnh nó như bản Parquet) được dùng lại.
+
+    Returns:
+        dict: content_hash, path, columnar_path, csv_format, stats, duplicate
+    """
+    incoming_path = os.path.join(upload_dir, f".incoming_{uuid4().hex}.csv")
+    incoming_sample = sample_path_for(incoming_path)
+    content_hash, csv_format, stats, built_columnar = ingest_upload(
+        source, incoming_path, columnar_path_for(incoming_path), chunk_rows, sample_path=incoming_sample)
+
+    blob_path = blob_path_for(content_hash, upload_dir)
+    columnar_path = columnar_path_for(blob_path)
+    duplicate = os.path.exists(blob_path)
+    artifacts = [(incoming_sample, sample_path_for(blob_path))]
+    if built_columnar:
+        artifacts.append((built_columnar, columnar_path))
+    if duplicate:
+        os.remove(incoming_path)
+        for incoming, _ in artifacts:
+            if os.path.exists(incoming):
+                os.remove(incoming)
+    else:
+        os.replace(incoming_path, blob_path)
+        for incoming, final in artifacts:
+            if os.path.exists(incoming):
+                os.replace(incoming, final)
+    return {
+        'content_hash': content_hash,
+        'path': blob_path,
+        'columnar_path': columnar_path if os.path.exists(columnar_path) else None,
+        'csv_format': csv_format,
+        'stats': stats,
+        'duplicate': duplicate,
+    }
+
+
+def _rescan_with_fallback(file_path, csv_format, columnar_path, chunk_rows, error):
+    for enc in FALLBACK_ENCODINGS:
+        if enc == csv_format['encoding']:
+            continue
+        candidate = dict(csv_format, encoding=enc)
+        stats = StatsAccumulator()
+        writer = _ColumnarWriter(columnar_path)
+        sampler = ReservoirSampler()
+
+        def on_chunk(chunk):
+            stats.update(chunk)
+            writer.write(chunk)
+            sampler.update(chunk)
+
+        try:
+            _scan(file_path, candidate, chunk_rows, on_chunk)
+            return candidate, stats, writer, sampler
+        except UnicodeDecodeError:
+            writer.abort()
+    raise error
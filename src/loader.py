@@ -0,0 +1,203 @@
+import codecs
+import csv
+import glob
+import os
+import re
+
+import pandas as pd
+
+UPLOAD_DIR = os.path.join("data", "uploads")
+COLUMNAR_EXT = ".parquet"
+SNIFF_BYTES = 256 * 1024
+FALLBACK_ENCODINGS = ['utf-8', 'cp1252', 'ISO-8859-1']
+CSV_FORMAT_FIELDS = ('encoding', 'delimiter', 'quotechar', 'header_row', 'decimal_sep')
+
+_COMMA_DECIMAL = re.compile(r"^-?\d+,\d+$")
+_DOT_DECIMAL = re.compile(r"^-?\d+\.\d+$")
+
+
+def resolve_path(path):
+    """Chuẩn hoá đường dẫn lưu trong DB (có thể được ghi trên Windows với dấu `\\`)."""
+    return os.path.normpath(path.replace("\\", "/"))
+
+
+def _detect_encoding(sample: bytes):
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+    for enc in ['utf-8', 'cp1252']:
+        try:
+            # final=False: mẫu có thể cắt ngang một ký tự nhiều byte ở cuối
+            codecs.getincrementaldecoder(enc)().decode(sample, final=False)
+            return enc
+        except UnicodeDecodeError:
+            continue
+    return 'ISO-8859-1'  # giải mã được mọi chuỗi byte
+
+
+def _is_number(cell):
+    try:
+        float(cell.replace(',', '.'))
+        return True
+    except ValueError:
+        return False
+
+
+def _detect_decimal_sep(rows, delimiter):
+    if delimiter == ',':
+        return '.'
+    cells = [cell.strip() for row in rows for cell in row]
+    comma = sum(1 for cell in cells if _COMMA_DECIMAL.match(cell))
+    dot = sum(1 for cell in cells if _DOT_DECIMAL.match(cell))
+    return ',' if comma > dot else '.'
+
+
+def detect_csv_format(file_path, sample_bytes=SNIFF_BYTES):
+    """Dò encoding, delimiter, quotechar, dòng header và dấu thập phân từ phần đầu file.
+
+    Chỉ đọc `sample_bytes` đầu tiên nên chạy được một lần lúc upload; kết quả
+    được lưu vào bảng `datasets` để các lần đọc sau chỉ cần parse một lần.
+    """
+    with open(file_path, "rb") as f:
+        sample = f.read(sample_bytes)
+    return detect_csv_format_from_sample(sample, truncated=len(sample) == sample_bytes)
+
+
+def detect_csv_format_from_sample(sample: bytes, truncated=True):
+    """Như `detect_csv_format` nhưng nhận trực tiếp các byte đầu file (dùng khi đang stream upload)."""
+    encoding = _detect_encoding(sample)
+    text = codecs.getincrementaldecoder(encoding)(errors="replace").decode(sample, final=False)
+    # Bỏ dòng cuối có thể bị cắt dở
+    lines = text.splitlines()
+    if len(lines) > 1 and truncated:
+        lines = lines[:-1]
+    text = "\n".join(lines)
+
+    sniffer = csv.Sniffer()
+    try:
+        dialect = sniffer.sniff(text, delimiters=",;\t|")
+        delimiter, quotechar = dialect.delimiter, dialect.quotechar or '"'
+    except csv.Error:
+        delimiter, quotechar = ',', '"'
+    rows = list(csv.reader(lines[:200], delimiter=delimiter, quotechar=quotechar))
+    try:
+        has_header = sniffer.has_header(text)
+    except csv.Error:
+        has_header = True
+    if not has_header and rows:
+        # Sniffer coi bảng toàn cột chữ là không có header; chỉ tin nó khi
+        # dòng đầu chứa giá trị số (tên cột hầu như không bao giờ là số)
+        has_header = not any(_is_number(cell) for cell in rows[0])
+
+    return {
+        'encoding': encoding,
+        'delimiter': delimiter,
+        'quotechar': quotechar,
+        'header_row': 0 if has_header else None,
+        'decimal_sep': _detect_decimal_sep(rows[1:], delimiter),
+    }
+
+
+def csv_read_options(csv_format):
+    """Tham số `pd.read_csv` (trừ encoding) tương ứng với định dạng đã dò."""
+    return dict(
+        sep=csv_format['delimiter'],
+        quotechar=csv_format['quotechar'],
+        header=csv_format['header_row'],
+        decimal=csv_format['decimal_sep'],
+    )
+
+
+def label_columns(df: pd.DataFrame, csv_format):
+    """File không có header: đặt tên cột `column_0`, `column_1`, ... thay cho nhãn số nguyên.
+
+    Mọi bước sau (kế hoạch làm sạch, schema thu gọn, bản Parquet) tra cột theo tên chuỗi.
+    """
+    if csv_format['header_row'] is None:
+        df.columns = [f"column_{i}" for i in range(len(df.columns))]
+    return df
+
+
+def read_csv_file(file_path, csv_format=None, **kwargs):
+    """Đọc CSV bằng một lần parse theo định dạng đã dò (dò ngay nếu chưa có)."""
+    if csv_format is None:
+        csv_format = detect_csv_format(file_path)
+    options = csv_read_options(csv_format)
+    options.update(kwargs)
+    try:
+        return label_columns(pd.read_csv(file_path, encoding=csv_format['encoding'], **options), csv_format)
+    except UnicodeDecodeError:
+        # Byte lỗi nằm sau phần mẫu đã dò → thử các encoding 8-bit
+        for enc in FALLBACK_ENCODINGS:
+            if enc == csv_format['encoding']:
+                continue
+            try:
+                return label_columns(pd.read_csv(file_path, encoding=enc, **options), csv_format)
+            except UnicodeDecodeError:
+                continue
+    raise UnicodeDecodeError("utf-8", b"", 0, 1, "Unable to decode file with common encodings.")
+
+
+def blob_path_for(content_hash, upload_dir=UPLOAD_DIR):
+    """Đường dẫn lưu file upload theo hash nội dung."""
+    return os.path.join(upload_dir, f"{content_hash}.csv")
+
+
+def remove_blob(csv_path):
+    """Xoá blob CSV cùng mọi artifact dẫn xuất cùng tên gốc (`<hash>.parquet`, `<hash>.*`)."""
+    stem = os.path.splitext(resolve_path(csv_path))[0]
+    for path in glob.glob(glob.escape(stem) + ".*"):
+        os.remove(path)
+
+
+def columnar_path_for(csv_path):
+    """Đường dẫn bản sao dạng cột nằm cạnh file CSV trong `data/uploads`."""
+    return os.path.splitext(resolve_path(csv_path))[0] + COLUMNAR_EXT
+
+
+def is_columnar_stale(csv_path, columnar_path):
+    """Bản sao dạng cột cần build lại nếu chưa có hoặc cũ hơn file CSV gốc."""
+    if not columnar_path or not os.path.exists(columnar_path):
+        return True
+    return os.path.getmtime(columnar_path) < os.path.getmtime(csv_path)
+
+
+def build_columnar_copy(df: pd.DataFrame, columnar_path: str):
+    """Ghi `df` ra Parquet, trả về đường dẫn hoặc None nếu dữ liệu không ghi được dạng cột.
+
+    File được ghi ra file tạm rồi đổi tên, nên trang khác đang đọc không bao giờ
+    thấy một file Parquet ghi dở.
+    """
+    tmp_path = columnar_path + ".tmp"
+    try:
+        df.to_parquet(tmp_path, engine="pyarrow", index=False)
+        os.replace(tmp_path, columnar_path)
+        return columnar_path
+    except Exception as e:
+        # Cột object chứa kiểu lẫn lộn không chuyển được sang Arrow → giữ CSV
+        print(f"Failed to build columnar copy {columnar_path}: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
+
+
+def read_columnar(columnar_path, columns=None):
+    """Đọc bản sao Parquet bằng memory-map, chỉ lấy các cột cần thiết nếu có `columns`."""
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(columnar_path, columns=columns, memory_map=True)
+    return table.to_pandas()
+
+
+def read_preview(csv_path, columnar_path=None, csv_format=None, n=5):
+    """Đọc `n` dòng đầu: từ batch đầu của bản Parquet nếu còn mới, không thì `nrows` trên CSV."""
+    if not is_columnar_stale(csv_path, columnar_path):
+        import pyarrow.parquet as pq
+
+        parquet_file = pq.ParquetFile(columnar_path, memory_map=True)
+        batch = next(parquet_file.iter_batches(batch_size=n), None)
+        if batch is None:
+            return parquet_file.schema_arrow.empty_table().to_pandas()
+        return batch.to_pandas()
+    return read_csv_file(csv_path, csv_format=csv_format, nrows=n)
@@ -1,53 +1,450 @@
+import hashlib
+import json
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
 from langchain_openai import ChatOpenAI
 from langchain_experimental.agents import create_pandas_dataframe_agent
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import AIMessage, HumanMessage
+import numpy as np
 import pandas as pd
-from src.utils import safe_read_csv
+from src.models.offline import LLM_BACKENDS, CannedChatModel, RecordingChatModel, ReplayChatModel
+from src.prompt_context import head_rows_within_budget
+from src.utils import add_cached_response, get_cached_response
+
+AGENT_IDLE_SECONDS = int(os.environ.get("VUDA_AGENT_IDLE_SECONDS", 600))
+MAX_POOLED_AGENTS = int(os.environ.get("VUDA_MAX_POOLED_AGENTS", 16))
+AGENT_HEAD_TOKENS = 800
+LLM_BACKEND = os.environ.get("VUDA_LLM_BACKEND", "openai")
+LLM_CACHE_ENABLED = os.environ.get("VUDA_LLM_CACHE", "1") != "0"
+LLM_CACHE_TTL = int(os.environ.get("VUDA_LLM_CACHE_TTL", 7 * 24 * 3600))
+LLM_CACHE_MAX_BYTES = int(os.environ.get("VUDA_LLM_CACHE_BYTES", 64 * 1024 ** 2))
+# Số request LLM tối đa đang chạy cùng lúc cho cả process (mọi phiên cộng lại)
+LLM_MAX_IN_FLIGHT = int(os.environ.get("VUDA_LLM_MAX_IN_FLIGHT", 8))
+# Tăng khi đổi template prompt dùng chung để bỏ các câu trả lời cũ
+PROMPT_VERSION = "1"
+
+_llm_lock = threading.Lock()
+_llms = {}
+_cached_llms = {}
 
 
+def response_cache_enabled(backend=None):
+    """Cache câu trả lời có bật cho `backend` không: khi ghi lại request ("record"),
+    cache không được chặn lời gọi tới model thật."""
+    return LLM_CACHE_ENABLED and (backend or LLM_BACKEND) != "record"
 
-def load_llm(model_name):
+
+def load_llm(model_name, cache=True, backend=None):
     """Load Large Language Model.
 
+    Mỗi (model, backend) chỉ được tạo một lần cho cả process, nên mọi trang và
+    mọi phiên dùng chung HTTP client (và connection pool) của nó.
+
     Args:
         model_name (str): The name of the model to load.
+        cache (bool): Bọc model bằng `CachedLLM` (cache câu trả lời trong SQLite).
+        backend (str): "openai", hoặc backend offline "record" / "replay" / "canned"
+            (xem `src.models.offline`). Mặc định lấy từ `VUDA_LLM_BACKEND`.
 
     Raises:
-        ValueError: If the model_name is not recognized.
+        ValueError: If the model_name or backend is not recognized.
 
     Returns:
-        ChatOpenAI: An instance of ChatOpenAI configured for the specified model.
+        CachedLLM | BaseChatModel: The model, wrapped in the response cache unless `cache=False`.
     """
+    backend = backend or LLM_BACKEND
+    if backend not in LLM_BACKENDS:
+        raise ValueError(f"Unknown LLM backend '{backend}'. Choose from {LLM_BACKENDS}.")
+    key = (model_name, backend)
+    with _llm_lock:
+        if key not in _llms:
+            _llms[key] = _build_llm(model_name, backend)
+        if not cache:
+            return _llms[key]
+        if key not in _cached_llms:
+            _cached_llms[key] = CachedLLM(_llms[key], model_name, enabled=response_cache_enabled(backend))
+        return _cached_llms[key]
+
+
+class LatencyStats:
+    """Các mẫu độ trễ gần nhất (giây) của một chỉ số, dùng chung giữa các phiên."""
+
+    def __init__(self, maxlen=1000):
+        self._samples = deque(maxlen=maxlen)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def summary(self):
+        with self._lock:
+            samples = np.array(self._samples)
+        if len(samples) == 0:
+            return {"count": 0, "p50": None, "p95": None, "last": None}
+        return {"count": len(samples), "p50": float(np.percentile(samples, 50)),
+                "p95": float(np.percentile(samples, 95)), "last": float(samples[-1])}
+
+
+# Thời gian từ lúc gửi prompt tới token đầu tiên, cho cả LLM thường và agent
+first_token_latency = LatencyStats()
+
+
+def _as_messages(input):
+    return [HumanMessage(content=input)] if isinstance(input, str) else list(input)
+
+
+def normalize_prompt(messages):
+    """(vai trò, nội dung) của từng message, khoảng trắng gộp lại: khác biệt chỉ do thụt lề không tạo khoá mới."""
+    normalized = []
+    for message in messages:
+        content = message.content if isinstance(message.content, str) else json.dumps(message.content, default=str)
+        normalized.append((message.type, re.sub(r"\s+", " ", content).strip()))
+    return normalized
+
+
+class CachedLLM:
+    """Bọc chat model, lưu câu trả lời vào bảng `llm_responses`.
+
+    Khoá là (model, temperature, prompt đã chuẩn hoá, phiên bản template). Entry
+    quá `ttl` giây bị bỏ qua; tổng dung lượng giữ dưới `max_bytes` bằng cách bỏ
+    entry ít dùng gần đây nhất. `bypass=True` luôn gọi model (và ghi đè entry cũ).
+    Các thuộc tính khác (`bind`, `stream`, ...) chuyển thẳng tới model gốc.
+    """
+
+    def __init__(self, llm, model_name, ttl=LLM_CACHE_TTL, max_bytes=LLM_CACHE_MAX_BYTES, enabled=LLM_CACHE_ENABLED):
+        self.llm = llm
+        self.model_name = model_name
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self._lock = threading.Lock()
 
+    def cache_key(self, messages, prompt_version=PROMPT_VERSION):
+        payload = [self.model_name, getattr(self.llm, "temperature", None), str(prompt_version), normalize_prompt(messages)]
+        return hashlib.sha256(json.dumps(payload, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _lookup(self, key):
+        try:
+            cached = get_cached_response(key, self.ttl)
+        except sqlite3.Error as e:
+            print(f"LLM cache lookup failed: {e}")
+            return None
+        if cached is not None:
+            self._count("hits")
+        return cached
+
+    def _store(self, key, prompt_version, text):
+        if not text:
+            return
+        try:
+            add_cached_response(key, self.model_name, prompt_version, text, self.ttl, self.max_bytes)
+        except sqlite3.Error as e:
+            print(f"LLM cache write failed: {e}")
+
+    def invoke(self, input, prompt_version=PROMPT_VERSION, bypass=False, **kwargs):
+        messages = _as_messages(input)
+        if not self.enabled or kwargs:
+            return self.llm.invoke(messages, **kwargs)
+        key = self.cache_key(messages, prompt_version)
+        cached = None if bypass else self._lookup(key)
+        if cached is not None:
+            return AIMessage(content=cached)
+        self._count("bypassed" if bypass else "misses")
+        response = self.llm.invoke(messages)
+        if isinstance(response.content, str):
+            self._store(key, prompt_version, response.content)
+        return response
+
+    def stream(self, input, prompt_version=PROMPT_VERSION, bypass=False):
+        """Yield từng đoạn text ngay khi model sinh ra; câu trả lời đầy đủ chỉ được lưu cache một lần ở cuối."""
+        messages = _as_messages(input)
+        key = self.cache_key(messages, prompt_version)
+        cached = None if bypass or not self.enabled else self._lookup(key)
+        if cached is not None:
+            yield cached
+            return
+        if self.enabled:
+            self._count("bypassed" if bypass else "misses")
+        start = time.perf_counter()
+        parts = []
+        for chunk in self.llm.stream(messages):
+            if isinstance(chunk.content, str) and chunk.content:
+                if not parts:
+                    first_token_latency.record(time.perf_counter() - start)
+                parts.append(chunk.content)
+                yield chunk.content
+        if self.enabled:
+            self._store(key, prompt_version, "".join(parts))
+
+    def predict(self, text, **kwargs):
+        return self.invoke(text, **kwargs).content
+
+    def __call__(self, messages, **kwargs):
+        return self.invoke(messages, **kwargs)
+
+    def __getattr__(self, name):
+        if name == "llm":
+            raise AttributeError(name)
+        return getattr(self.llm, name)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def _build_llm(model_name, backend="openai"):
+    if backend == "replay":
+        return ReplayChatModel(model_name=model_name)
+    if backend == "canned":
+        return CannedChatModel(model_name=model_name)
+    if backend == "record":
+        return RecordingChatModel(model_name=model_name, inner=_build_llm(model_name))
     if model_name == "gpt-3.5-turbo":
         return ChatOpenAI(
             model=model_name,
             temperature=0.0,
             max_tokens=1000,
+            streaming=True,
         )
     elif model_name == "gpt-4":
         return ChatOpenAI(
             model=model_name,
             temperature=0.0,
             max_tokens=1000,
+            streaming=True,
         )
     elif model_name == "gemini-pro":
-        # Import Gemini and Return Gemini mode
-        pass
+        try:
+            from langchain_google_genai import ChatGoogleGenerativeAI
+        except ImportError as e:
+            raise ValueError("gemini-pro needs the langchain-google-genai package.") from e
+        return ChatGoogleGenerativeAI(
+            model=model_name,
+            temperature=0.0,
+            max_output_tokens=1000,
+        )
     else:
         raise ValueError(
             "Unknown model.\
-                Please choose from ['gpt-3.5-turbo','gpt-4', ...]"
+                Please choose from ['gpt-3.5-turbo','gpt-4','gemini-pro']"
         )
 
 
-def create_agent_from_csv(model_name: str, file_path: str, return_steps=True):
-    df = safe_read_csv(file_path) 
-    llm = load_llm(model_name)
+_llm_pool = ThreadPoolExecutor(max_workers=LLM_MAX_IN_FLIGHT, thread_name_prefix="llm")
+
+
+def submit_llm_call(fn, *args, **kwargs):
+    """Chạy một lời gọi LLM trên pool dùng chung (tối đa `LLM_MAX_IN_FLIGHT` request cùng lúc).
+
+    Hàm được gửi không được tự chờ một lời gọi khác trên pool này.
+
+    Returns:
+        concurrent.futures.Future: Kết quả của `fn(*args, **kwargs)`.
+    """
+    return _llm_pool.submit(fn, *args, **kwargs)
+
+
+def gather(futures):
+    """Kết quả của các future theo đúng thứ tự; lời gọi lỗi trả về chính exception thay vì raise."""
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def predict_many(llm, prompts, **kwargs):
+    """Gửi các prompt độc lập cùng lúc; thời gian chờ bằng lời gọi chậm nhất thay vì tổng.
+
+    Returns:
+        list: Câu trả lời (str) hoặc exception cho từng prompt, cùng thứ tự với `prompts`.
+    """
+    return gather([submit_llm_call(llm.predict, prompt, **kwargs) for prompt in prompts])
+
+
+class AgentStopped(Exception):
+    pass
+
+
+class _AgentStreamHandler(BaseCallbackHandler):
+    """Đẩy token và bước gọi tool của agent vào hàng đợi (chạy trong thread của agent).
+
+    Khi `stopped` được set (người xem đã bỏ đi), lần callback kế tiếp raise để agent dừng sớm.
+    """
+
+    raise_error = True
+
+    def __init__(self, events):
+        self.events = events
+        self.stopped = threading.Event()
+
+    def _check(self):
+        if self.stopped.is_set():
+            raise AgentStopped("Agent run abandoned by the reader.")
+
+    def on_llm_new_token(self, token, **kwargs):
+        self._check()
+        if token:
+            self.events.put(("token", token))
+
+    def on_agent_action(self, action, **kwargs):
+        self._check()
+        tool_input = action.tool_input
+        self.events.put(("action", tool_input.get("query", str(tool_input)) if isinstance(tool_input, dict) else str(tool_input)))
+
+
+def stream_agent(agent, prompt):
+    """Chạy agent ở thread riêng và yield sự kiện ngay khi tới.
+
+    Nếu generator bị đóng giữa chừng (vd. Streamlit rerun), agent được yêu cầu
+    dừng và generator chờ thread của nó kết thúc, nên agent không bao giờ được
+    trả về pool khi vẫn còn đang chạy.
+
+    Yields:
+        tuple: ("token", text), ("action", code của bước gọi tool), cuối cùng
+            ("result", dict trả về của agent). Lỗi của agent được raise lại ở đây.
+    """
+    events = queue.Queue()
+    handler = _AgentStreamHandler(events)
+
+    def run():
+        try:
+            events.put(("result", agent.invoke({"input": prompt}, config={"callbacks": [handler]})))
+        except Exception as e:
+            events.put(("error", e))
+
+    start = time.perf_counter()
+    first_token = True
+    worker = threading.Thread(target=run, daemon=True)
+    worker.start()
+    try:
+        while True:
+            kind, value = events.get()
+            if kind == "error":
+                raise value
+            if first_token and kind in ("token", "action"):
+                first_token_latency.record(time.perf_counter() - start)
+                first_token = False
+            yield kind, value
+            if kind == "result":
+                return
+    finally:
+        handler.stopped.set()
+        worker.join()
+
+
+def _build_agent(llm, df, return_steps):
+    # Prompt của agent chứa df.head() dạng markdown → với dataset rộng giảm số dòng cho vừa ngân sách
+    head_rows = head_rows_within_budget(df, AGENT_HEAD_TOKENS)
     return create_pandas_dataframe_agent(
         llm=llm,
         df=df,
         agent_type="tool-calling",
+        number_of_head_rows=max(head_rows, 1),
+        include_df_in_prompt=head_rows > 0,
         return_intermediate_steps=return_steps,
         allow_dangerous_code=True,
         verbose=True,
-    )
\ No newline at end of file
+    )
+
+
+def _reset_agent(agent, df):
+    """Trả REPL của agent về trạng thái ban đầu: chỉ có `df`.
+
+    Bản nông: với copy-on-write của pandas 3 (bắt buộc trong requirements.txt),
+    code agent ghi vào `df` chỉ sửa bản của nó, frame dùng chung không đổi.
+    """
+    repl = agent.tools[0]
+    repl.globals = {}
+    repl.locals = {"df": df.copy(deep=False)}
+
+
+class AgentPool:
+    """Pool pandas agent dùng lại giữa các câu hỏi và các phiên Streamlit.
+
+    Khoá là (dataset, model, tuỳ chọn). Mỗi agent chỉ được một phiên mượn tại một
+    thời điểm; phiên khác hỏi cùng khoá sẽ nhận agent rảnh hoặc agent mới dùng
+    chung frame và LLM client. Agent rảnh quá `idle_seconds` bị bỏ.
+    """
+
+    def __init__(self, idle_seconds=AGENT_IDLE_SECONDS, max_agents=MAX_POOLED_AGENTS):
+        self.idle_seconds = idle_seconds
+        self.max_agents = max_agents
+        self.created = 0
+        self.reused = 0
+        self._idle = {}  # key -> [(agent, lúc trả về)]
+        self._lock = threading.Lock()
+
+    def _evict_idle(self, now):
+        entries = [(t, key, agent) for key, agents in self._idle.items() for agent, t in agents
+                   if now - t < self.idle_seconds]
+        # Vượt trần → chỉ giữ các agent vừa được trả về gần nhất
+        entries = sorted(entries, key=lambda entry: entry[0])[-self.max_agents:] if self.max_agents else []
+        self._idle = {}
+        for t, key, agent in entries:
+            self._idle.setdefault(key, []).append((agent, t))
+
+    @contextmanager
+    def checkout(self, dataset_key, df: pd.DataFrame, model_name, return_steps=True):
+        """Mượn một agent cho `df` trong khối `with`, trả lại pool khi xong.
+
+        `dataset_key` phải đổi khi nội dung dataset đổi (vd. hash nội dung).
+        """
+        key = (dataset_key, model_name, return_steps)
+        with self._lock:
+            self._evict_idle(time.monotonic())
+            agents = self._idle.get(key)
+            agent = agents.pop()[0] if agents else None
+            if agent is not None:
+                self.reused += 1
+        if agent is None:
+            agent = _build_agent(load_llm(model_name, cache=False), df, return_steps)
+            with self._lock:
+                self.created += 1
+        _reset_agent(agent, df)
+        try:
+            yield agent
+        finally:
+            with self._lock:
+                self._idle.setdefault(key, []).append((agent, time.monotonic()))
+                self._evict_idle(time.monotonic())
+
+    def clear(self):
+        with self._lock:
+            self._idle.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "created": self.created,
+                "reused": self.reused,
+                "idle": sum(len(agents) for agents in self._idle.values()),
+            }
+
+
+agent_pool = AgentPool()
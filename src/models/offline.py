@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import re
+import time
+from typing import Any, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, ToolMessage, message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+LLM_BACKENDS = ("openai", "record", "replay", "canned")
+RECORDINGS_DIR = os.environ.get("VUDA_LLM_RECORDINGS", "data/llm_recordings")
+# Số giây chờ mỗi lời gọi khi replay, hoặc "recorded" để dùng đúng độ trễ lúc ghi
+REPLAY_LATENCY = os.environ.get("VUDA_REPLAY_LATENCY", "0")
+CANNED_RULES_PATH = os.environ.get("VUDA_LLM_CANNED_RULES")
+CANNED_AGENT_QUERY = "df.describe()"
+CANNED_TEXT = "This is a canned response from the offline LLM backend."
+MAX_CANNED_OBSERVATION = 2000
+
+
+def _normalize(text):
+    return re.sub(r"\s+", " ", text).strip() if isinstance(text, str) else json.dumps(text, default=str)
+
+
+def request_key(model_name, messages, **kwargs):
+    """Khoá của một request: model, nội dung message (bỏ id ngẫu nhiên) và tuỳ chọn (tool, response_format...)."""
+    payload = []
+    for message in messages:
+        entry = [message.type, _normalize(message.content)]
+        for call in getattr(message, "tool_calls", None) or []:
+            entry.append([call["name"], call["args"]])
+        payload.append(entry)
+    options = {name: value for name, value in kwargs.items() if name != "stream"}
+    raw = json.dumps([model_name, payload, options], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def recording_path(key, directory=RECORDINGS_DIR):
+    return os.path.join(directory, key[:2], f"{key}.json")
+
+
+class _OfflineChatModel(BaseChatModel):
+    """Phần chung: `bind_tools` giống ChatOpenAI để pandas agent (tool-calling) chạy được."""
+
+    model_name: str
+    directory: str = RECORDINGS_DIR
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(tool) for tool in tools], **kwargs)
+
+    def _result(self, message):
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+class RecordingChatModel(_OfflineChatModel):
+    """Gọi model thật và lưu từng cặp request/response (kèm độ trễ) thành file JSON."""
+
+    inner: Any
+
+    @property
+    def _llm_type(self):
+        return "vuda-record"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        start = time.perf_counter()
+        result = self.inner._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        key = request_key(self.model_name, messages, **kwargs)
+        path = recording_path(key, self.directory)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "model": self.model_name,
+                "request": [message_to_dict(message) for message in messages],
+                "response": message_to_dict(result.generations[0].message),
+                "latency": time.perf_counter() - start,
+            }, f, ensure_ascii=False, indent=1, default=str)
+        return result
+
+
+class ReplayChatModel(_OfflineChatModel):
+    """Trả lời từ các file đã ghi bằng `RecordingChatModel`, không cần mạng.
+
+    `latency`: số giây chờ mỗi lời gọi, hoặc "recorded" để dùng độ trễ lúc ghi.
+    """
+
+    latency: str = REPLAY_LATENCY
+
+    @property
+    def _llm_type(self):
+        return "vuda-replay"
+
+    def _load(self, messages, **kwargs):
+        path = recording_path(request_key(self.model_name, messages, **kwargs), self.directory)
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _wait(self, recording):
+        delay = recording.get("latency", 0.0) if self.latency == "recorded" else float(self.latency)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        recording = self._load(messages, **kwargs)
+        if recording is None:
+            raise LookupError(f"No recorded response for this {self.model_name} request in {self.directory}.")
+        self._wait(recording)
+        return self._result(messages_from_dict([recording["response"]])[0])
+
+
+class CannedChatModel(ReplayChatModel):
+    """Replay nếu có bản ghi; không thì trả lời dựng sẵn.
+
+    - Agent có tool: lượt đầu gọi tool `python_repl_ast` với `CANNED_AGENT_QUERY`
+      (hoặc query của luật khớp), lượt sau trả lời bằng kết quả tool.
+    - Prompt thường: text của luật đầu tiên có `match` (regex) khớp prompt cuối,
+      nếu không có thì `CANNED_TEXT` (hoặc "{}" khi yêu cầu JSON object).
+
+    Luật đọc từ file JSON `VUDA_LLM_CANNED_RULES`: [{"match": ..., "response": ..., "query": ...}]
+    (vd. `benchmarks/canned_rules.json` cho trang EDA Report và bước làm sạch).
+    """
+
+    rules_path: Optional[str] = CANNED_RULES_PATH
+
+    @property
+    def _llm_type(self):
+        return "vuda-canned"
+
+    def _rule(self, prompt):
+        if not self.rules_path:
+            return {}
+        with open(self.rules_path, encoding="utf-8") as f:
+            rules = json.load(f)
+        return next((rule for rule in rules if re.search(rule["match"], prompt, re.S)), {})
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        recording = self._load(messages, **kwargs)
+        if recording is not None:
+            self._wait(recording)
+            return self._result(messages_from_dict([recording["response"]])[0])
+
+        prompt = next((str(m.content) for m in reversed(messages) if m.type == "human"), "")
+        rule = self._rule(prompt)
+        tools = kwargs.get("tools")
+        if tools:
+            observations = [m for m in messages if isinstance(m, ToolMessage)]
+            if not observations:
+                call = {"name": tools[0]["function"]["name"], "id": "canned-0",
+                        "args": {"query": rule.get("query", CANNED_AGENT_QUERY)}}
+                return self._result(AIMessage(content="", tool_calls=[call]))
+            answer = rule.get("response") or f"Result:\n{str(observations[-1].content)[:MAX_CANNED_OBSERVATION]}"
+            return self._result(AIMessage(content=answer))
+
+        if "response" in rule:
+            return self._result(AIMessage(content=rule["response"]))
+        wants_json = (kwargs.get("response_format") or {}).get("type") == "json_object"
+        return self._result(AIMessage(content="{}" if wants_json else CANNED_TEXT))
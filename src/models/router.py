@@ -0,0 +1,286 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeout
+from contextlib import contextmanager
+
+from src.models.llms import LLM_MAX_IN_FLIGHT, CachedLLM, LatencyStats, _as_messages, load_llm, response_cache_enabled
+
+ROUTER_MODELS = [m.strip() for m in os.environ.get("VUDA_ROUTER_MODELS", "gpt-3.5-turbo,gpt-4").split(",") if m.strip()]
+LLM_TIMEOUT = float(os.environ.get("VUDA_LLM_TIMEOUT", 60))
+# Gửi request trùng sang model kế tiếp khi request đầu chậm hơn p95 của model đó
+LLM_HEDGE = os.environ.get("VUDA_LLM_HEDGE", "0") != "0"
+MIN_HEDGE_SAMPLES = 10
+HEALTH_WINDOW = 50
+MAX_ERROR_RATE = 0.5
+# Model bị coi là lỗi được thử lại sau khoảng này
+UNHEALTHY_COOLDOWN = 60
+# Tỉ lệ lời gọi được gửi tới model khoẻ chưa đủ số đo (hoặc số đo đã cũ) thay vì model nhanh nhất
+ROUTER_EXPLORE_RATE = float(os.environ.get("VUDA_ROUTER_EXPLORE", 0.1))
+EXPLORE_MIN_SAMPLES = 3
+STALE_SECONDS = 15 * 60
+
+
+class RouterTimeout(TimeoutError):
+    pass
+
+
+class BackendHealth:
+    """Độ trễ và tỉ lệ lỗi gần đây của một model cho một loại lời gọi."""
+
+    def __init__(self, window=HEALTH_WINDOW):
+        self.latency = LatencyStats(maxlen=window)
+        self._outcomes = deque(maxlen=window)
+        self._last_failure = None
+        self._last_success = None
+        self._lock = threading.Lock()
+
+    def record(self, seconds, ok):
+        with self._lock:
+            self._outcomes.append(ok)
+            if ok:
+                self._last_success = time.monotonic()
+            else:
+                self._last_failure = time.monotonic()
+        if ok:
+            self.latency.record(seconds)
+
+    @property
+    def error_rate(self):
+        with self._lock:
+            return (len(self._outcomes) - sum(self._outcomes)) / len(self._outcomes) if self._outcomes else 0.0
+
+    def healthy(self):
+        if self.error_rate <= MAX_ERROR_RATE:
+            return True
+        return time.monotonic() - self._last_failure > UNHEALTHY_COOLDOWN
+
+    def needs_samples(self):
+        """Model khoẻ mà số đo độ trễ chưa đủ hoặc đã cũ → đáng gửi thử một lời gọi."""
+        if not self.healthy():
+            return False
+        if self.latency.summary()["count"] < EXPLORE_MIN_SAMPLES:
+            return True
+        with self._lock:
+            return time.monotonic() - self._last_success > STALE_SECONDS
+
+    def summary(self):
+        return dict(self.latency.summary(), error_rate=self.error_rate, healthy=self.healthy())
+
+
+class ModelRouter:
+    """Chọn model cho từng loại lời gọi theo độ trễ và tỉ lệ lỗi gần đây.
+
+    Model khoẻ đã có số đo xếp theo p50 tăng dần, rồi tới model khoẻ chưa có số
+    đo (theo thứ tự cấu hình), cuối cùng là model đang lỗi. Một phần nhỏ
+    (`explore_rate`) lời gọi được đưa lên model khoẻ chưa đủ số đo hoặc số đo đã
+    cũ, để model dự phòng cũng có độ trễ để so sánh. Lời gọi lỗi hoặc quá
+    `timeout` giây chuyển sang model kế tiếp. Với `hedge=True`, nếu model đầu chưa
+    trả lời sau p95 của nó thì gửi thêm một request sang model kế tiếp và lấy câu
+    trả lời về trước.
+    """
+
+    def __init__(self, models=ROUTER_MODELS, timeout=LLM_TIMEOUT, hedge=LLM_HEDGE, explore_rate=ROUTER_EXPLORE_RATE):
+        self.models = list(models)
+        self.timeout = timeout
+        self.hedge = hedge
+        self.explore_rate = explore_rate
+        self._random = random.Random()
+        self._health = {}
+        self._lock = threading.Lock()
+        # Tách khỏi pool của `submit_llm_call` vì lời gọi đi qua router thường đã chạy trên pool đó
+        self._attempts = ThreadPoolExecutor(max_workers=2 * LLM_MAX_IN_FLIGHT, thread_name_prefix="llm-route")
+
+    def health(self, call_type, model_name):
+        with self._lock:
+            return self._health.setdefault((call_type, model_name), BackendHealth())
+
+    def ranked(self, call_type):
+        def rank(item):
+            order, model_name = item
+            health = self.health(call_type, model_name)
+            p50 = health.latency.summary()["p50"]
+            return (not health.healthy(), p50 is None, p50 or 0.0, order)
+        ranked = [model_name for _, model_name in sorted(enumerate(self.models), key=rank)]
+        # Các model sau model đầu chỉ được đo khi model đầu lỗi → thỉnh thoảng đưa một model cần đo lên đầu
+        explore = [m for m in ranked[1:] if self.health(call_type, m).needs_samples()]
+        if explore and self._random.random() < self.explore_rate:
+            ranked.remove(explore[0])
+            ranked.insert(0, explore[0])
+        return ranked
+
+    def pick(self, call_type):
+        return self.ranked(call_type)[0]
+
+    def record(self, call_type, model_name, seconds, ok):
+        self.health(call_type, model_name).record(seconds, ok)
+
+    @contextmanager
+    def track(self, call_type):
+        """Dùng model nhanh nhất cho một khối code tự gọi LLM (vd. agent), ghi lại độ trễ và lỗi."""
+        model_name = self.pick(call_type)
+        start = time.perf_counter()
+        try:
+            yield model_name
+        except Exception:
+            self.record(call_type, model_name, time.perf_counter() - start, ok=False)
+            raise
+        self.record(call_type, model_name, time.perf_counter() - start, ok=True)
+
+    def _submit(self, call_type, model_name, messages, kwargs):
+        """Gửi một lần thử lên pool riêng.
+
+        Returns:
+            tuple: (future, record_once) — `record_once(seconds, ok)` chỉ ghi kết quả
+                lần thử đầu tiên được gọi, nên lần thử đã bị tính timeout mà sau đó mới
+                xong sẽ không được tính thêm lần nữa.
+        """
+        lock = threading.Lock()
+        recorded = []
+
+        def record_once(seconds, ok):
+            with lock:
+                if recorded:
+                    return
+                recorded.append(ok)
+            self.record(call_type, model_name, seconds, ok)
+
+        def attempt():
+            start = time.perf_counter()
+            try:
+                response = load_llm(model_name, cache=False).invoke(messages, **kwargs)
+            except Exception:
+                record_once(time.perf_counter() - start, ok=False)
+                raise
+            record_once(time.perf_counter() - start, ok=True)
+            # Cho nơi gọi biết model nào đã trả lời (vd. để làm khoá cache theo model)
+            response.response_metadata["routed_model"] = model_name
+            return response
+        return self._attempts.submit(attempt), record_once
+
+    def _hedge_delay(self, call_type, model_name):
+        latency = self.health(call_type, model_name).latency.summary()
+        if not self.hedge or latency["count"] < MIN_HEDGE_SAMPLES:
+            return None
+        return min(latency["p95"], self.timeout)
+
+    def invoke(self, call_type, input, **kwargs):
+        messages = _as_messages(input)
+        candidates = self.ranked(call_type)
+        last_error = None
+        while candidates:
+            model_name = candidates.pop(0)
+            future, record_once = self._submit(call_type, model_name, messages, kwargs)
+            pending = {future: (model_name, record_once)}
+            deadline = time.monotonic() + self.timeout
+            delay = self._hedge_delay(call_type, model_name)
+            if delay is not None and candidates:
+                done, _ = wait(pending, timeout=delay)
+                if not done:
+                    backup = candidates.pop(0)
+                    future, record_once = self._submit(call_type, backup, messages, kwargs)
+                    pending[future] = (backup, record_once)
+            while pending:
+                done, _ = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+                if not done:
+                    # Request còn chạy nền nhưng không chờ nữa; kết quả muộn của nó không được tính
+                    for _, record_once in pending.values():
+                        record_once(self.timeout, ok=False)
+                    names = ", ".join(name for name, _ in pending.values())
+                    last_error = RouterTimeout(f"{names} did not answer within {self.timeout}s.")
+                    break
+                for future in done:
+                    name, _ = pending.pop(future)
+                    try:
+                        return future.result()
+                    except Exception as e:
+                        print(f"LLM call to {name} failed, trying the next model: {e}")
+                        last_error = e
+        raise last_error
+
+    def stream(self, call_type, input, **kwargs):
+        """Stream từ model nhanh nhất; chỉ chuyển model khi lỗi/timeout trước token đầu tiên."""
+        messages = _as_messages(input)
+        last_error = None
+        for model_name in self.ranked(call_type):
+            start = time.perf_counter()
+            started = False
+            try:
+                chunks = load_llm(model_name, cache=False).stream(messages, **kwargs)
+                first = self._attempts.submit(next, chunks, None)
+                try:
+                    chunk = first.result(timeout=self.timeout)
+                except FutureTimeout:
+                    raise RouterTimeout(f"{model_name} did not start answering within {self.timeout}s.")
+                while chunk is not None:
+                    started = True
+                    yield chunk
+                    chunk = next(chunks, None)
+            except Exception as e:
+                self.record(call_type, model_name, time.perf_counter() - start, ok=False)
+                if started:
+                    raise
+                print(f"LLM stream from {model_name} failed, trying the next model: {e}")
+                last_error = e
+                continue
+            self.record(call_type, model_name, time.perf_counter() - start, ok=True)
+            return
+        raise last_error
+
+    def stats(self):
+        with self._lock:
+            keys = list(self._health)
+        return {f"{call_type}/{model_name}": self.health(call_type, model_name).summary() for call_type, model_name in keys}
+
+
+class RoutedModel:
+    """Giao diện chat model (`invoke`, `stream`, `bind`) cho một loại lời gọi, đi qua `ModelRouter`.
+
+    `bind(**kwargs)` trả về một `RoutedModel` gửi kèm các tuỳ chọn đó (vd.
+    `response_format`) tới mọi model, nên lời gọi đã bind vẫn được chuyển model
+    khi lỗi và vẫn được đo độ trễ.
+    """
+
+    def __init__(self, router, call_type, **bound):
+        self.router = router
+        self.call_type = call_type
+        self.bound = bound
+
+    def bind(self, **kwargs):
+        return RoutedModel(self.router, self.call_type, **{**self.bound, **kwargs})
+
+    def invoke(self, input, **kwargs):
+        return self.router.invoke(self.call_type, input, **{**self.bound, **kwargs})
+
+    def stream(self, input, **kwargs):
+        return self.router.stream(self.call_type, input, **{**self.bound, **kwargs})
+
+    def __getattr__(self, name):
+        if name in ("router", "call_type", "bound"):
+            raise AttributeError(name)
+        # Các thuộc tính khác (temperature, bind_tools...) lấy từ model đang nhanh nhất
+        return getattr(load_llm(self.router.pick(self.call_type), cache=False), name)
+
+
+model_router = ModelRouter()
+_routed_llms = {}
+_routed_lock = threading.Lock()
+
+
+def route_llm(call_type):
+    """LLM cho một loại lời gọi (vd. "eda_report"), tự chọn model và chuyển model khi lỗi.
+
+    Cache câu trả lời bọc ngoài router, nên một câu trả lời đã lưu dùng được
+    dù lần trước do model nào trả lời.
+
+    Returns:
+        CachedLLM: Cùng giao diện với `load_llm` (`predict`, `invoke`, `stream`, gọi trực tiếp).
+    """
+    with _routed_lock:
+        if call_type not in _routed_llms:
+            _routed_llms[call_type] = CachedLLM(RoutedModel(model_router, call_type), f"auto:{call_type}",
+                                             enabled=response_cache_enabled())
+        return _routed_llms[call_type]
@@ -0,0 +1,112 @@
+import numpy as np
+import pandas as pd
+
+MOMENT_FIELDS = ('count', 'mean', 'm2', 'm3', 'm4')
+
+
+class Moments:
+    """count, mean và tổng lũy thừa độ lệch bậc 2–4 (M2, M3, M4) cho nhiều cột, gộp được giữa các chunk.
+
+    Skew/kurtosis suy ra từ đây trùng với `DataFrame.skew()`/`kurtosis()` của pandas
+    (đã hiệu chỉnh theo cỡ mẫu), nên có thể tính theo từng chunk cho dữ liệu không vừa RAM.
+    """
+
+    def __init__(self, columns, count=None, mean=None, m2=None, m3=None, m4=None):
+        self.columns = [str(col) for col in columns]
+        n_cols = len(self.columns)
+        self.count = np.zeros(n_cols) if count is None else np.asarray(count, dtype=np.float64)
+        self.mean = np.zeros(n_cols) if mean is None else np.asarray(mean, dtype=np.float64)
+        self.m2 = np.zeros(n_cols) if m2 is None else np.asarray(m2, dtype=np.float64)
+        self.m3 = np.zeros(n_cols) if m3 is None else np.asarray(m3, dtype=np.float64)
+        self.m4 = np.zeros(n_cols) if m4 is None else np.asarray(m4, dtype=np.float64)
+
+    @classmethod
+    def from_values(cls, columns, values: np.ndarray):
+        """Một lượt vector hoá trên khối (n_rows × n_cols); NaN bị bỏ qua."""
+        valid = ~np.isnan(values)
+        count = valid.sum(axis=0).astype(np.float64)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where(valid, values, 0).sum(axis=0) / count
+        deviation = np.where(valid, values - mean, 0)
+        squared = deviation * deviation
+        return cls(
+            columns, count, np.nan_to_num(mean),
+            squared.sum(axis=0), (squared * deviation).sum(axis=0), (squared * squared).sum(axis=0),
+        )
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, columns=None):
+        columns = list(df.select_dtypes(include='number').columns) if columns is None else list(columns)
+        return cls.from_values(columns, df[columns].to_numpy(dtype=np.float64, na_value=np.nan))
+
+    def merge(self, other: "Moments"):
+        """Gộp hai tập moment của cùng danh sách cột (công thức Chan/Pébay)."""
+        if other.columns != self.columns:
+            raise ValueError("Cannot merge moments computed on different columns.")
+        n_a, n_b = self.count, other.count
+        n = n_a + n_b
+        with np.errstate(invalid="ignore", divide="ignore"):
+            delta = other.mean - self.mean
+            delta_n = np.where(n > 0, delta / n, 0)
+        delta_n2 = delta_n * delta_n
+        term1 = delta * delta_n * n_a * n_b
+        m4 = (self.m4 + other.m4 + term1 * delta_n2 * (n_a * n_a - n_a * n_b + n_b * n_b)
+              + 6 * delta_n2 * (n_a * n_a * other.m2 + n_b * n_b * self.m2)
+              + 4 * delta_n * (n_a * other.m3 - n_b * self.m3))
+        m3 = (self.m3 + other.m3 + term1 * delta_n * (n_a - n_b)
+              + 3 * delta_n * (n_a * other.m2 - n_b * self.m2))
+        self.m2 = self.m2 + other.m2 + term1
+        self.m3, self.m4 = m3, m4
+        self.mean = self.mean + delta_n * n_b
+        self.count = n
+        return self
+
+    def replace(self, other: "Moments"):
+        """Thay moment của các cột có trong `other` (vd. sau khi làm sạch), giữ nguyên các cột khác."""
+        positions = [self.columns.index(col) for col in other.columns]
+        for field in MOMENT_FIELDS:
+            getattr(self, field)[positions] = getattr(other, field)
+        return self
+
+    def subset(self, columns):
+        positions = [self.columns.index(str(col)) for col in columns]
+        return Moments(columns, *(getattr(self, field)[positions] for field in MOMENT_FIELDS))
+
+    def skew(self):
+        n, m2, m3 = self.count, self.m2, self.m3
+        with np.errstate(invalid="ignore", divide="ignore"):
+            result = n * np.sqrt(n - 1) / (n - 2) * (m3 / m2 ** 1.5)
+        result = np.where(m2 == 0, 0.0, result)
+        return pd.Series(np.where(n < 3, np.nan, result), index=self.columns)
+
+    def kurtosis(self):
+        n, m2, m4 = self.count, self.m2, self.m4
+        with np.errstate(invalid="ignore", divide="ignore"):
+            adj = 3 * (n - 1) ** 2 / ((n - 2) * (n - 3))
+            result = n * (n + 1) * (n - 1) * m4 / ((n - 2) * (n - 3) * m2 ** 2) - adj
+        result = np.where(m2 == 0, 0.0, result)
+        return pd.Series(np.where(n < 4, np.nan, result), index=self.columns)
+
+    def to_dict(self):
+        return {'columns': self.columns, **{field: getattr(self, field).tolist() for field in MOMENT_FIELDS}}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['columns'], *(data[field] for field in MOMENT_FIELDS))
+
+
+def changed_columns(before: pd.DataFrame, after: pd.DataFrame, columns):
+    """Các cột trong `columns` có giá trị khác nhau giữa hai frame (so sánh cả khối một lần).
+
+    Đổi số dòng hoặc index (vd. dropna, lọc outlier) coi như mọi cột đều đổi.
+    Tên cột không có trong cả hai frame bị bỏ qua.
+    """
+    columns = [col for col in columns if col in before.columns and col in after.columns]
+    if not columns:
+        return []
+    if len(before) != len(after) or not before.index.equals(after.index):
+        return columns
+    a = before[columns].to_numpy(dtype=np.float64, na_value=np.nan)
+    b = after[columns].to_numpy(dtype=np.float64, na_value=np.nan)
+    unchanged = ((a == b) | (np.isnan(a) & np.isnan(b))).all(axis=0)
+    return [col for col, same in zip(columns, unchanged) if not same]
@@ -0,0 +1,370 @@
+import multiprocessing
+import os
+import threading
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+
+from src.compaction import apply_schema
+from src.loader import read_columnar
+from src.moments import Moments
+
+PROFILE_VERSION = 3
+NUMERIC_FIELDS = ['min', 'max', 'mean', 'median', 'std', 'outliers']
+CATEGORY_MAX_UNIQUE = 20
+HISTOGRAM_BINS = 20
+TOP_K_VALUES = 20
+# Dưới ngưỡng này profile luôn tính chính xác; trên ngưỡng thì dùng sketch lưu lúc upload (nếu có)
+EXACT_ROW_THRESHOLD = int(os.environ.get("VUDA_EXACT_PROFILE_ROWS", 1_000_000))
+# Số process profile song song theo nhóm cột; 1 = luôn chạy tuần tự
+PROFILE_WORKERS = int(os.environ.get("VUDA_PROFILE_WORKERS", os.cpu_count() or 1))
+# Frame hẹp/nhỏ thì chi phí gửi việc sang pool lớn hơn phần tiết kiệm được
+MIN_PARALLEL_COLUMNS = 32
+MIN_PARALLEL_CELLS = 2_000_000
+
+_pool = None
+_pool_workers = None
+_pool_lock = threading.Lock()
+
+
+def _numeric_columns(df: pd.DataFrame):
+    # bool cũng là "numeric" với pandas nhưng describe() không có min/max → xếp vào Boolean
+    return [
+        col for col in df.columns
+        if pd.api.types.is_numeric_dtype(df[col].dtype) and not pd.api.types.is_bool_dtype(df[col].dtype)
+    ]
+
+
+def _sorted_quantiles(sorted_values, counts, q):
+    """Quantile nội suy tuyến tính (giống pandas) lấy thẳng từ mảng đã sắp theo cột."""
+    pos = q * np.maximum(counts - 1, 0)
+    lo = np.floor(pos).astype(np.int64)
+    hi = np.ceil(pos).astype(np.int64)
+    lo_values = np.take_along_axis(sorted_values, lo[None, :], axis=0)[0]
+    hi_values = np.take_along_axis(sorted_values, hi[None, :], axis=0)[0]
+    return np.where(counts > 0, lo_values + (hi_values - lo_values) * (pos - lo), np.nan)
+
+
+def _numeric_profile(values: np.ndarray):
+    """Thống kê cho cả khối số (n_rows × n_cols) bằng một lần sort theo trục cột.
+
+    Mảng đã sort (NaN nằm cuối) cho luôn min/max, các quantile và số giá trị
+    khác nhau; mean/std/outliers là các phép rút gọn theo trục 0.
+    """
+    n_rows, n_cols = values.shape
+    if n_cols == 0 or n_rows == 0:
+        return {field: np.full(n_cols, np.nan) for field in NUMERIC_FIELDS + ['unique']}
+
+    sorted_values = np.sort(values, axis=0)
+    counts = np.count_nonzero(~np.isnan(values), axis=0)
+    q1, median, q3 = (_sorted_quantiles(sorted_values, counts, q) for q in (0.25, 0.5, 0.75))
+    iqr = q3 - q1
+    # Số giá trị khác nhau: đếm chỗ đổi giá trị giữa hai dòng liên tiếp trong vùng không NaN
+    changes = (sorted_values[1:] != sorted_values[:-1]) & (np.arange(1, n_rows)[:, None] < counts)
+    with warnings.catch_warnings():
+        # Cột toàn NaN → nanmean/nanstd cảnh báo và trả NaN, đúng như describe()
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return {
+            'min': _sorted_quantiles(sorted_values, counts, 0.0),
+            'max': _sorted_quantiles(sorted_values, counts, 1.0),
+            'mean': np.nanmean(values, axis=0),
+            'median': median,
+            'std': np.nanstd(values, axis=0, ddof=1),
+            'outliers': ((values < q1 - 1.5 * iqr) | (values > q3 + 1.5 * iqr)).sum(axis=0),
+            'unique': np.where(counts > 0, changes.sum(axis=0) + 1, 0),
+        }
+
+
+def _sketched_numeric_profile(values: np.ndarray, quantile_sketches):
+    """Như `_numeric_profile` nhưng lấy Q1/median/Q3 từ sketch KLL thay vì sort cả khối.
+
+    min/max/mean/std vẫn chính xác (chỉ là phép rút gọn O(n)); outliers được
+    đếm chính xác theo ngưỡng IQR xấp xỉ.
+    """
+    q1, median, q3 = np.array([sketch.quantiles([0.25, 0.5, 0.75]) for sketch in quantile_sketches]).T.reshape(3, -1)
+    iqr = q3 - q1
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return {
+            'min': np.nanmin(values, axis=0),
+            'max': np.nanmax(values, axis=0),
+            'mean': np.nanmean(values, axis=0),
+            'median': median,
+            'std': np.nanstd(values, axis=0, ddof=1),
+            'outliers': ((values < q1 - 1.5 * iqr) | (values > q3 + 1.5 * iqr)).sum(axis=0),
+        }
+
+
+def _sketch_of(sketches, col, kind):
+    entry = sketches.get(str(col)) if sketches else None
+    return entry.get(kind) if entry else None
+
+
+def profile_frame(df: pd.DataFrame, sketches=None):
+    """Profile toàn bộ các cột của `df` bằng các phép tính vector hoá trên cả frame.
+
+    Thay cho việc gọi `analyze_column` lần lượt từng cột: missing/unique tính
+    một lần cho mọi cột, còn các cột số được gom thành một mảng 2D để
+    min/max/mean/median/std/IQR cùng đi qua numpy theo trục cột.
+
+    Với frame lớn hơn `EXACT_ROW_THRESHOLD` dòng, `sketches` ({tên cột: {'hll': ...,
+    'kll': ...}}, xem `src.utils.get_column_sketches`) thay cho nunique và sort:
+    unique lấy từ HyperLogLog, quantile từ KLL. Sai số khi đó nằm trong
+    `profile.attrs['error_bounds']` (xem `profile_error_caption`).
+
+    Returns:
+        pd.DataFrame: mỗi dòng một cột của `df` (index là tên cột) với các cột
+            name, dtype, missing_pct, unique, type, min, max, mean, median, std, outliers.
+    """
+    n_rows, n_cols = df.shape
+    if n_rows <= EXACT_ROW_THRESHOLD:
+        sketches = None
+    numeric_cols = _numeric_columns(df)
+    is_numeric = df.columns.isin(numeric_cols)
+    columns = {
+        'name': [str(col) for col in df.columns],
+        'dtype': df.dtypes.astype(str).to_numpy(),
+        'missing_pct': df.isna().mean().to_numpy() * 100 if n_rows else np.zeros(n_cols),
+        'unique': np.zeros(n_cols, dtype=np.int64),
+    }
+    quantile_sketches = {col: _sketch_of(sketches, col, 'kll') for col in numeric_cols}
+    is_sketched = df.columns.isin([col for col, sketch in quantile_sketches.items() if sketch is not None])
+    # Cột số đã sort thì đếm unique chính xác luôn; HLL chỉ thay cho nunique ở các cột còn lại
+    distinct_sketches = {
+        col: _sketch_of(sketches, col, 'hll') for col in df.columns[~is_numeric | is_sketched]
+    }
+    uses_distinct = df.columns.isin([col for col, sketch in distinct_sketches.items() if sketch is not None])
+    exact_unique = (~is_numeric | is_sketched) & ~uses_distinct
+    if uses_distinct.any():
+        estimates = [distinct_sketches[col].estimate() for col in df.columns[uses_distinct]]
+        non_null = df.loc[:, uses_distinct].count().to_numpy()
+        columns['unique'][uses_distinct] = np.minimum(estimates, non_null)
+    if exact_unique.any():
+        columns['unique'][exact_unique] = df.loc[:, exact_unique].nunique().to_numpy()
+
+    for field in NUMERIC_FIELDS:
+        columns[field] = np.full(n_cols, np.nan)
+    exact_numeric = is_numeric & ~is_sketched
+    values = df.loc[:, exact_numeric].to_numpy(dtype=np.float64, na_value=np.nan)
+    for field, result in _numeric_profile(values).items():
+        columns[field][exact_numeric] = result
+    if is_sketched.any():
+        values = df.loc[:, is_sketched].to_numpy(dtype=np.float64, na_value=np.nan)
+        results = _sketched_numeric_profile(values, [quantile_sketches[col] for col in df.columns[is_sketched]])
+        for field, result in results.items():
+            columns[field][is_sketched] = result
+    profile = pd.DataFrame(columns, index=df.columns)
+
+    error_bounds = {}
+    if uses_distinct.any():
+        error_bounds['unique'] = max(distinct_sketches[col].relative_error for col in df.columns[uses_distinct])
+    if is_sketched.any():
+        error_bounds['quantile_rank'] = max(quantile_sketches[col].rank_error for col in df.columns[is_sketched])
+
+    # Ước lượng HLL hiếm khi đúng bằng số dòng → coi là ID nếu nằm trong 3 lần sai số chuẩn
+    id_threshold = np.where(uses_distinct, n_rows * (1 - 3 * error_bounds.get('unique', 0)), n_rows)
+    profile['type'] = np.select(
+        [is_numeric, profile['unique'] == 2, profile['unique'] >= id_threshold, profile['unique'] <= CATEGORY_MAX_UNIQUE],
+        ['Numeric', 'Boolean', 'ID', 'Category'],
+        default='Text',
+    )
+    profile.attrs['error_bounds'] = error_bounds
+    return profile
+
+
+def profile_error_caption(profile: pd.DataFrame):
+    """Nhãn nêu sai số khi profile dùng sketch; None nếu mọi giá trị đều chính xác."""
+    bounds = profile.attrs.get('error_bounds')
+    if not bounds:
+        return None
+    parts = []
+    if 'unique' in bounds:
+        parts.append(f"unique counts ±{bounds['unique']:.1%} (HyperLogLog)")
+    if 'quantile_rank' in bounds:
+        parts.append(f"median/IQR/outlier bounds within ±{bounds['quantile_rank']:.1%} rank (KLL)")
+    return "≈ Approximate profile from upload-time sketches: " + ", ".join(parts) + "."
+
+
+def distinct_count(df: pd.DataFrame, col, approx_distinct=None):
+    """Số giá trị khác nhau của `df[col]`, lấy ước lượng HLL đã lưu nếu có (xem `get_approx_distinct`)."""
+    if approx_distinct and str(col) in approx_distinct:
+        return approx_distinct[str(col)]
+    return df[col].nunique()
+
+
+def numeric_histograms(values: np.ndarray, bins=HISTOGRAM_BINS):
+    """Histogram `bins` khoảng đều cho từng cột của khối số, một lần `bincount` cho cả khối.
+
+    Khoảng chia giống `np.histogram`/`ax.hist` (từ min đến max, cột hằng số thì ±0.5).
+
+    Returns:
+        tuple: (edges (bins+1 × n_cols), counts (bins × n_cols))
+    """
+    n_rows, n_cols = values.shape
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        lo, hi = np.nanmin(values, axis=0), np.nanmax(values, axis=0)
+    constant = lo == hi
+    lo, hi = np.where(constant, lo - 0.5, lo), np.where(constant, hi + 0.5, hi)
+    edges = lo + (hi - lo) * np.linspace(0, 1, bins + 1)[:, None]
+    valid = ~np.isnan(values)
+    with np.errstate(invalid="ignore"):
+        idx = np.floor((values - lo) / (hi - lo) * bins)
+    # Giá trị max rơi vào khoảng cuối (khoảng cuối đóng hai đầu như np.histogram)
+    idx = np.clip(np.nan_to_num(idx, nan=0), 0, bins - 1).astype(np.int64) + np.arange(n_cols) * bins
+    counts = np.bincount(idx[valid], minlength=n_cols * bins).reshape(n_cols, bins).T
+    return edges, counts
+
+
+def distribution_data(df: pd.DataFrame, bins=HISTOGRAM_BINS, top_k=TOP_K_VALUES):
+    """Dữ liệu đã rút gọn để vẽ phân phối từng cột mà không cần đọc lại dữ liệu thô.
+
+    Cột số: histogram (edges, counts). Cột khác: `top_k` giá trị nhiều nhất
+    (NaN tính là "NaN", giống biểu đồ cũ).
+
+    Returns:
+        dict: {tên cột: {'kind': 'histogram', 'edges', 'counts'} | {'kind': 'top_values', 'values', 'counts'}}
+    """
+    numeric_cols = _numeric_columns(df)
+    distributions = {}
+    if numeric_cols:
+        values = df[numeric_cols].to_numpy(dtype=np.float64, na_value=np.nan)
+        edges, counts = numeric_histograms(values, bins)
+        for i, col in enumerate(numeric_cols):
+            if np.isnan(edges[0, i]):
+                continue  # cột toàn NaN
+            distributions[str(col)] = {'kind': 'histogram', 'edges': edges[:, i].tolist(),
+                                       'counts': counts[:, i].tolist()}
+    for col in df.columns.difference(numeric_cols, sort=False):
+        series = df[col]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            series = series.astype(object)
+        top = series.fillna("NaN").value_counts().head(top_k)
+        distributions[str(col)] = {'kind': 'top_values', 'values': [str(v) for v in top.index],
+                                   'counts': top.to_numpy().tolist()}
+    return distributions
+
+
+def _get_pool(workers):
+    """Pool dùng chung cho cả process (worker được giữ ấm giữa các lần profile)."""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            # spawn thay vì fork: server Streamlit chạy nhiều thread
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _pool_workers = workers
+        return _pool
+
+
+def _profile_column_group(columnar_path, columns, schema, sketches):
+    """Chạy trong worker: tự đọc các cột của nhóm từ Parquet (memory-map) rồi profile."""
+    df = read_columnar(columnar_path, columns=columns)
+    if schema:
+        df = apply_schema(df, schema)
+    profile = profile_frame(df, sketches)
+    # attrs không đảm bảo đi qua pickle → trả riêng
+    return len(df), profile, profile.attrs['error_bounds']
+
+
+def profile_frame_parallel(df: pd.DataFrame, columnar_path=None, schema=None, sketches=None, workers=None):
+    """`profile_frame` chia theo nhóm cột cho process pool.
+
+    Worker không nhận frame qua pickle mà tự đọc cột của mình từ bản Parquet
+    `columnar_path` (memory-map), rồi áp `schema` thu gọn kiểu giống `load_dataset`.
+    Chạy tuần tự khi chỉ có một worker, không có bản Parquet, frame nhỏ, hoặc pool lỗi.
+    """
+    workers = PROFILE_WORKERS if workers is None else workers
+    n_rows, n_cols = df.shape
+    if (workers <= 1 or not columnar_path or n_cols < MIN_PARALLEL_COLUMNS
+            or n_rows * n_cols < MIN_PARALLEL_CELLS):
+        return profile_frame(df, sketches)
+    if n_rows <= EXACT_ROW_THRESHOLD:
+        sketches = None
+
+    groups = [list(group) for group in np.array_split(np.asarray(df.columns, dtype=object), min(workers * 2, n_cols))]
+    try:
+        pool = _get_pool(workers)
+        futures = [
+            pool.submit(
+                _profile_column_group, columnar_path, group,
+                {col: schema[col] for col in group if col in schema} if schema else None,
+                {col: sketches[col] for col in group if col in sketches} if sketches else None,
+            )
+            for group in groups
+        ]
+        results = [future.result() for future in futures]
+    except (BrokenProcessPool, OSError, ValueError) as e:
+        print(f"Parallel profiling failed, falling back to serial: {e}")
+        return profile_frame(df, sketches)
+    if any(rows != n_rows for rows, _, _ in results):
+        # Bản Parquet không khớp frame đang có (vd. vừa build lại) → tính trên frame
+        return profile_frame(df, sketches)
+
+    profile = pd.concat([group_profile for _, group_profile, _ in results])
+    profile.index = df.columns
+    error_bounds = {}
+    for _, _, bounds in results:
+        for field, bound in bounds.items():
+            error_bounds[field] = max(error_bounds.get(field, 0), bound)
+    profile.attrs['error_bounds'] = error_bounds
+    return profile
+
+
+def build_dataset_profile(df: pd.DataFrame, sketches=None, columnar_path=None, schema=None):
+    """Profile cả dataset dưới dạng dict lưu được (JSON) trong bảng `dataset_profiles`.
+
+    `columnar_path`/`schema` cho phép profile song song (xem `profile_frame_parallel`).
+
+    Returns:
+        dict: version, num_rows, num_cols, columns (bảng `profile_frame` dạng records),
+            error_bounds, missing ({cột: số ô trống}), duplicate_rows, describe (`df.describe()`),
+            distributions (histogram / top-k để vẽ, xem `distribution_data`),
+            moments (`src.moments.Moments.to_dict()` của các cột số, cho skew/kurtosis).
+    """
+    profile = profile_frame_parallel(df, columnar_path, schema, sketches)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        describe = df.describe().to_dict() if len(_numeric_columns(df)) else {}
+    return {
+        'version': PROFILE_VERSION,
+        'num_rows': int(df.shape[0]),
+        'num_cols': int(df.shape[1]),
+        'columns': profile.to_dict(orient='records'),
+        'error_bounds': profile.attrs['error_bounds'],
+        'missing': {str(col): int(count) for col, count in df.isna().sum().items()},
+        'duplicate_rows': int(df.duplicated().sum()),
+        'describe': {str(col): stats for col, stats in describe.items()},
+        'distributions': distribution_data(df),
+        'moments': Moments.from_frame(df).to_dict(),
+    }
+
+
+def profile_table(dataset_profile):
+    """Dựng lại bảng `profile_frame` từ dict của `build_dataset_profile`."""
+    profile = pd.DataFrame.from_records(dataset_profile['columns'])
+    profile.index = profile['name']
+    profile.index.name = None
+    profile.attrs['error_bounds'] = dataset_profile.get('error_bounds', {})
+    return profile
+
+
+def profile_records(profile: pd.DataFrame):
+    """Chuyển bảng profile về list dict giống kết quả `analyze_column` cũ.
+
+    Cột không phải số không có các khoá min/max/... (UI và `generate_insight`
+    dựa vào việc có khoá hay không).
+    """
+    records = []
+    for record in profile.to_dict(orient='records'):
+        if record['type'] != 'Numeric':
+            for field in NUMERIC_FIELDS:
+                record.pop(field, None)
+        else:
+            record['outliers'] = int(record['outliers'])
+        records.append(record)
+    return records
@@ -0,0 +1,120 @@
+import math
+import os
+from functools import lru_cache
+
+import pandas as pd
+
+DEFAULT_TOKEN_MODEL = "gpt-3.5-turbo"
+DEFAULT_CONTEXT_TOKENS = int(os.environ.get("VUDA_CONTEXT_TOKENS", 1500))
+TOP_VALUES_IN_CONTEXT = 5
+HEAD_ROWS_IN_CONTEXT = 3
+CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=None)
+def _encoding(model):
+    """Encoder tiktoken của model; None nếu không tải được (vd. máy không có mạng lần đầu)."""
+    try:
+        import tiktoken
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        print(f"tiktoken unavailable, estimating tokens from length: {e}")
+        return None
+
+
+def count_tokens(text, model=DEFAULT_TOKEN_MODEL):
+    encoding = _encoding(model)
+    if encoding is None:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def fit_lines(lines, budget, model=DEFAULT_TOKEN_MODEL, overflow="... and {n} more"):
+    """Giữ nhiều dòng đầu nhất (theo thứ tự truyền vào) vừa `budget` token, thêm dòng ghi chú số dòng bị bỏ."""
+    lines = list(lines)
+    text = "\n".join(lines)
+    if count_tokens(text, model) <= budget:
+        return text
+    # Tìm nhị phân số dòng giữ được (kể cả dòng ghi chú)
+    lo, hi = 0, len(lines)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        candidate = "\n".join(lines[:mid] + [overflow.format(n=len(lines) - mid)])
+        if count_tokens(candidate, model) <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    return "\n".join(lines[:lo] + [overflow.format(n=len(lines) - lo)])
+
+
+def fit_table(df: pd.DataFrame, budget, model=DEFAULT_TOKEN_MODEL):
+    """Bảng markdown của các dòng đầu của `df` vừa `budget` token (sắp xếp trước theo độ quan trọng)."""
+    header, *rows = df.to_markdown().splitlines()
+    separator, rows = rows[0], rows[1:]
+    return fit_lines([header, separator] + rows, budget, model, overflow="... ({n} more rows)")
+
+
+def _number(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return f"{value:.4g}" if isinstance(value, float) else str(value)
+
+
+def column_digest(record, distribution=None, detail=2):
+    """Một dòng mô tả cột từ profile.
+
+    `detail`: 0 = tên và kiểu; 1 = thêm missing/unique/min/max/mean; 2 = thêm các giá trị phổ biến.
+    """
+    line = f"- {record['name']} ({record['dtype']}, {record.get('type', '?')})"
+    if detail == 0:
+        return line
+    parts = [f"missing {record['missing_pct']:.1f}%", f"unique {record['unique']}"]
+    stats = [(name, _number(record.get(name))) for name in ("min", "max", "mean")]
+    parts += [f"{name} {value}" for name, value in stats if value is not None]
+    line += ": " + ", ".join(parts)
+    if detail >= 2 and record.get('type') != 'ID' and distribution and distribution.get('kind') == 'top_values':
+        line += " | top: " + ", ".join(distribution['values'][:TOP_VALUES_IN_CONTEXT])
+    return line
+
+
+def build_dataset_context(dataset_profile, budget=DEFAULT_CONTEXT_TOKENS, head: pd.DataFrame = None,
+                          focus=(), model=DEFAULT_TOKEN_MODEL):
+    """Tóm tắt dataset gọn cho prompt, dựng từ profile đã lưu (xem `build_dataset_profile`).
+
+    Giảm dần độ chi tiết cho tới khi vừa `budget` token: bỏ các dòng mẫu, bỏ giá
+    trị phổ biến, bỏ thống kê, cuối cùng bỏ bớt cột (cột trong `focus` luôn được giữ đầu tiên).
+
+    Returns:
+        str: Đoạn text mô tả dataset.
+    """
+    header = (f"Dataset: {dataset_profile['num_rows']:,} rows × {dataset_profile['num_cols']} columns, "
+              f"{dataset_profile.get('duplicate_rows', 0):,} duplicate rows.\nColumns:")
+    focus = [str(col) for col in focus if col is not None]
+    records = sorted(dataset_profile['columns'], key=lambda r: str(r['name']) not in focus)
+    distributions = dataset_profile.get('distributions', {})
+    budget -= count_tokens(header, model)
+
+    head_text = ""
+    if head is not None and len(head):
+        head_text = "\nFirst rows (CSV):\n" + head.head(HEAD_ROWS_IN_CONTEXT).to_csv(index=False)
+
+    for detail in (2, 1, 0):
+        lines = [column_digest(r, distributions.get(str(r['name'])), detail) for r in records]
+        columns_text = "\n".join(lines)
+        used = count_tokens(columns_text, model)
+        if used <= budget:
+            if head_text and used + count_tokens(head_text, model) <= budget:
+                columns_text += head_text
+            return f"{header}\n{columns_text}"
+    return f"{header}\n{fit_lines(lines, budget, model, overflow='... and {n} more columns')}"
+
+
+def head_rows_within_budget(df: pd.DataFrame, budget, max_rows=5, model=DEFAULT_TOKEN_MODEL):
+    """Số dòng đầu (tối đa `max_rows`) mà bảng markdown của chúng vừa `budget` token."""
+    for n in range(max_rows, 0, -1):
+        if count_tokens(df.head(n).to_markdown(), model) <= budget:
+            return n
+    return 0
@@ -0,0 +1,153 @@
+import os
+import zlib
+
+import numpy as np
+import pandas as pd
+
+SAMPLE_SEED = 42
+MAX_PLOT_ROWS = int(os.environ.get("VUDA_MAX_PLOT_ROWS", 50_000))
+OVERVIEW_MAX_ROWS = 100_000
+# Sample đều dựng lúc upload phải đủ lớn cho mọi nơi gọi `load_sample` (biểu đồ, Pygwalker)
+SAMPLE_ROWS = max(MAX_PLOT_ROWS, OVERVIEW_MAX_ROWS)
+TIME_BUCKETS = 50
+ROW_COLUMN = "__row__"
+KEY_COLUMN = "__key__"
+SAMPLE_METHODS = ("uniform", "stratified", "time")
+
+
+def sample_path_for(csv_path, method="uniform", column=None, n=None):
+    """Sample được lưu cạnh blob CSV: `<stem>.sample-<method>[-<cột>-<n>].parquet`.
+
+    `method="uniform"` không có `n` là sample đều dựng sẵn lúc upload.
+    """
+    stem = os.path.splitext(csv_path)[0]
+    if method == "uniform" and n is None:
+        return f"{stem}.sample-uniform.parquet"
+    # Tên cột có thể chứa ký tự không hợp lệ trong tên file → dùng crc32
+    return f"{stem}.sample-{method}-{zlib.crc32(str(column).encode()):08x}-{n}.parquet"
+
+
+class ReservoirSampler:
+    """Sample đều kích thước `k` qua nhiều chunk (bottom-k theo khoá ngẫu nhiên).
+
+    Mỗi dòng nhận một khoá U(0,1) từ bộ sinh có seed; giữ `k` dòng có khoá nhỏ
+    nhất. Kết quả giống nhau dù đọc theo chunk hay cả frame, và `head(m)` của
+    sample đã sắp theo khoá vẫn là một sample đều kích thước `m`.
+    """
+
+    def __init__(self, k=SAMPLE_ROWS, seed=SAMPLE_SEED):
+        self.k = k
+        self._rng = np.random.default_rng(seed)
+        self._rows_seen = 0
+        self._sample = None
+
+    def update(self, chunk: pd.DataFrame):
+        keys = self._rng.random(len(chunk))
+        chunk = chunk.assign(**{
+            ROW_COLUMN: np.arange(self._rows_seen, self._rows_seen + len(chunk)),
+            KEY_COLUMN: keys,
+        })
+        self._rows_seen += len(chunk)
+        if self._sample is not None:
+            chunk = pd.concat([self._sample, chunk], ignore_index=True)
+        self._sample = chunk.nsmallest(self.k, KEY_COLUMN) if len(chunk) > self.k else chunk
+
+    def result(self):
+        """Sample sắp theo khoá, còn giữ cột số thứ tự dòng gốc và khoá."""
+        if self._sample is None:
+            return pd.DataFrame()
+        return self._sample.sort_values(KEY_COLUMN, kind="stable").reset_index(drop=True)
+
+
+def _random_keys(n, seed):
+    return np.random.default_rng(seed).random(n)
+
+
+def _take_by_quota(df, strata, quotas, seed):
+    """Lấy `quotas[s]` dòng có khoá ngẫu nhiên nhỏ nhất trong mỗi nhóm `s`."""
+    keys = pd.Series(_random_keys(len(df), seed), index=df.index)
+    order = keys.groupby(strata, observed=True).rank(method="first") - 1
+    quota_per_row = strata.map(quotas).fillna(0)
+    return df[order < quota_per_row]
+
+
+def _with_row_numbers(df):
+    return df.assign(**{ROW_COLUMN: np.arange(len(df))})
+
+
+def uniform_sample(df: pd.DataFrame, n, seed=SAMPLE_SEED):
+    sampler = ReservoirSampler(k=n, seed=seed)
+    sampler.update(df)
+    return sampler.result()
+
+
+def _proportional_quotas(sizes: pd.Series, n):
+    """Chia `n` dòng cho các nhóm theo tỉ lệ kích thước, phần lẻ theo phương pháp số dư lớn nhất.
+
+    Tổng quota đúng bằng `min(n, tổng kích thước)`.
+    """
+    n = min(n, int(sizes.sum()))
+    exact = sizes / sizes.sum() * n
+    quotas = np.floor(exact).astype(int)
+    remainder = n - int(quotas.sum())
+    if remainder:
+        largest = (exact - quotas).sort_values(ascending=False, kind="stable").index[:remainder]
+        quotas[largest] += 1
+    return quotas
+
+
+def stratified_sample(df: pd.DataFrame, column, n, seed=SAMPLE_SEED):
+    """Sample theo tỉ lệ từng nhóm của `column`, tối đa `n` dòng.
+
+    Cột có nhiều nhóm hơn `n` (vd. cột gần như duy nhất) không chia tầng được → sample đều.
+    """
+    strata = df[column].astype(object).where(df[column].notna(), "NaN")
+    sizes = strata.value_counts()
+    if len(sizes) > n:
+        return uniform_sample(df, n, seed=seed)
+    df = _with_row_numbers(df)
+    return _take_by_quota(df, strata, _proportional_quotas(sizes, n), seed)
+
+
+def time_bucketed_sample(df: pd.DataFrame, column, n, buckets=TIME_BUCKETS, seed=SAMPLE_SEED):
+    """Chia trục thời gian thành `buckets` khoảng đều và lấy số dòng như nhau ở mỗi khoảng.
+
+    Giai đoạn thưa dữ liệu vẫn xuất hiện trong sample thay vì bị các giai đoạn dày lấn át.
+    """
+    df = _with_row_numbers(df)
+    times = pd.to_datetime(df[column], errors="coerce")
+    valid = times.notna()
+    if not valid.any():
+        return uniform_sample(df.drop(columns=[ROW_COLUMN]), n, seed=seed)
+    bins = pd.cut(times[valid].astype("int64"), bins=buckets, labels=False)
+    sizes = bins.value_counts()
+    # Chia đều quota; khoảng nào thiếu dòng thì phần dư không được bù sang khoảng khác
+    quotas = np.minimum(sizes, max(1, n // len(sizes)))
+    return _take_by_quota(df[valid], bins, quotas, seed)
+
+
+def finalize_sample(sample: pd.DataFrame):
+    """Bỏ cột phụ, đưa về thứ tự dòng gốc (index = số thứ tự dòng trong dataset)."""
+    if ROW_COLUMN not in sample.columns:
+        return sample.sort_index()
+    sample = sample.sort_values(ROW_COLUMN).set_index(ROW_COLUMN)
+    sample.index.name = None
+    return sample.drop(columns=[KEY_COLUMN], errors="ignore")
+
+
+def build_sample(df: pd.DataFrame, n, method="uniform", column=None, seed=SAMPLE_SEED):
+    """Dựng sample (còn cột số thứ tự dòng gốc; gọi `finalize_sample` trước khi dùng)."""
+    if method == "uniform":
+        return uniform_sample(df, n, seed=seed)
+    if method == "stratified":
+        return stratified_sample(df, column, n, seed=seed)
+    if method == "time":
+        return time_bucketed_sample(df, column, n, seed=seed)
+    raise ValueError(f"Unknown sampling method '{method}'. Choose from {SAMPLE_METHODS}.")
+
+
+def sample_caption(info):
+    """Nhãn hiển thị dưới biểu đồ/kết quả được tính trên sample."""
+    label = {"uniform": "uniform", "stratified": f"stratified by `{info.get('column')}`",
+             "time": f"time-bucketed on `{info.get('column')}`"}[info["method"]]
+    return f"🎲 Computed on a {label} sample: {info['rows']:,} of {info['total_rows']:,} rows."
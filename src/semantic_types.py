@@ -0,0 +1,107 @@
+import hashlib
+import json
+import pandas as pd
+
+from src.models.llms import gather, submit_llm_call
+from src.utils import add_cached_semantics, get_cached_semantics
+
+SEMANTIC_BATCH_SIZE = 40
+SEMANTIC_SAMPLE_VALUES = 5
+SEMANTIC_SCAN_ROWS = 200
+UNKNOWN_SEMANTIC = "Unknown"
+
+
+def column_sample_values(series: pd.Series, n=SEMANTIC_SAMPLE_VALUES):
+    """Vài giá trị khác nhau đầu tiên của cột (chỉ quét `SEMANTIC_SCAN_ROWS` dòng đầu)."""
+    values = series.head(SEMANTIC_SCAN_ROWS).dropna().astype(str).unique()[:n]
+    return [value[:50] for value in values]
+
+
+def semantic_cache_key(column_name, sample_values, model_name):
+    payload = json.dumps([str(column_name), list(sample_values), model_name], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _batch_prompt(columns):
+    lines = "\n".join(
+        f"- {json.dumps(name, ensure_ascii=False)}: sample values {json.dumps(values, ensure_ascii=False)}"
+        for name, values in columns
+    )
+    return f"""For each dataset column below, give its semantic type or meaning in 3-5 words.
+
+{lines}
+
+Return only a JSON object mapping every column name exactly as given to its semantic type, e.g. {{"cust_id": "Customer identifier"}}."""
+
+
+def _ask_batch(llm, columns, default_model):
+    """Một request cho cả batch; cột nào thiếu trong kết quả thì không có khoá trong dict trả về.
+
+    Returns:
+        tuple: (model đã trả lời, {tên cột: kiểu ngữ nghĩa})
+    """
+    try:
+        response = llm.bind(response_format={"type": "json_object"}).invoke(_batch_prompt(columns))
+        answer = json.loads(response.content)
+    except Exception as e:
+        print(f"Semantic typing batch failed: {e}")
+        return default_model, {}
+    # LLM đi qua router (`route_llm`) cho biết model nào thực sự trả lời
+    model_name = response.response_metadata.get("routed_model", default_model)
+    if not isinstance(answer, dict):
+        return model_name, {}
+    return model_name, {name: str(answer[name]).strip() for name, _ in columns if answer.get(name)}
+
+
+def guess_column_semantics(llm, model_names, df: pd.DataFrame):
+    """Kiểu ngữ nghĩa của mọi cột trong `df`, hỏi LLM theo batch và cache lâu dài.
+
+    Khoá cache là (tên cột, giá trị mẫu, model đã trả lời). Câu trả lời cache của
+    bất kỳ model nào trong `model_names` đều dùng được (model đứng trước được ưu
+    tiên). Chỉ các cột chưa có trong cache mới được gửi đi, mỗi request tối đa
+    `SEMANTIC_BATCH_SIZE` cột, các batch chạy đồng thời nên cả bảng chỉ tốn
+    khoảng một lượt gọi LLM.
+
+    Args:
+        model_names: Các model `llm` có thể dùng (vd. `model_router.models`), hoặc tên một model.
+
+    Returns:
+        dict: {tên cột: kiểu ngữ nghĩa} (`UNKNOWN_SEMANTIC` nếu LLM không trả lời được).
+    """
+    model_names = [model_names] if isinstance(model_names, str) else list(model_names)
+    samples = {col: column_sample_values(df[col]) for col in df.columns}
+    keys = {col: {model_name: semantic_cache_key(col, values, model_name) for model_name in model_names}
+            for col, values in samples.items()}
+    cached = get_cached_semantics([key for by_model in keys.values() for key in by_model.values()])
+    semantics = {}
+    for col, by_model in keys.items():
+        hit = next((cached[key] for key in by_model.values() if key in cached), None)
+        if hit is not None:
+            semantics[col] = hit
+
+    missing = [(str(col), samples[col]) for col in df.columns if col not in semantics]
+    batches = [missing[i:i + SEMANTIC_BATCH_SIZE] for i in range(0, len(missing), SEMANTIC_BATCH_SIZE)]
+    if len(batches) == 1:
+        answers = [_ask_batch(llm, batches[0], model_names[0])]
+    else:
+        answers = gather([submit_llm_call(_ask_batch, llm, batch, model_names[0]) for batch in batches])
+
+    fresh, answered_by = {}, {}
+    for result in answers:
+        if isinstance(result, Exception):
+            continue
+        model_name, answer = result
+        fresh.update(answer)
+        answered_by.update(dict.fromkeys(answer, model_name))
+    # Chỉ lưu câu trả lời hợp lệ; cột lỗi sẽ được hỏi lại ở lần sau
+    rows = []
+    for col in df.columns:
+        if str(col) in fresh:
+            model_name = answered_by[str(col)]
+            key = semantic_cache_key(col, samples[col], model_name)
+            rows.append((key, str(col), model_name, fresh[str(col)]))
+    add_cached_semantics(rows)
+    for col in df.columns:
+        if col not in semantics:
+            semantics[col] = fresh.get(str(col), UNKNOWN_SEMANTIC)
+    return semantics
@@ -0,0 +1,174 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+
+def hash_values(series: pd.Series):
+    """Hash 64-bit cho các giá trị không null của một cột (vector hoá)."""
+    return pd.util.hash_pandas_object(series.dropna(), index=False).to_numpy(dtype=np.uint64)
+
+
+def _bit_length(values: np.ndarray):
+    """Số bit của từng phần tử uint64, tách hai nửa 32-bit để float64 biểu diễn chính xác."""
+    hi = (values >> np.uint64(32)).astype(np.float64)
+    lo = (values & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    return np.where(hi > 0, 32 + np.frexp(hi)[1], np.frexp(lo)[1])
+
+
+class HyperLogLog:
+    """Sketch đếm số giá trị khác nhau xấp xỉ, gộp được giữa các chunk.
+
+    Sai số chuẩn khoảng 1.04 / sqrt(2**p) (p=12 → ~1.6%).
+    """
+
+    def __init__(self, p=12):
+        self.p = p
+        self.m = 1 << p
+        self.registers = np.zeros(self.m, dtype=np.uint8)
+
+    @property
+    def relative_error(self):
+        return 1.04 / np.sqrt(self.m)
+
+    def update_hashes(self, hashes: np.ndarray):
+        if len(hashes) == 0:
+            return
+        tail_bits = 64 - self.p
+        idx = (hashes >> np.uint64(tail_bits)).astype(np.int64)
+        tail = hashes & np.uint64((1 << tail_bits) - 1)
+        rank = (tail_bits - _bit_length(tail) + 1).astype(np.uint8)
+        np.maximum.at(self.registers, idx, rank)
+
+    def update(self, series: pd.Series):
+        self.update_hashes(hash_values(series))
+
+    def merge(self, other: "HyperLogLog"):
+        if other.p != self.p:
+            raise ValueError("Cannot merge HyperLogLog sketches with different precision.")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def estimate(self):
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        raw = alpha * self.m ** 2 / np.sum(np.exp2(-self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if raw <= 2.5 * self.m and zeros:
+            # Linear counting cho vùng giá trị nhỏ
+            return int(round(self.m * np.log(self.m / zeros)))
+        return int(round(raw))
+
+
+class KLLSketch:
+    """Sketch quantile gộp được (họ KLL): giữ các "compactor" theo tầng, tầng `h` có trọng số 2**h.
+
+    Khi một tầng đầy, nó được sort và giữ lại một nửa (xen kẽ, lệch ngẫu nhiên)
+    để đẩy lên tầng trên. Sai số hạng chuẩn hoá cho một quantile xấp xỉ
+    2.296 / k**0.9723 (k=200 → ~1.3%, độ tin cậy 99%).
+    """
+
+    def __init__(self, k=200, seed=0):
+        self.k = k
+        self.n = 0
+        self.min = np.nan
+        self.max = np.nan
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    @property
+    def rank_error(self):
+        return 2.296 / self.k ** 0.9723
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(2, int(np.ceil(self.k * (2 / 3) ** depth)))
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            if len(self.levels[level]) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(self.levels[level])
+                # Số phần tử lẻ → để lại một phần tử ở tầng hiện tại
+                leftover, items = items[:len(items) % 2], items[len(items) % 2:]
+                promoted = items[self._rng.integers(2)::2]
+                self.levels[level] = leftover
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            level += 1
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        self.n += len(values)
+        self.min = np.nanmin([self.min, values.min()])
+        self.max = np.nanmax([self.max, values.max()])
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+
+    def merge(self, other: "KLLSketch"):
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.n += other.n
+        self.min = np.nanmin([self.min, other.min])
+        self.max = np.nanmax([self.max, other.max])
+        self._compress()
+        return self
+
+    def _weighted_items(self):
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items_), 2.0 ** level) for level, items_ in enumerate(self.levels)])
+        order = np.argsort(items, kind="stable")
+        return items[order], np.cumsum(weights[order])
+
+    def quantiles(self, qs):
+        qs = np.atleast_1d(np.asarray(qs, dtype=np.float64))
+        if self.n == 0:
+            return np.full(len(qs), np.nan)
+        items, cum_weights = self._weighted_items()
+        idx = np.searchsorted(cum_weights, qs * cum_weights[-1], side="left")
+        result = items[np.minimum(idx, len(items) - 1)]
+        # Hai đầu mút luôn chính xác
+        result = np.where(qs <= 0, self.min, result)
+        return np.where(qs >= 1, self.max, result)
+
+    def rank(self, values, inclusive=True):
+        """Tỉ lệ phần tử <= (hoặc < nếu `inclusive=False`) từng giá trị trong `values`."""
+        values = np.atleast_1d(np.asarray(values, dtype=np.float64))
+        if self.n == 0:
+            return np.full(len(values), np.nan)
+        items, cum_weights = self._weighted_items()
+        idx = np.searchsorted(items, values, side="right" if inclusive else "left")
+        below = np.where(idx > 0, cum_weights[np.maximum(idx - 1, 0)], 0.0)
+        return below / cum_weights[-1]
+
+
+def dump_sketch(sketch):
+    """Serialize HyperLogLog/KLLSketch thành bytes (lưu BLOB trong SQLite)."""
+    buffer = io.BytesIO()
+    if isinstance(sketch, HyperLogLog):
+        np.savez(buffer, kind="hll", p=sketch.p, registers=sketch.registers)
+    else:
+        np.savez(buffer, kind="kll", k=sketch.k, n=sketch.n, bounds=[sketch.min, sketch.max],
+                 **{f"level_{i}": items for i, items in enumerate(sketch.levels)})
+    return buffer.getvalue()
+
+
+def load_sketch(data):
+    if data is None:
+        return None
+    with np.load(io.BytesIO(data)) as arrays:
+        if str(arrays["kind"]) == "hll":
+            sketch = HyperLogLog(p=int(arrays["p"]))
+            sketch.registers = arrays["registers"].copy()
+            return sketch
+        sketch = KLLSketch(k=int(arrays["k"]))
+        sketch.n = int(arrays["n"])
+        sketch.min, sketch.max = (float(v) for v in arrays["bounds"])
+        n_levels = sum(1 for name in arrays.files if name.startswith("level_"))
+        sketch.levels = [arrays[f"level_{i}"].copy() for i in range(n_levels)]
+        return sketch
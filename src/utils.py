@@ -1,35 +1,84 @@
-import matplotlib.pyplot as plt
+import json
 import pandas as pd
 import sqlite3
-from datetime import datetime
+from contextlib import closing
+from datetime import datetime, timedelta
 import streamlit as st
+from src.loader import (
+    CSV_FORMAT_FIELDS,
+    build_columnar_copy,
+    columnar_path_for,
+    detect_csv_format,
+    is_columnar_stale,
+    read_columnar,
+    read_csv_file,
+    read_preview,
+    remove_blob,
+    resolve_path,
+)
+from src.cache import dataframe_cache, file_identity
+from src.compaction import COMPACT_DTYPES, apply_schema, compact_dtypes
+from src.sampling import MAX_PLOT_ROWS, SAMPLE_ROWS, build_sample, finalize_sample, sample_path_for
+from src.profiling import EXACT_ROW_THRESHOLD, PROFILE_VERSION, build_dataset_profile
+from src.sketches import load_sketch
+from src.executor import ExecutionError, code_executor
+from src.cleaning import apply_plan, cleaning_stats, plan_hash
 
 DB_NAME = "db.sqlite"
 
-def execute_plt_code(code: str, df: pd.DataFrame):
-    try:
-        # local_vars = {"plt": plt, "df": df}
-        import seaborn as sns
-        local_vars = {"plt": plt, "df": df, "sns": sns}
+def execute_plt_code(code: str, df: pd.DataFrame, frame_key=None):
+    """Chạy code vẽ do LLM sinh trong worker riêng (xem `src.executor`), trả về ảnh PNG hoặc None.
 
-        compiled_code = compile(code, "<string>", "exec")
-        exec(compiled_code, globals(), local_vars)
-        return plt.gcf()
-    except Exception as e:
+    `frame_key`: khoá trả về từ `code_executor.preload(df)` nếu frame đã được nạp sẵn.
+    """
+    try:
+        return code_executor.run(code, df, frame_key=frame_key)
+    except ExecutionError as e:
         st.error(f"Error executing plt code: {e}")
         return None
 
-def safe_read_csv(file_path):
-    for enc in ['utf-8', 'ISO-8859-1', 'utf-16', 'cp1252']:
-        try:
-            return pd.read_csv(file_path, encoding=enc)
-        except UnicodeDecodeError:
-            continue
-    raise UnicodeDecodeError("utf-8", b"", 0, 1, "Unable to decode file with common encodings.")
+def render_agent_stream(events):
+    """Hiển thị câu trả lời của agent trong khung chat hiện tại khi token/bước tới.
+
+    Args:
+        events: Sự kiện từ `src.models.llms.stream_agent`.
+
+    Returns:
+        dict: Kết quả cuối của agent (`output`, `intermediate_steps`).
+    """
+    steps = st.status("🔧 Analyzing...", expanded=False)
+    placeholder = st.empty()
+    text, n_steps = "", 0
+    # Đóng generator ngay cả khi script bị dừng giữa chừng: agent phải dừng hẳn trước khi về pool
+    with closing(events):
+        for kind, value in events:
+            if kind == "token":
+                text += value
+                placeholder.markdown(text + "▌")
+            elif kind == "action":
+                # Token trước một bước gọi tool chỉ là phần dẫn → thay bằng code đang chạy
+                n_steps += 1
+                text = ""
+                placeholder.empty()
+                steps.code(value, language="python")
+            elif kind == "result":
+                placeholder.markdown(value["output"])
+                steps.update(label=f"🔧 {n_steps} analysis step(s)", state="complete")
+                return value
+
+def safe_read_csv(file_path, csv_format=None):
+    return read_csv_file(resolve_path(file_path), csv_format=csv_format)
 
 def get_connection():
     return sqlite3.connect(DB_NAME)
 
+def _add_missing_columns(c, table, columns):
+    """Thêm các cột mới vào bảng đã tồn tại (DB cũ được tạo trước khi có cột đó)."""
+    existing = {row[1] for row in c.execute(f"PRAGMA table_info({table})")}
+    for name, col_type in columns.items():
+        if name not in existing:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN {name} {col_type}")
+
 def init_db():
     conn = get_connection()
     c = conn.cursor()
@@ -41,7 +90,73 @@ def init_db():
             num_rows INTEGER,
             num_cols INTEGER,
             upload_time TEXT,
-            status TEXT
+            status TEXT,
+            columnar_path TEXT,
+            encoding TEXT,
+            delimiter TEXT,
+            quotechar TEXT,
+            header_row INTEGER,
+            decimal_sep TEXT,
+            dtype_schema TEXT,
+            compact_bytes_saved INTEGER,
+            content_hash TEXT
+        )''')
+    _add_missing_columns(c, "datasets", {
+        "columnar_path": "TEXT",
+        "encoding": "TEXT",
+        "delimiter": "TEXT",
+        "quotechar": "TEXT",
+        "header_row": "INTEGER",
+        "decimal_sep": "TEXT",
+        "dtype_schema": "TEXT",
+        "compact_bytes_saved": "INTEGER",
+        "content_hash": "TEXT",
+    })
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS dataset_column_stats (
+            dataset_id INTEGER,
+            position INTEGER,
+            name TEXT,
+            dtype TEXT,
+            null_count INTEGER,
+            min_value REAL,
+            max_value REAL,
+            approx_distinct INTEGER,
+            hll_sketch BLOB,
+            quantile_sketch BLOB,
+            PRIMARY KEY (dataset_id, position),
+            FOREIGN KEY (dataset_id) REFERENCES datasets(id)
+        )''')
+    _add_missing_columns(c, "dataset_column_stats", {
+        "hll_sketch": "BLOB",
+        "quantile_sketch": "BLOB",
+    })
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS dataset_profiles (
+            content_hash TEXT,
+            profiler_version INTEGER,
+            profile TEXT,
+            created_at TEXT,
+            PRIMARY KEY (content_hash, profiler_version)
+        )''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS column_semantics (
+            cache_key TEXT PRIMARY KEY,
+            column_name TEXT,
+            model TEXT,
+            semantic TEXT,
+            created_at TEXT
+        )''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS llm_responses (
+            cache_key TEXT PRIMARY KEY,
+            model TEXT,
+            prompt_version TEXT,
+            response TEXT,
+            size INTEGER,
+            hits INTEGER DEFAULT 0,
+            created_at TEXT,
+            last_used_at TEXT
         )''')
     c.execute('''
         CREATE TABLE IF NOT EXISTS chat_history (
@@ -81,14 +196,21 @@ def init_db():
     conn.commit()
     conn.close()
 
-def add_dataset(name, path, num_rows, num_cols, upload_time, status="Uploaded"):
+def add_dataset(name, path, num_rows, num_cols, upload_time, status="Uploaded", columnar_path=None,
+                csv_format=None, content_hash=None):
+    csv_format = csv_format or {}
     conn = get_connection()
     c = conn.cursor()
     c.execute('''
-        INSERT INTO datasets (name, path, num_rows, num_cols, upload_time, status)
-        VALUES (?, ?, ?, ?, ?, ?)''', (name, path, num_rows, num_cols, upload_time, status))
+        INSERT INTO datasets (name, path, num_rows, num_cols, upload_time, status, columnar_path,
+                              content_hash, encoding, delimiter, quotechar, header_row, decimal_sep)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+        (name, path, num_rows, num_cols, upload_time, status, columnar_path, content_hash)
+        + tuple(csv_format.get(field) for field in CSV_FORMAT_FIELDS))
     conn.commit()
+    dataset_id = c.lastrowid
     conn.close()
+    return dataset_id
 
 def get_all_datasets():
     conn = get_connection()
@@ -98,6 +220,48 @@ def get_all_datasets():
     conn.close()
     return rows
 
+def find_dataset_by_hash(content_hash):
+    """Dataset đầu tiên trỏ tới cùng blob nội dung, hoặc None."""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('SELECT id FROM datasets WHERE content_hash = ? ORDER BY id LIMIT 1', (content_hash,))
+    row = c.fetchone()
+    conn.close()
+    return row[0] if row else None
+
+def get_dataset_key(dataset_id):
+    """Khoá nhận diện nội dung dataset (hash nội dung, hoặc file + kích thước + mtime với dataset cũ)."""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('SELECT path, content_hash FROM datasets WHERE id = ?', (dataset_id,))
+    row = c.fetchone()
+    conn.close()
+    if row is None:
+        raise ValueError(f"Dataset {dataset_id} not found.")
+    return _profile_key(resolve_path(row[0]), row[1])
+
+def get_datasets_page(limit, offset=0):
+    """Một trang danh sách dataset, cùng cột và thứ tự với `get_all_datasets`."""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('''
+        SELECT id, name, num_rows, num_cols, upload_time, status
+        FROM datasets
+        ORDER BY id
+        LIMIT ? OFFSET ?''', (limit, offset))
+    rows = c.fetchall()
+    conn.close()
+    return rows
+
+def get_dataset_summary():
+    """(số dataset, tổng số dòng, tổng số cột) tính bằng SQL, không cần đọc danh sách."""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('SELECT COUNT(*), COALESCE(SUM(num_rows), 0), COALESCE(SUM(num_cols), 0) FROM datasets')
+    row = c.fetchone()
+    conn.close()
+    return row
+
 def get_dataset(id):
     conn = get_connection()
     c = conn.cursor()
@@ -106,6 +270,404 @@ def get_dataset(id):
     conn.close()
     return row
 
+def set_dataset_columnar_path(dataset_id, columnar_path):
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('''
+        UPDATE datasets
+        SET columnar_path = ?
+        WHERE id = ?
+    ''', (columnar_path, dataset_id))
+    conn.commit()
+    conn.close()
+
+def add_column_stats(dataset_id, columns):
+    """Lưu thống kê theo cột tính lúc upload (xem `src.ingest.StatsAccumulator`)."""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('DELETE FROM dataset_column_stats WHERE dataset_id = ?', (dataset_id,))
+    c.executemany('''
+        INSERT INTO dataset_column_stats (dataset_id, position, name, dtype, null_count, min_value, max_value,
+                                          approx_distinct, hll_sketch, quantile_sketch)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', [
+            (dataset_id, i, col['name'], col['dtype'], col['null_count'], col['min'], col['max'], col['approx_distinct'],
+             col.get('hll_sketch'), col.get('quantile_sketch'))
+            for i, col in enumerate(columns)
+        ])
+    conn.commit()
+    conn.close()
+
+def get_column_stats(dataset_id):
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('''
+        SELECT name, dtype, null_count, min_value, max_value, approx_distinct
+        FROM dataset_column_stats
+        WHERE dataset_id = ?
+        ORDER BY position''', (dataset_id,))
+    rows = c.fetchall()
+    conn.close()
+    return rows
+
+def get_column_sketches(dataset_id):
+    """Sketch HyperLogLog/KLL lưu lúc upload: {tên cột: {'hll': ..., 'kll': ...}} (rỗng với dataset cũ)."""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('''
+        SELECT name, hll_sketch, quantile_sketch
+        FROM dataset_column_stats
+        WHERE dataset_id = ? AND hll_sketch IS NOT NULL''', (dataset_id,))
+    rows = c.fetchall()
+    conn.close()
+    return {name: {'hll': load_sketch(hll), 'kll': load_sketch(kll)} for name, hll, kll in rows}
+
+def get_approx_distinct(dataset_id):
+    """Số giá trị khác nhau ước lượng (HLL) theo cột, chỉ với dataset lớn hơn `EXACT_ROW_THRESHOLD` dòng.
+
+    Dataset nhỏ trả về {} để nơi gọi đếm chính xác (xem `src.profiling.distinct_count`).
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('''
+        SELECT s.name, s.approx_distinct
+        FROM dataset_column_stats s JOIN datasets d ON d.id = s.dataset_id
+        WHERE s.dataset_id = ? AND d.num_rows > ? AND s.approx_distinct IS NOT NULL''',
+              (dataset_id, EXACT_ROW_THRESHOLD))
+    rows = c.fetchall()
+    conn.close()
+    return dict(rows)
+
+def _profile_key(csv_path, content_hash):
+    """Khoá của profile: hash nội dung; dataset cũ chưa có hash dùng đường dẫn + kích thước + mtime."""
+    if content_hash:
+        return content_hash
+    path, size, mtime_ns = file_identity(csv_path)
+    return f"file:{path}:{size}:{mtime_ns}"
+
+def _json_default(value):
+    # Số numpy (np.int64, ...) và Timestamp trong describe()
+    return value.item() if hasattr(value, "item") else str(value)
+
+def get_dataset_profile(content_hash, version=PROFILE_VERSION):
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('SELECT profile FROM dataset_profiles WHERE content_hash = ? AND profiler_version = ?',
+              (content_hash, version))
+    row = c.fetchone()
+    conn.close()
+    return json.loads(row[0]) if row else None
+
+def set_dataset_profile(content_hash, profile, version=PROFILE_VERSION):
+    created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('''
+        INSERT OR REPLACE INTO dataset_profiles (content_hash, profiler_version, profile, created_at)
+        VALUES (?, ?, ?, ?)''', (content_hash, version, json.dumps(profile, default=_json_default), created_at))
+    # Profile của phiên bản profiler cũ không còn được đọc nữa
+    c.execute('DELETE FROM dataset_profiles WHERE content_hash = ? AND profiler_version != ?', (content_hash, version))
+    conn.commit()
+    conn.close()
+
+def load_profile(dataset_id):
+    """Profile của dataset (xem `src.profiling.build_dataset_profile`), đọc từ `dataset_profiles` trước.
+
+    Chỉ tính lại khi chưa có profile cho hash nội dung hiện tại và `PROFILE_VERSION`;
+    dataset trùng nội dung dùng chung một profile.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('SELECT path, content_hash FROM datasets WHERE id = ?', (dataset_id,))
+    row = c.fetchone()
+    conn.close()
+    if row is None:
+        raise ValueError(f"Dataset {dataset_id} not found.")
+
+    csv_path = resolve_path(row[0])
+    key = _profile_key(csv_path, row[1])
+    profile = get_dataset_profile(key)
+    if profile is None:
+        df = load_dataset(dataset_id)
+        sketches = get_column_sketches(dataset_id) if len(df) > EXACT_ROW_THRESHOLD else None
+        # load_dataset vừa đảm bảo bản Parquet còn mới → worker profile đọc thẳng từ đó
+        conn = get_connection()
+        c = conn.cursor()
+        c.execute('SELECT columnar_path FROM datasets WHERE id = ?', (dataset_id,))
+        columnar_path = c.fetchone()[0]
+        conn.close()
+        columnar_path = resolve_path(columnar_path) if columnar_path else None
+        if is_columnar_stale(csv_path, columnar_path):
+            columnar_path = None
+        schema, _ = get_dataset_schema(dataset_id) if COMPACT_DTYPES else (None, None)
+        profile = build_dataset_profile(df, sketches, columnar_path=columnar_path, schema=schema)
+        set_dataset_profile(key, profile)
+    return profile
+
+def get_cached_semantics(cache_keys):
+    """Kiểu ngữ nghĩa đã cache (xem `src.semantic_types`): {cache_key: semantic}."""
+    if not cache_keys:
+        return {}
+    conn = get_connection()
+    c = conn.cursor()
+    result = {}
+    # SQLite giới hạn số tham số trong một câu lệnh
+    for i in range(0, len(cache_keys), 500):
+        chunk = cache_keys[i:i + 500]
+        c.execute(f'SELECT cache_key, semantic FROM column_semantics WHERE cache_key IN ({", ".join("?" * len(chunk))})',
+                  chunk)
+        result.update(c.fetchall())
+    conn.close()
+    return result
+
+def add_cached_semantics(rows):
+    """Lưu các bộ (cache_key, column_name, model, semantic)."""
+    if not rows:
+        return
+    created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    conn = get_connection()
+    c = conn.cursor()
+    c.executemany('''
+        INSERT OR REPLACE INTO column_semantics (cache_key, column_name, model, semantic, created_at)
+        VALUES (?, ?, ?, ?, ?)''', [row + (created_at,) for row in rows])
+    conn.commit()
+    conn.close()
+
+def _timestamp(seconds_ago=0):
+    return (datetime.now() - timedelta(seconds=seconds_ago)).strftime("%Y-%m-%d %H:%M:%S")
+
+def get_cached_response(cache_key, ttl_seconds):
+    """Câu trả lời LLM đã lưu nếu còn hạn (tạo trong vòng `ttl_seconds`), không thì None."""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('SELECT response FROM llm_responses WHERE cache_key = ? AND created_at >= ?',
+              (cache_key, _timestamp(ttl_seconds)))
+    row = c.fetchone()
+    if row is not None:
+        c.execute('UPDATE llm_responses SET hits = hits + 1, last_used_at = ? WHERE cache_key = ?',
+                  (_timestamp(), cache_key))
+        conn.commit()
+    conn.close()
+    return row[0] if row else None
+
+def add_cached_response(cache_key, model, prompt_version, response, ttl_seconds, max_bytes):
+    """Lưu một câu trả lời, bỏ các entry hết hạn rồi bỏ entry ít dùng gần đây nhất cho tới khi vừa `max_bytes`."""
+    now = _timestamp()
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('''
+        INSERT OR REPLACE INTO llm_responses (cache_key, model, prompt_version, response, size, hits, created_at, last_used_at)
+        VALUES (?, ?, ?, ?, ?, 0, ?, ?)''',
+        (cache_key, model, str(prompt_version), response, len(response.encode("utf-8")), now, now))
+    c.execute('DELETE FROM llm_responses WHERE created_at < ?', (_timestamp(ttl_seconds),))
+    c.execute('''
+        DELETE FROM llm_responses WHERE cache_key IN (
+            SELECT cache_key FROM (
+                SELECT cache_key, SUM(size) OVER (ORDER BY last_used_at DESC, created_at DESC) AS running
+                FROM llm_responses
+            ) WHERE running > ?
+        )''', (max_bytes,))
+    conn.commit()
+    conn.close()
+
+def get_llm_cache_usage():
+    """Số entry, tổng byte và tổng lượt hit đã lưu của cache câu trả lời LLM."""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(hits), 0) FROM llm_responses')
+    entries, size, hits = c.fetchone()
+    conn.close()
+    return {"entries": entries, "bytes": size, "stored_hits": hits}
+
+def clear_llm_cache():
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('DELETE FROM llm_responses')
+    conn.commit()
+    conn.close()
+
+def load_cleaned(dataset_id, operations):
+    """Áp kế hoạch làm sạch dạng bước có kiểu (xem `src.cleaning`) lên dataset.
+
+    Kết quả được cache theo (hash nội dung, hash kế hoạch); từng cột đã làm sạch
+    cũng được cache theo chuỗi bước của nó, nên khi sửa kế hoạch chỉ các cột có
+    bước thay đổi mới được tính lại. Median/IQR/min/max lấy từ profile đã lưu.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('SELECT path, content_hash FROM datasets WHERE id = ?', (dataset_id,))
+    row = c.fetchone()
+    conn.close()
+    if row is None:
+        raise ValueError(f"Dataset {dataset_id} not found.")
+    csv_path = resolve_path(row[0])
+    identity = file_identity(csv_path)
+    content_key = _profile_key(csv_path, row[1])
+
+    def column_cache(col, ops_key, compute):
+        key = (identity, ("cleaned-column", content_key, col, ops_key))
+        return dataframe_cache.get_or_load(key, lambda: compute().to_frame(name=col))[col]
+
+    def load():
+        stats = cleaning_stats(load_profile(dataset_id))
+        return apply_plan(load_dataset(dataset_id), operations, stats, column_cache)
+
+    return dataframe_cache.get_or_load((identity, ("cleaned", content_key, plan_hash(operations))), load)
+
+def get_dataset_csv_format(dataset_id):
+    """Định dạng CSV đã dò lúc upload, hoặc None với dataset cũ chưa được dò."""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(f'SELECT {", ".join(CSV_FORMAT_FIELDS)} FROM datasets WHERE id = ?', (dataset_id,))
+    row = c.fetchone()
+    conn.close()
+    if row is None or row[0] is None:
+        return None
+    return dict(zip(CSV_FORMAT_FIELDS, row))
+
+def set_dataset_csv_format(dataset_id, csv_format):
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(f'''
+        UPDATE datasets
+        SET {", ".join(f"{field} = ?" for field in CSV_FORMAT_FIELDS)}
+        WHERE id = ?
+    ''', tuple(csv_format[field] for field in CSV_FORMAT_FIELDS) + (dataset_id,))
+    conn.commit()
+    conn.close()
+
+def get_dataset_schema(dataset_id):
+    """Schema thu gọn kiểu dữ liệu đã lưu (xem `src.compaction`), hoặc None nếu chưa có."""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('SELECT dtype_schema, compact_bytes_saved FROM datasets WHERE id = ?', (dataset_id,))
+    row = c.fetchone()
+    conn.close()
+    if row is None or row[0] is None:
+        return None, None
+    return json.loads(row[0]), row[1]
+
+def set_dataset_schema(dataset_id, schema, bytes_saved):
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('''
+        UPDATE datasets
+        SET dtype_schema = ?, compact_bytes_saved = ?
+        WHERE id = ?
+    ''', (json.dumps(schema), bytes_saved, dataset_id))
+    conn.commit()
+    conn.close()
+
+def load_dataset(dataset_id, columns=None):
+    """Đọc dataset từ bản sao Parquet; CSV vẫn là nguồn gốc.
+
+    Bản sao được build lại (và ghi lại vào DB) nếu chưa có hoặc cũ hơn CSV.
+    `columns` cho phép chỉ đọc một số cột. Kết quả đi qua `dataframe_cache`
+    dùng chung giữa các phiên, nên frame trả về là read-only.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('SELECT path, columnar_path FROM datasets WHERE id = ?', (dataset_id,))
+    row = c.fetchone()
+    conn.close()
+    if row is None:
+        raise ValueError(f"Dataset {dataset_id} not found.")
+
+    csv_path = resolve_path(row[0])
+    key = (file_identity(csv_path), tuple(columns) if columns is not None else None)
+    return dataframe_cache.get_or_load(key, lambda: _read_dataset(dataset_id, csv_path, row[1], columns))
+
+def _read_dataset(dataset_id, csv_path, stored_columnar_path, columns=None):
+    columnar_path = resolve_path(stored_columnar_path) if stored_columnar_path else columnar_path_for(csv_path)
+    if not is_columnar_stale(csv_path, columnar_path):
+        df = read_columnar(columnar_path, columns=columns)
+    else:
+        csv_format = get_dataset_csv_format(dataset_id)
+        if csv_format is None:
+            csv_format = detect_csv_format(csv_path)
+            set_dataset_csv_format(dataset_id, csv_format)
+        df = safe_read_csv(csv_path, csv_format=csv_format)
+        columnar_path = build_columnar_copy(df, columnar_path)
+        if columnar_path != stored_columnar_path:
+            set_dataset_columnar_path(dataset_id, columnar_path)
+        if columns is not None:
+            df = df[columns]
+
+    if not COMPACT_DTYPES:
+        return df
+    schema, _ = get_dataset_schema(dataset_id)
+    if schema is not None:
+        return apply_schema(df, schema)
+    if columns is not None:
+        return df  # chỉ suy schema trên toàn bộ cột
+    df, schema, bytes_saved = compact_dtypes(df)
+    set_dataset_schema(dataset_id, schema, bytes_saved)
+    if columnar_path and schema:
+        # Ghi lại bản Parquet với kiểu đã thu gọn để lần sau đọc ra đúng kiểu luôn
+        build_columnar_copy(df, columnar_path)
+    return df
+
+def load_sample(dataset_id, max_rows=MAX_PLOT_ROWS, method="uniform", column=None):
+    """Trả về tối đa `max_rows` dòng của dataset cho biểu đồ / prompt.
+
+    Dataset nhỏ hơn `max_rows` được trả nguyên vẹn. Sample dựng xong được lưu
+    cạnh blob CSV nên lần sau (và các phiên khác) đọc lại cùng một sample.
+
+    Returns:
+        tuple: (DataFrame, info) với info gồm sampled, method, column, rows, total_rows
+            (dùng `src.sampling.sample_caption(info)` để gắn nhãn trên UI).
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('SELECT path, num_rows FROM datasets WHERE id = ?', (dataset_id,))
+    row = c.fetchone()
+    conn.close()
+    if row is None:
+        raise ValueError(f"Dataset {dataset_id} not found.")
+    csv_path, total_rows = resolve_path(row[0]), row[1]
+    info = {"sampled": False, "method": method, "column": column, "rows": total_rows, "total_rows": total_rows}
+    if total_rows is not None and total_rows <= max_rows:
+        return load_dataset(dataset_id), info
+
+    if method == "uniform" and max_rows <= SAMPLE_ROWS:
+        # Sample đều dựng sẵn lúc upload đã sắp theo khoá → head(max_rows) vẫn là sample đều
+        path, n = sample_path_for(csv_path), None
+    else:
+        path, n = sample_path_for(csv_path, method, column, max_rows), max_rows
+
+    def load():
+        sample = None
+        if not is_columnar_stale(csv_path, path):
+            sample = read_columnar(path)
+            # Sample dựng sẵn của dataset cũ có thể nhỏ hơn `SAMPLE_ROWS` hiện tại → dựng lại
+            if n is None and total_rows is not None and len(sample) < min(max_rows, total_rows):
+                sample = None
+        if sample is None:
+            sample = build_sample(load_dataset(dataset_id), n or SAMPLE_ROWS, method=method, column=column)
+            build_columnar_copy(sample, path)
+        if n is None:
+            sample = sample.head(max_rows)
+        sample = finalize_sample(sample)
+        schema, _ = get_dataset_schema(dataset_id)
+        return apply_schema(sample, schema) if schema else sample
+
+    key = (file_identity(csv_path), ("sample", method, column, max_rows))
+    sample = dataframe_cache.get_or_load(key, load)
+    info.update(sampled=True, rows=len(sample))
+    return sample, info
+
+def load_preview(dataset_id, n=5):
+    """Chỉ đọc `n` dòng đầu của dataset, không load cả file."""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('SELECT path, columnar_path FROM datasets WHERE id = ?', (dataset_id,))
+    row = c.fetchone()
+    conn.close()
+    if row is None:
+        raise ValueError(f"Dataset {dataset_id} not found.")
+    csv_path = resolve_path(row[0])
+    columnar_path = resolve_path(row[1]) if row[1] else None
+    return read_preview(csv_path, columnar_path, get_dataset_csv_format(dataset_id), n=n)
+
 def add_chat(dataset_id, question, answer):
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     conn = get_connection()
@@ -229,18 +791,36 @@ def rename_chat_session(session_id, new_title):
 def delete_dataset(dataset_id):
     conn = get_connection()
     c = conn.cursor()
-    
+
+    c.execute('SELECT path, content_hash FROM datasets WHERE id = ?', (dataset_id,))
+    row = c.fetchone()
+
     # Xoá liên quan (nếu cần)
     c.execute('DELETE FROM chat_messages WHERE session_id IN (SELECT id FROM chat_sessions WHERE dataset_id = ?)', (dataset_id,))
     c.execute('DELETE FROM chat_sessions WHERE dataset_id = ?', (dataset_id,))
     c.execute('DELETE FROM chart_cards WHERE dataset_id = ?', (dataset_id,))
+    c.execute('DELETE FROM dataset_column_stats WHERE dataset_id = ?', (dataset_id,))
 
     # Xoá chính dataset
     c.execute('DELETE FROM datasets WHERE id = ?', (dataset_id,))
-    
+
+    # Blob theo hash nội dung chỉ bị xoá khi không còn dataset nào trỏ tới
+    blob_orphaned = False
+    if row is not None and row[1] is not None:
+        c.execute('SELECT COUNT(*) FROM datasets WHERE content_hash = ?', (row[1],))
+        blob_orphaned = c.fetchone()[0] == 0
+    if blob_orphaned:
+        c.execute('DELETE FROM dataset_profiles WHERE content_hash = ?', (row[1],))
+    elif row is not None and row[1] is None and os.path.exists(resolve_path(row[0])):
+        c.execute('DELETE FROM dataset_profiles WHERE content_hash = ?', (_profile_key(resolve_path(row[0]), None),))
+
     conn.commit()
     conn.close()
 
+    if blob_orphaned:
+        dataframe_cache.invalidate(resolve_path(row[0]))
+        remove_blob(row[0])
+
 def rename_dataset(dataset_id, new_name):
     conn = get_connection()
     c = conn.cursor()
@@ -265,11 +845,8 @@ def delete_chart_card(dataset_id: int, question: str, created_at: str):
 
 # ---------------------------- Hàm Export ---------------------------- 
 import os
-import shutil
 import base64
 import pdfkit
-import matplotlib.pyplot as plt
-import seaborn as sns
 from uuid import uuid4
 
 pdfkit_config = pdfkit.configuration(
@@ -307,12 +884,9 @@ def image_to_base64(path):
     with open(path, "rb") as img_f:
         return base64.b64encode(img_f.read()).decode("utf-8")
 
-def export_eda_report_to_pdf(eda_sections, df, summary_response, dataset_name):
+def export_eda_report_to_pdf(eda_sections, df, summary_response, dataset_name, frame_key=None):
     """Tạo file PDF báo cáo EDA hoàn chỉnh và trả về dạng bytes để tải xuống."""
 
-    img_dir = "temp_images"
-    os.makedirs(img_dir, exist_ok=True)
-
     # --- Load icons ---
     icon_dir = "assets/icon"
     icon_intro = image_to_base64(os.path.join(icon_dir, "book.png"))
@@ -324,13 +898,11 @@ def export_eda_report_to_pdf(eda_sections, df, summary_response, dataset_name):
     # --- Render Univariate Charts ---
     univariate_html = ""
     for idx, block in enumerate(eda_sections.get("univariate", [])):
-        img_path = os.path.join(img_dir, f"univar_{idx}.png")
         try:
-            exec(block['code'], {"df": df, "plt": plt, "sns": sns})
-            plt.savefig(img_path)
-            plt.clf()
-            with open(img_path, "rb") as img_f:
-                img_base64 = base64.b64encode(img_f.read()).decode("utf-8")
+            image = code_executor.run(block['code'], df, frame_key=frame_key)
+            if image is None:
+                raise ExecutionError("code did not draw a chart")
+            img_base64 = base64.b64encode(image).decode("utf-8")
             chart_img = f'<img src="data:image/png;base64,{img_base64}" style="width:600px;">'
         except Exception as e:
             chart_img = f"<p><em>Chart error: {e}</em></p>"
@@ -344,13 +916,11 @@ def export_eda_report_to_pdf(eda_sections, df, summary_response, dataset_name):
         """
 
     # --- Correlation Heatmap ---
-    cor_img_path = os.path.join(img_dir, "correlation.png")
     try:
-        exec(eda_sections['correlation']['code'], {"df": df, "plt": plt, "sns": sns})
-        plt.savefig(cor_img_path)
-        plt.clf()
-        with open(cor_img_path, "rb") as img_f:
-            cor_base64 = base64.b64encode(img_f.read()).decode("utf-8")
+        image = code_executor.run(eda_sections['correlation']['code'], df, frame_key=frame_key)
+        if image is None:
+            raise ExecutionError("code did not draw a chart")
+        cor_base64 = base64.b64encode(image).decode("utf-8")
         cor_html = f"""
         <pre><code>{eda_sections['correlation']['code']}</code></pre>
         <img src="data:image/png;base64,{cor_base64}" style="width:600px;">
@@ -418,7 +988,6 @@ def export_eda_report_to_pdf(eda_sections, df, summary_response, dataset_name):
 
     # --- Cleanup ---
     try:
-        shutil.rmtree(img_dir)
         os.remove(html_file)
         os.remove(pdf_file)
     except Exception: